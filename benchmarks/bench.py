@@ -0,0 +1,337 @@
+"""Micro-benchmarks of the simulation code that runs without Blender.
+
+    python benchmarks/bench.py                          time every case
+    python benchmarks/bench.py --save before.json       record the results as a baseline
+    python benchmarks/bench.py --compare before.json    compare against a recorded baseline
+    python benchmarks/bench.py --filter imu             only the cases whose name contains "imu"
+
+Every case is called until a run takes at least --min-time, the fastest of --repeat runs
+gives the time per call. With --compare, cases slower than their baseline by more than
+--threshold are reported as regressions and make the exit code 1. Times depend on the
+machine, so baselines are not kept in the repository: record one on the machine before
+changing code and compare there.
+"""
+import argparse
+import itertools
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from output.chunked_store import ChunkedWriter
+from output.codec import LidarCodec
+from output.records import lidar_point_dtype, lidar_points
+from sensor.models.imu.kinematics import imu_measurements
+from sensor.models.imu.noise import add_imu_noise
+from sensor.models.lidar.beams import compile_beams
+from sensor.models.lidar.intensity import IntensityTable
+from sensor.models.lidar.raycast import TriangleBVH
+from sensor.pose import interpolate_poses, matrix_quaternions, quaternion_matrices
+from sensor.registry import NOISE_PARAMETERS, lidar_models, scan_functions
+
+THRESHOLD = 0.2
+REPEAT = 5
+MIN_TIME = 0.05
+
+# case name -> function building the callable to time
+CASES = {}
+
+
+def case(name, sizes=(None,)):
+    """Registers a case builder once per problem size as `<name>/<size>`."""
+    def register(build):
+        for size in sizes:
+            CASES[name if size is None else f"{name}/{size}"] = (build, size)
+        return build
+    return register
+
+
+def model_parameters(model, **overrides):
+    parameters = lidar_models()[model]["parameters"]
+    return {**{name: info["default"] for name, info in parameters.items()}, **overrides}
+
+
+def random_poses(rng, count):
+    """(count, 4, 4) world matrices with random rotations and translations."""
+    quaternions = rng.standard_normal((count, 4))
+    quaternions /= np.linalg.norm(quaternions, axis=1, keepdims=True)
+    matrices = np.tile(np.eye(4), (count, 1, 1))
+    matrices[:, :3, :3] = quaternion_matrices(quaternions)
+    matrices[:, :3, 3] = rng.uniform(-10, 10, (count, 3))
+    return matrices
+
+
+def unit_vectors(rng, count):
+    vectors = rng.standard_normal((count, 3))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def pattern_case(model, **overrides):
+    parameters = model_parameters(model, **overrides)
+    scan_model = scan_functions(model)
+    frames = itertools.count()
+
+    def run():
+        frame = next(frames)
+        directions = scan_model.pattern(frame, parameters)
+        scan_model.firing(frame, parameters, len(directions))
+        scan_model.fields(frame, parameters)
+    return run
+
+
+for model in lidar_models():
+    case(f"pattern/{model}")(lambda size, model=model: pattern_case(model))
+
+
+for model, description in lidar_models().items():
+    if "beams" in description:
+        case(f"beams/{model}")(lambda size, beams=description["beams"]: lambda: compile_beams(beams))
+
+
+@case("pattern/livox_mid40/density", sizes=(100, 1000, 10000))
+def livox_density(size):
+    return pattern_case("livox_mid40", density=size)
+
+
+@case("transform", sizes=(1000, 10000, 100000))
+def transform(size):
+    # per ray pose interpolation and rotation into the world, as in a motion distorted sweep
+    rng = np.random.default_rng(0)
+    start, end = random_poses(rng, 2)
+    weights = np.linspace(0.0, 1.0, size)
+    directions = unit_vectors(rng, size)
+
+    def run():
+        rotations, origins = interpolate_poses(start, end, weights)
+        np.einsum("nij,nj->ni", rotations, directions)
+        matrix_quaternions(rotations[:1])
+    return run
+
+
+@case("intensity", sizes=(1000, 10000, 100000))
+def intensity(size):
+    rng = np.random.default_rng(0)
+    table = IntensityTable([rng.uniform(0, 1, rng.integers(0, 5)) for _ in range(500)])
+    object_ids = rng.integers(0, 500, size)
+    material_indices = rng.integers(0, 6, size)
+    return lambda: table.lookup(object_ids, material_indices)
+
+
+@case("records", sizes=(1000, 10000, 100000))
+def records(size):
+    rng = np.random.default_rng(0)
+    locations = rng.uniform(-50, 50, (size, 3)).astype(np.float32)
+    intensities = rng.uniform(0, 1, size).astype(np.float32)
+    times = np.linspace(-0.1, 0.0, size, dtype=np.float32)
+    dtype = lidar_point_dtype("time")
+    return lambda: lidar_points(locations, intensities, dtype=dtype, time=times)
+
+
+class StoreCase:
+    """Appends frames to a chunked store in a temporary folder that is emptied every
+    `max_bytes`, so long runs do not fill the disk."""
+
+    def __init__(self, size, max_bytes=1 << 26):
+        rng = np.random.default_rng(0)
+        self.records = lidar_points(rng.uniform(-50, 50, (size, 3)), rng.uniform(0, 1, size),
+                                    time=np.zeros(size))
+        self.max_bytes = max_bytes
+        self.folder = Path(tempfile.mkdtemp(prefix="otia-bench-"))
+        self.writer = ChunkedWriter(self.folder / "store", self.records.dtype)
+        self.frames = itertools.count()
+
+    def __call__(self):
+        if self.writer.offset > self.max_bytes:
+            self.close()
+            self.writer = ChunkedWriter(self.folder / "store", self.records.dtype)
+        self.writer.append(next(self.frames), self.records)
+
+    def close(self):
+        self.writer.close()
+        shutil.rmtree(self.folder / "store")
+
+
+@case("store", sizes=(1000, 10000, 100000))
+def store(size):
+    return StoreCase(size)
+
+
+def scan_records():
+    # one HDL-64E sweep over a gently waved ground plane, the points of a real scan in firing order
+    pattern = scan_functions("velodyne_hdl64")
+    parameters = model_parameters("velodyne_hdl64")
+    directions = pattern.pattern(0, parameters)
+    ground = directions[:, 2] < -0.02
+    distances = 1.8 / -directions[ground, 2] * (1 + 0.01 * np.sin(np.arange(ground.sum()) / 50))
+    fields = {name: values[ground] for name, values in pattern.fields(0, parameters).items()}
+    times = (pattern.firing(0, parameters, len(directions))[ground] - 1.0) * 0.1
+    return lidar_points(directions[ground] * distances[:, None], np.full(ground.sum(), 100.0), time=times, **fields)
+
+
+CODECS = {"lossless": LidarCodec(), "quantized": LidarCodec(quantization=0.001)}
+
+
+@case("codec/encode", sizes=tuple(CODECS))
+def codec_encode(size):
+    records = scan_records()
+    return lambda: CODECS[size].encode(records)
+
+
+@case("codec/decode", sizes=tuple(CODECS))
+def codec_decode(size):
+    records = scan_records()
+    payload = CODECS[size].encode(records)
+    return lambda: CODECS[size].decode(payload, records.dtype, len(records))
+
+
+def imu_trajectory(size):
+    # a body on a wobbling circle sampled at 100 Hz, read out at 200 Hz
+    times = np.arange(size) / 100.0
+    positions = np.column_stack((np.cos(times), np.sin(times), 0.1 * np.sin(3 * times)))
+    half_angles = 0.5 * times
+    quaternions = np.column_stack((np.cos(half_angles), np.zeros(size), np.zeros(size), np.sin(half_angles)))
+    sample_times = np.arange(2 * size - 1) / 200.0
+    return times, positions, quaternions, sample_times
+
+
+@case("imu", sizes=(100, 1000, 10000))
+def imu(size):
+    trajectory = imu_trajectory(size)
+    return lambda: imu_measurements(*trajectory)
+
+
+@case("imu_noise", sizes=(1000, 10000, 100000))
+def imu_noise(size):
+    imu_data = {
+        "frame_rate": 200,
+        "accelerations": np.zeros((size, 3)),
+        "angular_velocities": np.zeros((size, 3)),
+    }
+    noise = {name: default for name, (_, _, default) in NOISE_PARAMETERS.items()}
+    rng = np.random.default_rng(0)
+    return lambda: add_imu_noise(imu_data, noise, rng)
+
+
+@case("raycast", sizes=(1000, 10000, 100000))
+def raycast(size):
+    # rays from the origin against a 128 x 128 quad height field below and around it
+    rng = np.random.default_rng(0)
+    grid = np.linspace(-20, 20, 129)
+    x, y = np.meshgrid(grid, grid, indexing='ij')
+    vertices = np.column_stack((x.ravel(), y.ravel(), rng.uniform(-2.5, -1.5, x.size)))
+    corners = (np.arange(128)[:, None] * 129 + np.arange(128)[None, :]).ravel()
+    triangles = np.concatenate((np.column_stack((corners, corners + 129, corners + 1)),
+                                np.column_stack((corners + 1, corners + 129, corners + 130))))
+    bvh = TriangleBVH(vertices, triangles)
+    origins = np.zeros((size, 3))
+    directions = unit_vectors(rng, size)
+    directions[:, 2] = -np.abs(directions[:, 2])
+    return lambda: bvh.cast(origins, directions, 50.0)
+
+
+def measure(function, repeat=REPEAT, min_time=MIN_TIME):
+    """Seconds per call of `function`, the fastest of `repeat` runs of at least `min_time`."""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed * 4 > min_time else 10
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+
+def load_baseline(path):
+    if not path.exists():
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)["results"]
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as file:
+        json.dump({
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "results": results,
+        }, file, indent=4, sort_keys=True)
+        file.write("\n")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="bench.py", description=__doc__.splitlines()[0])
+    parser.add_argument("--filter", default="", help="only run the cases whose name contains this")
+    parser.add_argument("--compare", type=Path, help="baseline file to compare the results against")
+    parser.add_argument("--save", type=Path, help="write the results to this baseline file")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="relative slowdown reported as a regression")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="timed runs per case")
+    parser.add_argument("--min-time", type=float, default=MIN_TIME, help="minimum seconds of one timed run")
+    args = parser.parse_args(argv)
+    if args.compare is not None and not args.compare.exists():
+        parser.error(f"no baseline file {args.compare}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    baseline = load_baseline(args.compare) if args.compare else {}
+
+    results, regressions = {}, []
+    print(f"{'case':<36} {'time':>10} {'baseline':>10} {'change':>8}")
+    for name, (build, size) in CASES.items():
+        if args.filter not in name:
+            continue
+        function = build(size)
+        try:
+            results[name] = measure(function, args.repeat, args.min_time)
+        finally:
+            if hasattr(function, "close"):
+                function.close()
+
+        line = f"{name:<36} {format_time(results[name]):>10}"
+        if name in baseline:
+            change = results[name] / baseline[name] - 1.0
+            line += f" {format_time(baseline[name]):>10} {change:>+8.1%}"
+            if change > args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line, flush=True)
+
+    if args.save:
+        # a filtered run only replaces its own cases
+        save_baseline(args.save, {**load_baseline(args.save), **results})
+        print(f"Saved {len(results)} results to {args.save}")
+    if regressions:
+        print(f"{len(regressions)} cases are more than {args.threshold:.0%} slower than the baseline: "
+              + ", ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
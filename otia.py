@@ -1,29 +1,13 @@
 import bpy
 import logging
-from pathlib import Path
 import sys
-import os
-import json
 
 #begin preprocessing
 project_root = "/home/jan/Workspace/lidar_scanner2/otia"
 #end preprocessing 
-sys.path.append(project_root)
+if project_root not in sys.path:
+    sys.path.append(project_root)
 
-'''
-path = Path(bpy.data.filepath).parent
-project_root = path / "otia"
-
-print("Blender file path:", bpy.data.filepath)
-print("Project root path:", project_root)
-print("Checking if project root exists:", project_root.exists())
-print("sys.path before:", sys.path)
-
-if str(project_root) not in sys.path:
-    sys.path.append(str(project_root))
-
-print("sys.path after:", sys.path)
-'''
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
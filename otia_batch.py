@@ -0,0 +1,354 @@
+"""Headless simulation runner.
+
+    blender --background scene.blend --python otia_batch.py -- --frames 1-5000 --out /data/run
+
+Steps once through the times of the range that some sensor's rate asks for, records the pose
+of every sensor, scans the LiDARs and renders the cameras due at each step, then synthesizes
+the IMUs from the recorded poses, exports the poses as ground truth and exits with a summary.
+Nothing depends on animation playback, so no sample is skipped or repeated.
+With `--workers N` the LiDARs are scanned in N frame-range shards by background Blender workers
+and merged afterwards.
+"""
+import argparse
+import contextlib
+import logging
+import math
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bpy
+
+#begin preprocessing
+project_root = "/home/jan/Workspace/lidar_scanner2/otia"
+#end preprocessing
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+import otia
+from otia_panel.otia_panel import camera_frames, record_sensor_poses, render_frame, sensor_objects
+from otia_render import THREADS, render_parallel
+from output.chunked_store import ChunkedReader, merge_stores
+from output.frame_cache import frame_cache
+from output.live import live_output
+from output.records import RANGE_IMAGE_STORE
+from output.rosbag import bag_output
+from output.profiling import LOG_INTERVAL, profiler
+from output.writer import close_outputs, output_writer
+from sensor.models.cam.ros_info import save_cam_ros_info
+from sensor.models.cam.segmentation import segmentation_run
+from sensor.models.imu.ros_info import save_imu_ros_info
+from sensor.models.imu.simulation import animation_trajectory, check_imu_rate, publish_imu, save_imu_data, simulate_imu
+from sensor.models.lidar.lidar_creator import SCANNER_ORGANIZED, lidar_codec, scanner_config, scanner_ros_config
+from sensor.models.lidar.scanning import (close_lidar_stores, publish_scan, scan_frame, scan_key, store_scan,
+                                          sweep_start_pose)
+from sensor.models.lidar.ros_info import save_lidar_ros_info
+from sensor.schedule import SensorScheduler
+from sensor.trajectory import merge_pose_files, scan_poses, sensor_poses
+from workers.pool import blender_command, frame_range, run_commands, split
+
+logger = logging.getLogger(__name__)
+
+# scheduler entries shared by all cameras and by all IMUs; tuples never clash with object names
+CAMERAS = ("cameras",)
+IMUS = ("imus",)
+
+# the shard workers run this script as well
+SCRIPT = os.path.abspath(__file__)
+
+
+def parse_args(argv):
+    # Blender passes everything after "--" through to the script
+    argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    parser = argparse.ArgumentParser(prog="otia_batch.py", description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=frame_range, help="first-last frame, defaults to the scene's frame range")
+    parser.add_argument("--out", help="output folder, defaults to the scene's folder path")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="scan the LiDARs in this many frame-range shards on background Blender workers")
+    parser.add_argument("--threads", type=int, default=0, help="threads of every shard worker, 0 uses all cores")
+    parser.add_argument("--keep-shards", action="store_true",
+                        help="keep the shard outputs and worker logs under <out>/shards after merging them")
+    parser.add_argument("--no-lidar", action="store_true", help="skip the LiDARs")
+    parser.add_argument("--no-imu", action="store_true", help="skip the IMUs")
+    parser.add_argument("--no-cameras", action="store_true", help="skip rendering the cameras")
+    parser.add_argument("--camera-workers", type=int, default=0,
+                        help="render the cameras on this many background Blender workers instead of in this process")
+    parser.add_argument("--camera-threads", type=int, default=THREADS, help="threads of every camera worker")
+    parser.add_argument("--compression", choices=["none", "lossless", "quantized"],
+                        help="encoding of the LiDAR stores, defaults to the scene's LiDAR compression")
+    parser.add_argument("--compression-level", type=int, help="zlib level or lzma preset of the LiDAR stores")
+    parser.add_argument("--live", action="store_true",
+                        help="also publish every LiDAR scan and IMU batch to shared memory (python -m output.live)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="recompute every LiDAR scan and camera render, even those already in the output")
+    parser.add_argument("--bag", help="also write every sensor stream into a new rosbag2 (sqlite3) in this folder")
+    parser.add_argument("--profile", action="store_true",
+                        help="time every sensor stage, write trace.json (Chrome trace) and print a stage summary")
+    parser.add_argument("--log-interval", type=float, default=LOG_INTERVAL,
+                        help="seconds between repeated progress log lines of a sensor, 0 turns them off")
+    # first frame of the whole simulation when running a shard of it
+    parser.add_argument("--warmup-from", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+class SensorStats:
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.samples = 0
+        # samples found in the frame cache
+        self.cached = 0
+        self.points = 0
+        self.seconds = 0.0
+
+
+def scanners():
+    collection = bpy.data.collections.get("LiDAR")
+    for obj in (collection.objects if collection else []):
+        if obj.type != 'EMPTY':
+            continue
+        config = scanner_config(obj)
+        if config is None:
+            logger.warning("Scanner %s has no stored configuration, recreate it to run it headless", obj.name)
+            continue
+        yield obj, config
+
+
+def run(scene, frames, out, args, stats):
+    """One pass over the times some sensor needs: the scene is evaluated once per step, the
+    poses of all sensors are recorded and the LiDARs and cameras due at that step sample it.
+    The IMUs are synthesized from the recorded poses afterwards."""
+    frame_start, frame_end = frames.start, frames.stop - 1
+    # stores left open by an earlier run in this session keep its folder and codec
+    close_lidar_stores()
+
+    lidars = {}
+    for scanner_base, (selected_lidar, parameters, hz) in ([] if args.no_lidar else scanners()):
+        scanner_folder = os.path.join(out, "lidar", scanner_base.name)
+        save_lidar_ros_info(scanner_folder, *scanner_ros_config(scanner_base))
+        sensor_stats = SensorStats("lidar", scanner_base.name)
+        stats.append(sensor_stats)
+        lidars[scanner_base.name] = (selected_lidar, parameters, hz, scanner_folder, sensor_stats)
+    codec = lidar_codec(scene)
+
+    # a shard first replays the scans shortly before its range, their poses start its first sweeps
+    record_start = frame_start
+    rates = [hz for _, _, hz, _, _ in lidars.values() if hz > 0]
+    if args.warmup_from is not None and rates:
+        lookback = math.ceil(3000 / (min(rates) * scene.milliseconds_per_frame)) + 1
+        record_start = max(args.warmup_from, frame_start - lookback)
+
+    scheduler = SensorScheduler(scene.milliseconds_per_frame, record_start, frame_end)
+    for scanner_name, (_, _, hz, _, _) in lidars.items():
+        scheduler.add(scanner_name, hz)
+
+    objects = sensor_objects()
+    cameras = [] if args.no_cameras else [obj for obj in objects if obj.type == 'CAMERA']
+    camera_stats = [SensorStats("camera", camera.name) for camera in cameras]
+    stats.extend(camera_stats)
+    if cameras and not args.camera_workers:
+        scheduler.add(CAMERAS, scene.cam_hz)
+
+    imu_collection = bpy.data.collections.get("IMU")
+    imus = [] if args.no_imu or not imu_collection else [obj for obj in objects if obj.name in imu_collection.objects]
+    if imus:
+        check_imu_rate(scene)
+    # the bag takes topics and frame ids from the ros.json next to every output
+    for camera in cameras:
+        save_cam_ros_info(os.path.join(out, "cam", camera.name))
+    for imu_object in imus:
+        save_imu_ros_info(os.path.join(out, imu_object.name))
+    # IMUs moved only by their own F-Curves are read from them, the others need their poses
+    # recorded once per frame; the pose spline provides the IMU rate in between
+    if any(animation_trajectory(imu_object, [frame_start]) is None for imu_object in imus):
+        scheduler.add_frames(IMUS)
+
+    # the index passes are set up once for the cameras rendered in this process
+    segmentation = segmentation_run(scene, out) if CAMERAS in scheduler.sensors else contextlib.nullcontext()
+    with segmentation as index_output:
+        for step in scheduler.steps():
+            with profiler.stage("scene", "frame_set", step.frame):
+                scene.frame_set(step.frame, subframe=step.subframe)
+                record_sensor_poses(scene, step.time, objects)
+            scanners_due = [sensor for sensor in step.sensors if sensor in lidars]
+            for scanner_name in scanners_due:
+                scan_poses.record(scanner_name, step.time, scene.objects[scanner_name].matrix_world)
+            if step.frame < frame_start:
+                continue
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+
+            for scanner_name in scanners_due:
+                selected_lidar, parameters, hz, scanner_folder, sensor_stats = lidars[scanner_name]
+                started = time.perf_counter()
+                scanner_base = scene.objects[scanner_name]
+                sweep_duration = 1.0 / hz
+                sweep_start = sweep_start_pose(scanner_name, step.time, sweep_duration)
+                organized = scanner_base.get(SCANNER_ORGANIZED, False)
+                key = scan_key(depsgraph, scanner_base, selected_lidar, parameters, step.frame,
+                               sweep_duration, sweep_start, organized, codec) if frame_cache.enabled else None
+                if frame_cache.hit(scanner_folder, step.frame, key):
+                    sensor_stats.cached += 1
+                    sensor_stats.seconds += time.perf_counter() - started
+                    continue
+                scan = scan_frame(depsgraph, scanner_base, selected_lidar, parameters, step.frame,
+                                  sweep_duration, sweep_start, organized=organized)
+                hit_records = scan.points
+                store_scan(scanner_folder, selected_lidar, step.frame, scan, codec, key)
+                publish_scan(scanner_name, step.frame, step.time, scan)
+                bag_output.scan(scanner_folder, selected_lidar, step.frame, scan)
+                sensor_stats.samples += 1
+                sensor_stats.points += len(hit_records)
+                sensor_stats.seconds += time.perf_counter() - started
+                profiler.log(logger, scanner_name, "%s: %d points at frame %d", scanner_name, len(hit_records), step.frame)
+
+            if CAMERAS in step.sensors:
+                started = time.perf_counter()
+                cached = render_frame(scene, cameras, step.frame, out, index_output)
+                for camera, sensor_stats in zip(cameras, camera_stats):
+                    if camera in cached:
+                        sensor_stats.cached += 1
+                    else:
+                        sensor_stats.samples += 1
+                    sensor_stats.seconds += (time.perf_counter() - started) / len(cameras)
+
+    for imu_object in imus:
+        started = time.perf_counter()
+        imu_data = simulate_imu(scene, imu_object, frame_start, frame_end)
+        imu_folder = os.path.join(out, imu_object.name)
+        output_writer().submit(imu_folder, save_imu_data, imu_data, imu_folder, f"{imu_object.name}_imu_data.npy")
+        publish_imu(imu_object.name, frame_end, imu_data)
+        bag_output.imu(imu_folder, imu_data)
+        sensor_stats = SensorStats("imu", imu_object.name)
+        sensor_stats.samples = len(imu_data["timestamps"])
+        sensor_stats.seconds = time.perf_counter() - started
+        stats.append(sensor_stats)
+
+    if cameras and args.camera_workers:
+        started = time.perf_counter()
+        jobs = {"cameras": [camera.name for camera in cameras], "frames": camera_frames(scene, frame_start, frame_end)}
+        render_parallel(bpy.data.filepath, out, args.camera_workers, args.camera_threads,
+                        blender=bpy.app.binary_path, jobs=jobs, cache=not args.no_cache)
+        for sensor_stats in camera_stats:
+            sensor_stats.samples = len(jobs["frames"])
+            sensor_stats.seconds = (time.perf_counter() - started) / len(cameras)
+
+    sensor_poses.export(os.path.join(out, "poses"))
+    close_lidar_stores()
+
+
+def run_sharded(scene, frames, out, args, stats):
+    """Scans the LiDARs in frame-range shards on background Blender workers while this process
+    handles the IMUs and cameras, then merges the shards into the dataset a single run writes.
+    The shard folders are deleted once merged unless `--keep-shards` is given; shards left by an
+    earlier run are deleted before starting, since their frame ranges may differ."""
+    if not bpy.data.filepath:
+        raise RuntimeError("Save the .blend file first, the shard workers load it")
+
+    shards = [range(part[0], part[-1] + 1) for part in split(frames, args.workers)]
+    shards_folder = os.path.join(out, "shards")
+    shutil.rmtree(shards_folder, ignore_errors=True)
+    shard_folders = [os.path.join(shards_folder, f"shard-{shard:04d}") for shard in range(len(shards))]
+    commands = [blender_command(bpy.app.binary_path, bpy.data.filepath, SCRIPT,
+                                ["--frames", f"{shard.start}-{shard.stop - 1}", "--warmup-from", frames.start,
+                                 "--out", folder, "--no-imu", "--no-cameras", "--log-interval", args.log_interval]
+                                + (["--profile"] if args.profile else [])
+                                + (["--no-cache"] if args.no_cache else [])
+                                + (["--compression", args.compression] if args.compression else [])
+                                + (["--compression-level", args.compression_level]
+                                   if args.compression_level is not None else []), args.threads)
+                for shard, folder in zip(shards, shard_folders)]
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        shards_done = pool.submit(run_commands, commands, args.workers, shards_folder)
+        run(scene, frames, out, argparse.Namespace(**{**vars(args), "no_lidar": True}), stats)
+        shards_done.result()
+
+    # every shard holds a consecutive frame range, so appending them in order keeps frame order
+    scanner_names = sorted({name for folder in shard_folders for name in os.listdir(os.path.join(folder, "lidar"))})
+    for scanner_name in scanner_names:
+        scanner_folder = os.path.join(out, "lidar", scanner_name)
+        sensor_stats = SensorStats("lidar", scanner_name)
+        # organized scanners write range images, the others points
+        for store in ("points", RANGE_IMAGE_STORE):
+            sources = [os.path.join(folder, "lidar", scanner_name) for folder in shard_folders]
+            sources = [source for source in sources if os.path.exists(os.path.join(source, f"{store}.json"))]
+            if not sources:
+                continue
+            merge_stores(sources, scanner_folder, store)
+            shutil.copy(os.path.join(sources[0], "ros.json"), scanner_folder)
+
+            for source in sources:
+                reader = ChunkedReader(source, store)
+                sensor_stats.samples += len(reader)
+                if store == "points":
+                    sensor_stats.points += sum(int(reader.entries[int(frame)]["count"]) for frame in reader.frames)
+                else:
+                    sensor_stats.points += sum(int(image["valid"].sum()) for _, image in reader)
+        stats.insert(0, sensor_stats)
+
+    merge_pose_files([os.path.join(out, "poses")] + [os.path.join(folder, "poses") for folder in shard_folders],
+                     os.path.join(out, "poses"))
+    if not args.keep_shards:
+        shutil.rmtree(shards_folder)
+
+
+def summary(stats, frames, seconds):
+    lines = [f"Simulated frames {frames.start}-{frames.stop - 1} in {seconds:.1f} s",
+             f"{'kind':<8}{'sensor':<24}{'samples':>10}{'cached':>10}{'points':>14}{'seconds':>10}"]
+    for s in stats:
+        lines.append(f"{s.kind:<8}{s.name:<24}{s.samples:>10}{s.cached:>10}{s.points:>14}{s.seconds:>10.1f}")
+    return "\n".join(lines)
+
+
+def main(argv):
+    args = parse_args(argv)
+    otia.register()
+
+    scene = bpy.context.scene
+    frames = args.frames or range(scene.frame_start, scene.frame_end + 1)
+    if args.out:
+        scene.folder_path = args.out
+    if args.compression:
+        scene.lidar_compression = args.compression.upper()
+    if args.compression_level is not None:
+        scene.lidar_compression_level = args.compression_level
+    out = scene.folder_path
+    os.makedirs(out, exist_ok=True)
+    profiler.enabled = args.profile
+    live_output.enabled = args.live
+    frame_cache.enabled = not args.no_cache
+    if args.live and args.workers > 1:
+        logger.warning("The LiDAR shards run in other processes and do not publish live")
+    profiler.log_interval = args.log_interval or None
+
+    if args.bag:
+        bag_output.open(out, args.bag, frames, scene.milliseconds_per_frame)
+
+    started = time.perf_counter()
+    stats = []
+    if args.workers > 1 and not args.no_lidar:
+        run_sharded(scene, frames, out, args, stats)
+    else:
+        run(scene, frames, out, args, stats)
+    # waits for every pending write and raises a failed one
+    close_outputs()
+    live_output.close()
+
+    if args.bag:
+        # adds what was not streamed: cached frames, the LiDAR shards and the camera workers
+        with profiler.stage("bag", "close"):
+            bag_output.close()
+    print(summary(stats, frames, time.perf_counter() - started))
+    if args.profile:
+        profiler.export_trace(os.path.join(out, "trace.json"))
+        print(profiler.summary_table())
+
+
+if __name__ == "__main__":
+    try:
+        main(sys.argv)
+    except Exception:
+        logger.exception("Simulation failed")
+        sys.exit(1)
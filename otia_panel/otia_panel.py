@@ -1,34 +1,105 @@
 import bpy
 import os
-import json
 import logging
-from pathlib import Path
-import sys
-
 
 #begin preprocessing
 project_root = "/home/jan/Workspace/lidar_scanner2/otia"
 #end preprocessing 
-sys.path.append(project_root)
 
-logging.basicConfig(level=logging.DEBUG)
+from output.frame_cache import frame_cache
+from output.live import live_output
+from output.profiling import profiler
+from output.rosbag import bag_output
+from output.writer import flush_outputs
+from sensor.models.lidar.lidar_creator import close_scanner_stores
+from sensor.registry import NOISE_PARAMETERS, lidar_models, lidar_parameters
+
 logger = logging.getLogger(__name__)
 
+def camera_frames(scene, frame_start, frame_end):
+    """Frames of the range in which the cameras take a picture at the scene's camera rate."""
+    from sensor.schedule import SensorScheduler
+
+    scheduler = SensorScheduler(scene.milliseconds_per_frame, frame_start, frame_end)
+    scheduler.add("cameras", scene.cam_hz)
+    return scheduler.frames("cameras").tolist()
+
+
+# collections whose objects are sensors
+SENSOR_COLLECTIONS = {"LiDAR": 'EMPTY', "IMU": 'EMPTY', "Cameras": 'CAMERA'}
+
+
+def sensor_objects():
+    """Every sensor object of the LiDAR, IMU and Cameras collections."""
+    objects = []
+    for collection_name, object_type in SENSOR_COLLECTIONS.items():
+        collection = bpy.data.collections.get(collection_name)
+        if collection:
+            objects.extend(obj for obj in collection.objects if obj.type == object_type)
+    return objects
+
 
-def get_lidar_parameters():
-    filepath = os.path.join(project_root, "sensor", "models", "lidar", "models.json")
-    try:
-        with open(filepath, 'r') as file:
-            data = json.load(file)
-        return data
-    except Exception as e:
-        logger.info("%s", e)
-        print(f"An error occurred: {e}")
-        return None
+def record_sensor_poses(scene, time, objects=None):
+    """Records the evaluated world matrix of every sensor object in the shared pose table."""
+    from sensor.trajectory import sensor_poses
 
-lidar_data = get_lidar_parameters()
+    for obj in (objects if objects is not None else sensor_objects()):
+        sensor_poses.record(obj.name, time, obj.matrix_world)
+
+
+def render_frame(scene, cameras, frame_number, output_folder, index_output=None):
+    """Renders the already evaluated current frame once for each of `cameras`. With the file
+    output node of a `segmentation_run` the same render also writes object and material index
+    masks. Cameras whose render of the frame is in the frame cache are skipped, they are returned.
+    Renders are keyed only while the cache is enabled and the scene can be fully keyed."""
+    from sensor.models.cam.frame_key import camera_key, render_files, render_inputs
+    from sensor.models.cam.segmentation import collect_index_passes, index_folder
+
+    # Ensure render settings are configured correctly
+    scene.render.image_settings.file_format = 'PNG'
+    scene.render.use_file_extension = True
+    segmentation = index_output is not None
+    inputs = (render_inputs(scene, bpy.context.evaluated_depsgraph_get(), segmentation) if frame_cache.enabled
+              else None)
+    cached = []
+
+    for obj in cameras:
+        # Create a directory for the current camera
+        camera_folder = os.path.join(output_folder, "cam", obj.name)
+        os.makedirs(camera_folder, exist_ok=True)
+        key = camera_key(obj, frame_number, inputs) if inputs is not None else None
+        if (frame_cache.hit(camera_folder, frame_number, key)
+                and all(path.exists() for path in render_files(camera_folder, frame_number, segmentation))):
+            profiler.log(logger, obj.name, "%s: frame %d is cached", obj.name, frame_number)
+            cached.append(obj)
+            continue
+
+        # Set the current camera
+        scene.camera = obj
+        render_path = os.path.join(camera_folder, f"{frame_number}.png")
+        scene.render.filepath = render_path
+        if index_output:
+            index_output.base_path = index_folder(camera_folder)
+
+        # Perform rendering
+        profiler.log(logger, obj.name, "Rendering camera: %s at frame %d to %s", obj.name, frame_number, render_path)
+        with profiler.stage(obj.name, "render", frame_number):
+            bpy.ops.render.render(write_still=True)
+        bag_output.render(camera_folder, frame_number, render_path)
+        if index_output:
+            with profiler.stage(obj.name, "segmentation", frame_number):
+                collect_index_passes(camera_folder, frame_number)
+        frame_cache.record(camera_folder, frame_number, key)
+    return cached
+
+
+def render_cameras(scene, frames=None):
+    """Renders every camera of the Cameras collection for `frames`, by default the frames
+    of the scene's frame range that the camera rate asks for. Each frame is evaluated once
+    for all cameras."""
+    if frames is None:
+        frames = camera_frames(scene, scene.frame_start, scene.frame_end)
 
-def render_cameras(scene):
     # Get the Cameras collection
     camera_collection = bpy.data.collections.get("Cameras")
     if not camera_collection:
@@ -41,33 +112,26 @@ def render_cameras(scene):
         logger.error("Output folder path is not set or does not exist")
         return
 
-    # Ensure render settings are configured correctly
-    scene.render.image_settings.file_format = 'PNG'
-    scene.render.use_file_extension = True
-    
-    # Render all frames for each camera
-    for obj in camera_collection.objects:
-        if obj.type == 'CAMERA':
-            # Create a directory for the current camera
-            camera_folder = os.path.join(output_folder, "cam", obj.name)
-            os.makedirs(camera_folder, exist_ok=True)
-
-            # Set the current camera
-            scene.camera = obj
-
-            # Render each frame
-            for frame_number in range(scene.frame_start, scene.frame_end + 1):
-                scene.frame_set(frame_number)
-                render_path = os.path.join(camera_folder, f"{frame_number}.png")
-                scene.render.filepath = render_path
-                
-                # Perform rendering
-                logger.info(f"Rendering camera: {obj.name} at frame {frame_number} to {render_path}")
-                bpy.ops.render.render(write_still=True)
+    from sensor.models.cam.segmentation import segmentation_run
+
+    cameras = [obj for obj in camera_collection.objects if obj.type == 'CAMERA']
+    with segmentation_run(scene, output_folder) as index_output:
+        for frame_number in frames:
+            scene.frame_set(frame_number)
+            record_sensor_poses(scene, frame_number * scene.milliseconds_per_frame / 1000.0, cameras)
+            render_frame(scene, cameras, frame_number, output_folder, index_output)
+
+
+def export_profile(output_folder):
+    """Writes the recorded stages to `trace.json` and logs their summary, if profiling is on."""
+    if not profiler.enabled:
+        return
+    trace_path = os.path.join(output_folder, "trace.json")
+    profiler.export_trace(trace_path)
+    logger.info("Stage summary, trace in %s:\n%s", trace_path, profiler.summary_table())
 
 
 def simulate(scene):
-    logger.info("STARTING THE SIMULATION")
     scene.simulation_running = True
     # Ensure the simulation handler runs properly
     if simulate not in bpy.app.handlers.frame_change_post:
@@ -75,7 +139,11 @@ def simulate(scene):
 
     current_frame = scene.frame_current
     end_frame = scene.frame_end
+    profiler.log(logger, "simulate", "Simulating frame %d of %d", current_frame, end_frame)
 
+    # one pose record per frame serves the sweeps, the IMUs and the ground truth
+    with profiler.stage("scene", "poses", current_frame):
+        record_sensor_poses(scene, current_frame * scene.milliseconds_per_frame / 1000.0)
     bpy.ops.object.trigger_all_scans()
 
     if current_frame >= end_frame:
@@ -88,8 +156,15 @@ def simulate(scene):
         # Render all imus and cameras 
         bpy.ops.object.trigger_all_imus()
         render_cameras(scene)
+        from sensor.trajectory import sensor_poses
+        sensor_poses.export(os.path.join(scene.folder_path, "poses"))
+
+        # Wait for the background writer, this also raises any failed write
+        flush_outputs()
+        close_scanner_stores()
+        export_profile(scene.folder_path)
+        live_output.close()
     
-    logger.info("FINISHED THE SIMULATION")
     scene.simulation_running = False
 
 
@@ -124,7 +199,7 @@ class TriggerAllScansOperator(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO'}
 
     def execute(self, context):
-        logger.info("Triggering all scans")
+        profiler.log(logger, "trigger_all_scans", "Triggering all scans")
 
         lidar_collection = bpy.data.collections.get("LiDAR")
         if not lidar_collection:
@@ -133,11 +208,8 @@ class TriggerAllScansOperator(bpy.types.Operator):
 
         for obj in lidar_collection.objects:
             if obj.type == 'EMPTY':
-                operator_idname = f"object.custom_raycast_{obj.name}"
-                logger.info("Triggering operator: %s", operator_idname)
                 try:
                     eval(f"bpy.ops.object.custom_raycast_{obj.name}()")
-                    logger.info(f"Triggered scan for {obj.name}")
                 except Exception as e:
                     logger.error(f"Failed to trigger scan for {obj.name}: {str(e)}")
 
@@ -171,6 +243,18 @@ class ControlPanel(bpy.types.Panel):
         layout.label(text="Control Panel")
         layout.operator("object.trigger_all_scans", text="Single Scan")
         layout.prop(context.scene, "milliseconds_per_frame", text="Milliseconds per Frame")
+        layout.prop(context.scene, "lidar_preview_interval", text="Preview Every Nth Frame")
+        layout.prop(context.scene, "lidar_preview_decimation", text="Preview Decimation")
+        layout.prop(context.scene, "lidar_compression")
+        if context.scene.lidar_compression != 'NONE':
+            layout.prop(context.scene, "lidar_compressor")
+            layout.prop(context.scene, "lidar_compression_level")
+        if context.scene.lidar_compression == 'QUANTIZED':
+            layout.prop(context.scene, "lidar_quantization")
+        layout.prop(context.scene, "profile_simulation")
+        layout.prop(context.scene, "live_output")
+        layout.prop(context.scene, "frame_cache")
+        layout.prop(context.scene, "log_interval")
         layout.prop(context.scene, "folder_path", text="Folder Path")
         layout.operator("object.set_folder_path", text="Select Output Folder")
         layout.operator("object.start_simulation", text="Start Simulation")
@@ -183,6 +267,22 @@ class StartSimulationOperator(bpy.types.Operator):
     def execute(self, context):
         # Set the current frame to the start frame
         scene = context.scene
+        imu_collection = bpy.data.collections.get("IMU")
+        if imu_collection and len(imu_collection.objects) and scene.imu_hz <= 0:
+            # the IMUs are only simulated once every frame ran
+            self.report({'ERROR'}, "The IMU frequency must be positive")
+            return {'CANCELLED'}
+        from sensor.trajectory import scan_poses, sensor_poses
+        sensor_poses.clear()
+        scan_poses.clear()
+        profiler.clear()
+        close_scanner_stores()
+        profiler.enabled = scene.profile_simulation
+        live_output.enabled = scene.live_output
+        # the keys are read from the output folder again, it may have changed since the last run
+        frame_cache.clear()
+        frame_cache.enabled = scene.frame_cache
+        profiler.log_interval = scene.log_interval or None
         scene.frame_set(scene.frame_start)
         
         # Add the frame change handler
@@ -203,6 +303,10 @@ class StopSimulationOperator(bpy.types.Operator):
         bpy.ops.screen.animation_cancel()
         if simulate in bpy.app.handlers.frame_change_post:
             bpy.app.handlers.frame_change_post.remove(simulate)
+        flush_outputs()
+        close_scanner_stores()
+        export_profile(context.scene.folder_path)
+        live_output.close()
         return {'FINISHED'}
 
 class SensorPanel(bpy.types.Panel):
@@ -226,7 +330,7 @@ class SensorPanel(bpy.types.Panel):
             box.prop(scene, "lidar_selection_dropdown", text="LiDAR Model")
             selected_lidar = scene.lidar_selection_dropdown
             if selected_lidar:
-                parameters = lidar_data[selected_lidar]["parameters"]
+                parameters = lidar_parameters(selected_lidar)
                 for param_name, param_info in parameters.items():
                     prop_name = f"lidar_{param_name}"
                     box.prop(scene, prop_name, text=param_info["description"])
@@ -234,6 +338,8 @@ class SensorPanel(bpy.types.Panel):
                 box.prop(scene, "lidar_frame_id",text="ROS Frame Id")
                 box.prop(scene, "lidar_publisher",text="ROS publisher")
                 box.prop(scene, "lidar_hz",text="HZ")
+                if "beams" in lidar_models()[selected_lidar]:
+                    box.prop(scene, "lidar_organized")
             box.operator("object.create_scanner", text="Create Scanner")
 
         elif selected_sensor == 'IMU':
@@ -241,6 +347,9 @@ class SensorPanel(bpy.types.Panel):
             box.prop(scene, "imu_frame_id",text="ROS Frame Id")
             box.prop(scene, "imu_publisher",text="ROS publisher")
             box.prop(scene, "imu_hz",text="HZ")
+            for param_name in NOISE_PARAMETERS:
+                box.prop(scene, f"imu_{param_name}")
+            box.prop(scene, "imu_noise_seed", text="Noise Seed")
             box.operator("object.create_imu", text="Create IMU")
 
         elif selected_sensor == 'CAM':
@@ -259,6 +368,7 @@ class SensorPanel(bpy.types.Panel):
             box.prop(scene, "cam_frame_id")
             box.prop(scene, "cam_publisher")
             box.prop(scene, "cam_hz")
+            box.prop(scene, "cam_segmentation")
             box.prop(scene, "cam_name", text="Camera Name")
             box.operator("camera.create_update")
 
@@ -278,7 +388,7 @@ def register_properties():
     bpy.types.Scene.lidar_selection_dropdown = bpy.props.EnumProperty(
         name="LiDAR Model",
         description="Select a LiDAR model",
-        items=[(key, value["name"], value["description"]) for key, value in lidar_data.items()]
+        items=[(key, value["name"], value["description"]) for key, value in lidar_models().items()]
     )
 
     bpy.types.Scene.lidar_name = bpy.props.StringProperty(
@@ -338,10 +448,26 @@ def register_properties():
         name="IMU Frequency",
         description="Frequency of IMU data publication in Hz",
         default=10,
-        min=0,
+        min=1,
         max=1000,
     )
 
+    for param_name, (label, unit, default) in NOISE_PARAMETERS.items():
+        setattr(bpy.types.Scene, f"imu_{param_name}", bpy.props.FloatProperty(
+            name=label,
+            description=f"{label} in {unit}, 0 disables it",
+            default=default,
+            min=0.0,
+            precision=6,
+        ))
+
+    bpy.types.Scene.imu_noise_seed = bpy.props.IntProperty(
+        name="IMU Noise Seed",
+        description="Seed of the IMU noise, every IMU draws its own stream from it and its name",
+        default=0,
+        min=0,
+    )
+
     bpy.types.Scene.lidar_hz = bpy.props.IntProperty(
         name="LiDAR Frequency",
         description="Frequency of LiDAR data publication in Hz",
@@ -350,6 +476,47 @@ def register_properties():
         max=1000
     )
 
+    bpy.types.Scene.lidar_organized = bpy.props.BoolProperty(
+        name="Organized Output",
+        description="Write a range image (range, intensity and validity per channel and azimuth column) "
+                    "instead of a point list, for models with a beam table",
+        default=False,
+    )
+
+    bpy.types.Scene.lidar_compression = bpy.props.EnumProperty(
+        name="LiDAR Compression",
+        description="Encoding of the LiDAR stores, done by the background writer",
+        items=[
+            ('NONE', "None", "Raw float32 records, memory-mapped when read"),
+            ('LOSSLESS', "Lossless", "Predicted along the scan lines and compressed, decoded exactly"),
+            ('QUANTIZED', "Quantized", "Lengths rounded to the quantization step, then predicted and compressed"),
+        ],
+        default='NONE',
+    )
+
+    bpy.types.Scene.lidar_compressor = bpy.props.EnumProperty(
+        name="Compressor",
+        description="Codec of the LiDAR stores, lzma is smaller and slower",
+        items=[('zlib', "zlib", "Fast"), ('lzma', "lzma", "Smaller")],
+        default='zlib',
+    )
+
+    bpy.types.Scene.lidar_compression_level = bpy.props.IntProperty(
+        name="Compression Level",
+        description="zlib level or lzma preset",
+        default=6,
+        min=0,
+        max=9,
+    )
+
+    bpy.types.Scene.lidar_quantization = bpy.props.FloatProperty(
+        name="Quantization",
+        description="Step in metres the quantized LiDAR lengths are rounded to",
+        default=0.001,
+        min=1e-6,
+        unit='LENGTH',
+    )
+
     bpy.types.Scene.cam_hz = bpy.props.IntProperty(
         name="Camera Frequency",
         description="Frequency of Camera data publication in Hz",
@@ -358,6 +525,39 @@ def register_properties():
         max=1000,
     )
 
+    bpy.types.Scene.profile_simulation = bpy.props.BoolProperty(
+        name="Profile Simulation",
+        description="Time every sensor stage and write trace.json and a summary when the simulation ends",
+        default=False,
+    )
+
+    bpy.types.Scene.live_output = bpy.props.BoolProperty(
+        name="Live Output",
+        description="Also publish every LiDAR scan and IMU batch to shared memory for other processes "
+                    "(python -m output.live)",
+        default=False,
+    )
+
+    bpy.types.Scene.frame_cache = bpy.props.BoolProperty(
+        name="Reuse Cached Frames",
+        description="Skip the LiDAR scans and camera renders whose inputs are unchanged since they were "
+                    "written to the output folder",
+        default=True,
+    )
+
+    bpy.types.Scene.log_interval = bpy.props.FloatProperty(
+        name="Log Interval",
+        description="Seconds between repeated progress log lines of a sensor, 0 turns them off",
+        default=5.0,
+        min=0.0,
+    )
+
+    bpy.types.Scene.cam_segmentation = bpy.props.BoolProperty(
+        name="Segmentation Masks",
+        description="Also write object and material index masks of every camera render (Cycles only)",
+        default=True,
+    )
+
     bpy.types.Scene.milliseconds_per_frame= bpy.props.IntProperty(
         name="Milliseconds per Frame",
         description="Milliseconds per Frame",
@@ -366,13 +566,27 @@ def register_properties():
         max=1000,
     )
 
+    bpy.types.Scene.lidar_preview_interval = bpy.props.IntProperty(
+        name="Preview Every Nth Frame",
+        description="Refresh the LiDAR point cloud preview every Nth frame, 0 disables the preview",
+        default=1,
+        min=0,
+    )
+
+    bpy.types.Scene.lidar_preview_decimation = bpy.props.IntProperty(
+        name="Preview Decimation",
+        description="Show only every Nth point in the LiDAR point cloud preview",
+        default=1,
+        min=1,
+    )
+
     bpy.types.Scene.simulation_running = bpy.props.BoolProperty(
         name="Simulation is running",
         description="turns true if simulation is running",
         default=False
     )
 
-    for lidar in lidar_data.values():
+    for lidar in lidar_models().values():
         for param_name, param_info in lidar["parameters"].items():
             prop_name = f"lidar_{param_name}"
             if param_info["type"] == "float":
@@ -394,9 +608,24 @@ def unregister_properties():
     del bpy.types.Scene.folder_path
     del bpy.types.Scene.sensor_selection_dropdown
     del bpy.types.Scene.lidar_selection_dropdown
+    del bpy.types.Scene.lidar_preview_interval
+    del bpy.types.Scene.lidar_preview_decimation
+    del bpy.types.Scene.lidar_organized
+    del bpy.types.Scene.lidar_compression
+    del bpy.types.Scene.lidar_compressor
+    del bpy.types.Scene.lidar_compression_level
+    del bpy.types.Scene.lidar_quantization
+    del bpy.types.Scene.imu_noise_seed
+    del bpy.types.Scene.cam_segmentation
+    del bpy.types.Scene.profile_simulation
+    del bpy.types.Scene.log_interval
+    del bpy.types.Scene.live_output
+    del bpy.types.Scene.frame_cache
+    for param_name in NOISE_PARAMETERS:
+        delattr(bpy.types.Scene, f"imu_{param_name}")
     del bpy.types.Scene.sensor_name
 
-    for lidar in lidar_data.values():
+    for lidar in lidar_models().values():
         for param_name, param_info in lidar["parameters"].items():
             prop_name = f"lidar_{param_name}"
             delattr(bpy.types.Scene, prop_name)
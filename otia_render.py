@@ -0,0 +1,160 @@
+"""Parallel camera rendering.
+
+    python otia_render.py scene.blend --out /data/run --workers 8 --threads 8
+    blender --background scene.blend --python otia_render.py -- --out /data/run --workers 8 --threads 8
+
+Renders the frames the camera rate asks for on a pool of background Blender workers, each
+limited to `--threads` threads, into cam/<camera>/<frame>.png. The frames are split into
+chunks that idle workers pick up; every worker evaluates a frame once for all cameras.
+The same script runs inside the workers.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+#begin preprocessing
+project_root = "/home/jan/Workspace/lidar_scanner2/otia"
+#end preprocessing
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from workers.pool import blender_command, frame_range, run_commands, split
+
+try:
+    import bpy
+except ImportError:
+    # the coordinator also runs outside of Blender
+    bpy = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# chunks per worker, so that workers which finish early pick up the remaining frames
+CHUNKS_PER_WORKER = 4
+THREADS = 8
+
+# the workers run this script as well
+SCRIPT = os.path.abspath(__file__)
+
+
+def scene_jobs(frames=None):
+    """Names of the cameras and the frames they are rendered at, from the open scene."""
+    import otia
+    from otia_panel.otia_panel import camera_frames, sensor_objects
+
+    otia.register()
+    scene = bpy.context.scene
+    frames = frames or range(scene.frame_start, scene.frame_end + 1)
+    cameras = [obj.name for obj in sensor_objects() if obj.type == 'CAMERA']
+    return {"cameras": cameras, "frames": camera_frames(scene, frames.start, frames.stop - 1)}
+
+
+def list_jobs(blender, blend_file, job_folder, frames=None):
+    """Reads the camera jobs of `blend_file` with a short background Blender run."""
+    job_path = Path(job_folder) / "jobs.json"
+    arguments = ["--list", job_path] + (["--frames", f"{frames.start}-{frames.stop - 1}"] if frames else [])
+    run_commands([blender_command(blender, blend_file, SCRIPT, arguments)], 1, Path(job_folder) / "list")
+    with open(job_path, 'r') as file:
+        return json.load(file)
+
+
+def render_parallel(blend_file, out, workers, threads=THREADS, frames=None, blender="blender", jobs=None,
+                    cache=True):
+    """Renders the cameras of `blend_file` on `workers` background Blender processes.
+
+    `jobs` holds the camera names and frames to render, by default they are read from the file.
+    With `cache` the workers skip the renders already in the frame cache.
+    Returns the number of images the jobs ask for, cached ones included.
+    """
+    job_folder = Path(out) / "render_jobs"
+    job_folder.mkdir(parents=True, exist_ok=True)
+    if jobs is None:
+        jobs = list_jobs(blender, blend_file, job_folder, frames)
+    if not jobs["cameras"] or not jobs["frames"]:
+        return 0
+
+    commands = []
+    for chunk, chunk_frames in enumerate(split(jobs["frames"], workers * CHUNKS_PER_WORKER)):
+        job_path = job_folder / f"job-{chunk:04d}.json"
+        with open(job_path, 'w') as file:
+            json.dump({"cameras": jobs["cameras"], "frames": chunk_frames, "cache": cache}, file)
+        commands.append(blender_command(blender, blend_file, SCRIPT, ["--worker", job_path, "--out", out], threads))
+
+    logger.info("Rendering %d cameras at %d frames in %d chunks on %d workers",
+                len(jobs["cameras"]), len(jobs["frames"]), len(commands), workers)
+    run_commands(commands, workers, job_folder)
+    return len(jobs["cameras"]) * len(jobs["frames"])
+
+
+def work(job_path, out):
+    """Worker side: renders the frames of one job file."""
+    import otia
+    from otia_panel.otia_panel import render_frame
+    from sensor.models.cam.segmentation import segmentation_run
+    from output.frame_cache import frame_cache
+    from output.writer import flush_outputs
+
+    otia.register()
+    with open(job_path, 'r') as file:
+        jobs = json.load(file)
+    frame_cache.enabled = jobs.get("cache", True)
+    scene = bpy.context.scene
+    cameras = [bpy.data.objects[name] for name in jobs["cameras"]]
+    with segmentation_run(scene, out) as index_output:
+        for frame in jobs["frames"]:
+            scene.frame_set(frame)
+            render_frame(scene, cameras, frame, out, index_output)
+    # the index masks are saved on the background writer
+    flush_outputs()
+
+
+def parse_args(argv, in_blender):
+    parser = argparse.ArgumentParser(prog="otia_render.py", description=__doc__.splitlines()[0])
+    if not in_blender:
+        parser.add_argument("blend_file", help="scene to render")
+        parser.add_argument("--blender", default="blender", help="Blender executable of the workers")
+    parser.add_argument("--out", required=True, help="output folder")
+    parser.add_argument("--frames", type=frame_range, help="first-last frame, defaults to the scene's frame range")
+    parser.add_argument("--threads", type=int, default=THREADS, help="threads of every worker")
+    parser.add_argument("--workers", type=int, help="number of workers, defaults to the cores divided by the threads")
+    parser.add_argument("--no-cache", action="store_true", help="render every frame, even those already in the output")
+    # used by the coordinator to talk to the workers
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--list", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main():
+    in_blender = bpy is not None
+    argv = sys.argv[sys.argv.index("--") + 1:] if in_blender and "--" in sys.argv else sys.argv[1:]
+    args = parse_args(argv, in_blender)
+
+    if args.worker:
+        work(args.worker, args.out)
+        return
+    if args.list:
+        with open(args.list, 'w') as file:
+            json.dump(scene_jobs(args.frames), file)
+        return
+
+    workers = args.workers or max(1, (os.cpu_count() or 1) // args.threads)
+    started = time.perf_counter()
+    if in_blender:
+        rendered = render_parallel(bpy.data.filepath, args.out, workers, args.threads,
+                                   blender=bpy.app.binary_path, jobs=scene_jobs(args.frames), cache=not args.no_cache)
+    else:
+        rendered = render_parallel(args.blend_file, args.out, workers, args.threads, args.frames, args.blender,
+                                   cache=not args.no_cache)
+    print(f"Rendered {rendered} images on {workers} workers in {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception:
+        logger.exception("Rendering failed")
+        sys.exit(1)
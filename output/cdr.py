@@ -0,0 +1,141 @@
+"""CDR (XCDR1, little endian) serialization of the ROS 2 messages the sensors publish.
+
+Only the standard library and NumPy are used, so bags are written without a ROS installation.
+"""
+import struct
+
+import numpy as np
+
+# encapsulation header of little endian plain CDR
+CDR_HEADER = b"\x00\x01\x00\x00"
+
+# sensor_msgs/PointField datatypes of NumPy field types
+POINT_FIELD_TYPES = {
+    np.dtype("i1"): 1, np.dtype("u1"): 2, np.dtype("<i2"): 3, np.dtype("<u2"): 4,
+    np.dtype("<i4"): 5, np.dtype("<u4"): 6, np.dtype("<f4"): 7, np.dtype("<f8"): 8,
+}
+
+# image encodings of single channel arrays
+IMAGE_ENCODINGS = {np.dtype("u1"): "mono8", np.dtype("<u2"): "16UC1", np.dtype("<f4"): "32FC1"}
+
+
+class CdrWriter:
+    """Appends primitives with CDR alignment, relative to the end of the encapsulation header."""
+
+    def __init__(self):
+        self.buffer = bytearray(CDR_HEADER)
+
+    def _align(self, size):
+        padding = -(len(self.buffer) - len(CDR_HEADER)) % size
+        self.buffer += b"\x00" * padding
+
+    def pack(self, fmt, *values):
+        self._align(struct.calcsize(fmt[-1]))
+        self.buffer += struct.pack("<" + fmt, *values)
+
+    def string(self, value):
+        encoded = value.encode() + b"\x00"
+        self.pack("I", len(encoded))
+        self.buffer += encoded
+
+    def octets(self, data):
+        """uint8[] sequence."""
+        data = memoryview(data).cast("B")
+        self.pack("I", len(data))
+        self.buffer += data
+
+    def header(self, stamp_ns, frame_id):
+        """std_msgs/Header of a stamp in nanoseconds."""
+        seconds, nanoseconds = divmod(int(stamp_ns), 1_000_000_000)
+        self.pack("iI", seconds, nanoseconds)
+        self.string(frame_id)
+
+    def bytes(self):
+        return bytes(self.buffer)
+
+
+def point_cloud2(stamp_ns, frame_id, records, height=1):
+    """sensor_msgs/PointCloud2 of packed structured records; `height` rows for organized clouds."""
+    writer = CdrWriter()
+    writer.header(stamp_ns, frame_id)
+    width = len(records) // height if height else 0
+    writer.pack("II", height, width)
+    writer.pack("I", len(records.dtype.names))
+    for name in records.dtype.names:
+        field_dtype, offset = records.dtype.fields[name][:2]
+        writer.string(name)
+        writer.pack("I", offset)
+        writer.pack("B", POINT_FIELD_TYPES[field_dtype])
+        writer.pack("I", 1)
+    writer.pack("B", 0)  # is_bigendian
+    writer.pack("II", records.dtype.itemsize, records.dtype.itemsize * width)
+    writer.octets(np.ascontiguousarray(records).view(np.uint8).reshape(-1))
+    # dense unless some point is NaN, like the invalid pixels of an organized cloud
+    dense = not any(np.isnan(records[name]).any() for name in records.dtype.names
+                    if records.dtype.fields[name][0].kind == 'f')
+    writer.pack("B", dense)
+    return writer.bytes()
+
+
+def imu(stamp_ns, frame_id, orientation, angular_velocity, linear_acceleration):
+    """sensor_msgs/Imu; `orientation` is a (w, x, y, z) quaternion, covariances are unknown (0)."""
+    writer = CdrWriter()
+    writer.header(stamp_ns, frame_id)
+    w, x, y, z = orientation
+    writer.pack("4d", x, y, z, w)
+    writer.pack("9d", *[0.0] * 9)
+    writer.pack("3d", *angular_velocity)
+    writer.pack("9d", *[0.0] * 9)
+    writer.pack("3d", *linear_acceleration)
+    writer.pack("9d", *[0.0] * 9)
+    return writer.bytes()
+
+
+def imu_block(stamps_ns, frame_id, orientations, angular_velocities, linear_accelerations):
+    """Serialized sensor_msgs/Imu of many samples of one frame id, which all share one layout:
+    a (N, size) uint8 array, one message per row."""
+    writer = CdrWriter()
+    writer.header(0, frame_id)
+    writer._align(8)
+    start = len(writer.buffer)
+    template = np.frombuffer(imu(0, frame_id, (1.0, 0.0, 0.0, 0.0), (0, 0, 0), (0, 0, 0)), dtype=np.uint8)
+    layout = np.dtype({
+        "names": ["seconds", "nanoseconds", "orientation", "angular_velocity", "linear_acceleration"],
+        "formats": ["<i4", "<u4", ("<f8", 4), ("<f8", 3), ("<f8", 3)],
+        "offsets": [4, 8, start, start + 104, start + 200],
+        "itemsize": len(template),
+    })
+    messages = np.empty((len(stamps_ns), len(template)), dtype=np.uint8)
+    messages[:] = template
+    fields = messages.view(layout).reshape(-1)
+    seconds, nanoseconds = np.divmod(np.asarray(stamps_ns, dtype=np.int64), 1_000_000_000)
+    fields["seconds"] = seconds
+    fields["nanoseconds"] = nanoseconds
+    # (w, x, y, z) to the message's (x, y, z, w)
+    fields["orientation"] = np.roll(orientations, -1, axis=1)
+    fields["angular_velocity"] = angular_velocities
+    fields["linear_acceleration"] = linear_accelerations
+    return messages
+
+
+def image(stamp_ns, frame_id, pixels):
+    """sensor_msgs/Image of a single channel (H, W) array."""
+    pixels = np.ascontiguousarray(pixels)
+    writer = CdrWriter()
+    writer.header(stamp_ns, frame_id)
+    height, width = pixels.shape
+    writer.pack("II", height, width)
+    writer.string(IMAGE_ENCODINGS[pixels.dtype])
+    writer.pack("B", 0)  # is_bigendian
+    writer.pack("I", width * pixels.dtype.itemsize)
+    writer.octets(pixels.view(np.uint8).reshape(-1))
+    return writer.bytes()
+
+
+def compressed_image(stamp_ns, frame_id, data, image_format="png"):
+    """sensor_msgs/CompressedImage of an encoded image file."""
+    writer = CdrWriter()
+    writer.header(stamp_ns, frame_id)
+    writer.string(image_format)
+    writer.octets(data)
+    return writer.bytes()
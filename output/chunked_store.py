@@ -0,0 +1,202 @@
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from output.codec import codec_from_spec
+from output.frame_cache import FrameKeys
+from output.profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 1
+# a new chunk file is started once the current one would grow past this size
+CHUNK_BYTES = 1 << 30
+
+# one record per appended frame; later records for the same frame replace earlier ones
+INDEX_DTYPE = np.dtype([
+    ("frame", "<i8"),
+    ("chunk", "<u4"),
+    ("count", "<u4"),
+    ("offset", "<u8"),
+    ("nbytes", "<u8"),
+])
+
+
+def _dtype_from_header(descr):
+    return np.dtype([tuple(field) for field in descr])
+
+
+def chunk_path(folder, name, chunk):
+    return Path(folder) / f"{name}-{chunk:05d}.bin"
+
+
+class ChunkedWriter:
+    """Append-only store of structured per frame arrays for one sensor.
+
+    The folder holds `<name>.json` with the record dtype and optional metadata describing the
+    records (the image shape of range images, ...), `<name>-NNNNN.bin` chunk files with
+    the records of all frames back to back, and `<name>.idx` with one INDEX_DTYPE row per frame.
+    Data is flushed before its index row, so an interrupted run never indexes missing data.
+    With a `codec` (output.codec) every frame is stored encoded; `append` encodes on the
+    calling thread, which is the background writer during a simulation.
+    """
+
+    def __init__(self, folder, dtype, name="points", chunk_bytes=CHUNK_BYTES, metadata=None, codec=None):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.dtype = np.dtype(dtype)
+        self.name = name
+        self.chunk_bytes = chunk_bytes
+        self.codec = codec
+
+        header_path = self.folder / f"{name}.json"
+        codec_spec = codec.spec if codec is not None else None
+        if header_path.exists():
+            with open(header_path, 'r') as file:
+                header = json.load(file)
+            stored = _dtype_from_header(header["dtype"])
+            if stored != self.dtype:
+                raise ValueError(f"{header_path} stores records of {stored}, not {self.dtype}")
+            if header.get("codec") != codec_spec:
+                raise ValueError(f"{header_path} stores frames encoded with {header.get('codec')}, not {codec_spec}")
+        else:
+            with open(header_path, 'w') as file:
+                json.dump({"version": STORE_VERSION, "dtype": self.dtype.descr, "metadata": metadata or {},
+                           "codec": codec_spec}, file)
+
+        index_path = self.folder / f"{name}.idx"
+        index_size = index_path.stat().st_size if index_path.exists() else 0
+        complete = index_size - index_size % INDEX_DTYPE.itemsize
+        self.index = open(index_path, 'ab')
+        if complete != index_size:
+            logger.warning("Dropping a partial index record of %s", index_path)
+            self.index.truncate(complete)
+
+        chunk, offset = 0, 0
+        if complete:
+            with open(index_path, 'rb') as file:
+                file.seek(complete - INDEX_DTYPE.itemsize)
+                last = np.frombuffer(file.read(INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)[0]
+            chunk, offset = int(last["chunk"]), int(last["offset"] + last["nbytes"])
+        self.data = None
+        self._open_chunk(chunk, offset)
+
+    def _open_chunk(self, chunk, offset):
+        if self.data is not None:
+            self.data.close()
+        self.chunk = chunk
+        self.offset = offset
+        self.data = open(chunk_path(self.folder, self.name, chunk), 'ab')
+        # bytes behind the last indexed frame belong to an interrupted write
+        self.data.truncate(offset)
+
+    def append(self, frame, records):
+        records = np.ascontiguousarray(records, dtype=self.dtype)
+        if self.codec is None:
+            payload = records.view(np.uint8).reshape(-1)
+        else:
+            with profiler.stage(self.folder.name, "encode", frame) as counters:
+                payload = np.frombuffer(self.codec.encode(records), dtype=np.uint8)
+                counters["bytes"] = records.nbytes
+        self.write(frame, payload, len(records))
+
+    def write(self, frame, payload, count):
+        """Appends an already serialized frame of `count` records."""
+        nbytes = len(payload)
+        with profiler.stage(self.folder.name, "write", frame) as counters:
+            if self.offset and self.offset + nbytes > self.chunk_bytes:
+                self._open_chunk(self.chunk + 1, 0)
+
+            self.data.write(payload)
+            self.data.flush()
+
+            entry = np.array([(frame, self.chunk, count, self.offset, nbytes)], dtype=INDEX_DTYPE)
+            self.index.write(entry.tobytes())
+            self.index.flush()
+            self.offset += nbytes
+            counters["bytes"] = nbytes
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self.index.close()
+
+
+class ChunkedReader:
+    """Reads a ChunkedWriter folder; every frame is a zero copy view into a memory-mapped chunk,
+    or a decoded copy if the store has a codec."""
+
+    def __init__(self, folder, name="points"):
+        self.folder = Path(folder)
+        self.name = name
+        with open(self.folder / f"{name}.json", 'r') as file:
+            self.header = json.load(file)
+        self.dtype = _dtype_from_header(self.header["dtype"])
+        self.metadata = self.header.get("metadata", {})
+        self.codec = codec_from_spec(self.header.get("codec"))
+
+        index_path = self.folder / f"{name}.idx"
+        size = index_path.stat().st_size
+        index = np.fromfile(index_path, dtype=INDEX_DTYPE, count=size // INDEX_DTYPE.itemsize)
+        # the last record of a frame wins
+        self.entries = {int(entry["frame"]): entry for entry in index}
+        self.frames = np.array(sorted(self.entries), dtype=np.int64)
+        self._chunks = {}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, frame):
+        return frame in self.entries
+
+    def __iter__(self):
+        for frame in self.frames:
+            yield int(frame), self.frame(int(frame))
+
+    def _chunk(self, chunk):
+        if chunk not in self._chunks:
+            self._chunks[chunk] = np.memmap(chunk_path(self.folder, self.name, chunk), dtype=np.uint8, mode='r')
+        return self._chunks[chunk]
+
+    def payload(self, frame):
+        """Raw bytes of a frame as a uint8 view."""
+        entry = self.entries[frame]
+        if entry["nbytes"] == 0:
+            return np.zeros(0, dtype=np.uint8)
+        offset = int(entry["offset"])
+        return self._chunk(int(entry["chunk"]))[offset:offset + int(entry["nbytes"])]
+
+    def frame(self, frame):
+        if self.codec is not None:
+            return self.codec.decode(self.payload(frame), self.dtype, int(self.entries[frame]["count"]))
+        return self.payload(frame).view(self.dtype)
+
+
+def merge_stores(sources, target, name="points"):
+    """Appends every frame of the `sources` stores, in the given order, to the store in `target`.
+    Encoded frames are copied as they are.
+
+    Used to join the stores of frame-range shards; the result is the store a single run over
+    all shards would have written. Frames the target already holds under the same frame cache
+    key are not copied again, the keys of the others are carried over.
+    """
+    writer = None
+    target_keys = FrameKeys(target)
+    try:
+        for source in sources:
+            reader = ChunkedReader(source, name)
+            source_keys = FrameKeys(source)
+            if writer is None:
+                writer = ChunkedWriter(target, reader.dtype, name, metadata=reader.metadata, codec=reader.codec)
+            for frame in reader.frames.tolist():
+                key = source_keys.get(frame)
+                if key is not None and target_keys.get(frame) == key:
+                    continue
+                writer.write(frame, reader.payload(frame), int(reader.entries[frame]["count"]))
+                target_keys.record(frame, key)
+    finally:
+        if writer is not None:
+            writer.close()
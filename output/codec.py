@@ -0,0 +1,151 @@
+"""Compressed encoding of lidar records in the chunked stores.
+
+A frame is encoded field by field. Every field is predicted from the previous record of its
+scan line and only the residuals are kept: integers and quantized floats as differences, floats
+kept losslessly as the XOR of their bits. Points with a `ring` field are grouped by ring for
+this, range images follow their rows. The residuals are zigzag coded into the narrowest of
+uint8/16/32/64, split into byte planes and compressed with zlib or lzma.
+
+Quantization rounds lengths (x, y, z, range) to `quantization` metres and the other float
+fields to QUANTIZATION_STEPS. Decoding is a few vectorized NumPy passes per field.
+"""
+import lzma
+import zlib
+
+import numpy as np
+
+COMPRESSORS = {
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+# fields quantized to the codec's `quantization`, in metres
+LENGTH_FIELDS = ("x", "y", "z", "range")
+# quantization steps of the other float fields: intensity in 1/100, radians and seconds
+QUANTIZATION_STEPS = {"intensity": 0.01, "azimuth": 1e-6, "time": 1e-7}
+# field whose values name the scan line of a record
+SCAN_LINE_FIELD = "ring"
+
+
+def _zigzag(residuals):
+    residuals = residuals.astype(np.int64)
+    return ((residuals << 1) ^ (residuals >> 63)).view(np.uint64)
+
+
+def _unzigzag(codes):
+    codes = codes.astype(np.uint64)
+    return (codes >> np.uint64(1)).astype(np.int64) ^ -(codes & np.uint64(1)).astype(np.int64)
+
+
+def _pack(codes):
+    """Width byte plus the byte planes of `codes` in the narrowest unsigned type holding them."""
+    largest = int(codes.max()) if len(codes) else 0
+    width = next(width for width in (1, 2, 4, 8) if largest < 1 << (8 * width))
+    planes = codes.astype(f"<u{width}").view(np.uint8).reshape(-1, width).T
+    return bytes([width]) + planes.tobytes()
+
+
+def _unpack(data, offset, count):
+    width = data[offset]
+    planes = np.frombuffer(data, dtype=np.uint8, count=count * width, offset=offset + 1)
+    codes = np.ascontiguousarray(planes.reshape(width, count).T).view(f"<u{width}").ravel()
+    return codes, offset + 1 + count * width
+
+
+class LidarCodec:
+    """Encodes structured lidar records (points or range image pixels) into compressed frames.
+
+    `quantization` is the length step in metres, None keeps every value exactly.
+    """
+
+    def __init__(self, compressor="zlib", level=6, quantization=None):
+        if compressor not in COMPRESSORS:
+            raise ValueError(f"Unknown compressor {compressor}, expected one of {sorted(COMPRESSORS)}")
+        self.compressor = compressor
+        self.level = level
+        self.quantization = quantization
+        self._compress, self._decompress = COMPRESSORS[compressor]
+
+    @property
+    def spec(self):
+        """JSON description stored in the store header."""
+        return {"name": "lidar", "compressor": self.compressor, "level": self.level,
+                "quantization": self.quantization}
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(spec["compressor"], spec["level"], spec["quantization"])
+
+    def step(self, name, dtype):
+        """Quantization step of a field, None for fields kept exactly."""
+        if self.quantization is None or dtype.kind != 'f':
+            return None
+        if name in LENGTH_FIELDS:
+            return self.quantization
+        return QUANTIZATION_STEPS.get(name)
+
+    @staticmethod
+    def _fields(dtype):
+        # the scan line field is decoded first, the other fields follow its order
+        names = list(dtype.names)
+        if SCAN_LINE_FIELD in names:
+            names.remove(SCAN_LINE_FIELD)
+            names.insert(0, SCAN_LINE_FIELD)
+        return names
+
+    def encode(self, records):
+        columns = []
+        order = None
+        for name in self._fields(records.dtype):
+            values = records[name]
+            if order is not None:
+                values = values[order]
+            columns.append(self._encode_field(values, self.step(name, records.dtype.fields[name][0])))
+            if name == SCAN_LINE_FIELD:
+                order = np.argsort(values, kind='stable')
+        return self._compress(b"".join(columns), self.level)
+
+    def decode(self, payload, dtype, count):
+        """Records of a frame encoded by `encode`."""
+        data = self._decompress(bytes(payload))
+        records = np.empty(count, dtype=dtype)
+        offset, order = 0, None
+        for name in self._fields(dtype):
+            field_dtype = dtype.fields[name][0]
+            codes, offset = _unpack(data, offset, count)
+            values = self._decode_field(codes, field_dtype, self.step(name, field_dtype))
+            if order is None:
+                records[name] = values
+            else:
+                records[name][order] = values
+            if name == SCAN_LINE_FIELD:
+                order = np.argsort(values, kind='stable')
+        return records
+
+    @staticmethod
+    def _encode_field(values, step):
+        if step is not None:
+            quantized = np.rint(values.astype(np.float64) / step).astype(np.int64)
+            return _pack(_zigzag(np.diff(quantized, prepend=0)))
+        if values.dtype.kind in 'iu':
+            return _pack(_zigzag(np.diff(values.astype(np.int64), prepend=0)))
+        bits = values.view(f"<u{values.dtype.itemsize}")
+        return _pack(bits ^ np.concatenate(([0], bits[:-1])).astype(bits.dtype))
+
+    @staticmethod
+    def _decode_field(codes, dtype, step):
+        if step is not None:
+            return (np.cumsum(_unzigzag(codes)) * step).astype(dtype)
+        if dtype.kind in 'iu':
+            return np.cumsum(_unzigzag(codes)).astype(dtype)
+        bits = np.bitwise_xor.accumulate(codes.astype(f"<u{dtype.itemsize}"))
+        return bits.view(dtype)
+
+
+def codec_from_spec(spec):
+    """Codec of a store header entry, None for stores of raw records."""
+    if spec is None:
+        return None
+    if spec["name"] != "lidar":
+        raise ValueError(f"Unknown store codec {spec['name']}")
+    return LidarCodec.from_spec(spec)
@@ -0,0 +1,124 @@
+"""Content addressed cache of sensor frames, so a re-run only recomputes what changed.
+
+Every frame a sensor writes is keyed by a hash of everything its output depends on: the scene
+geometry revision, the sensor's pose, its model and parameters (seed included) and the frame.
+The sensor folder remembers the key of each frame it holds in `frames.keys`; a frame whose key
+is unchanged is skipped. Keys are recorded only after the frame's data is written, so an
+interrupted run never marks a missing frame as done, and a frame written without a key forgets
+the one it had.
+"""
+import hashlib
+import json
+import logging
+import threading
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# bumped whenever the output of unchanged inputs changes, which invalidates every cached frame
+CACHE_VERSION = 1
+KEY_BYTES = 16
+KEYS_FILE = "frames.keys"
+
+# one record per written frame; later records for the same frame replace earlier ones
+KEY_DTYPE = np.dtype([("frame", "<i8"), ("key", f"S{KEY_BYTES}")])
+# recorded for a frame rewritten without a key
+NO_KEY = bytes(KEY_BYTES)
+
+
+def _update(digest, value):
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        digest.update(f"array {value.dtype.str} {value.shape}".encode())
+        digest.update(value.view(np.uint8).reshape(-1).data)
+    elif isinstance(value, (bytes, bytearray)):
+        digest.update(b"bytes %d " % len(value))
+        digest.update(value)
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"list %d " % len(value))
+        for item in value:
+            _update(digest, item)
+    else:
+        # dicts, strings and numbers; float reprs round trip exactly
+        digest.update(json.dumps(value, sort_keys=True, default=repr).encode())
+    digest.update(b";")
+
+
+def content_key(*parts):
+    """Key of the frame computed from `parts`: NumPy arrays, bytes, lists and JSON values."""
+    digest = hashlib.blake2b(digest_size=KEY_BYTES)
+    _update(digest, CACHE_VERSION)
+    for part in parts:
+        _update(digest, part)
+    return digest.digest()
+
+
+class FrameKeys:
+    """The `frames.keys` file of a sensor folder."""
+
+    def __init__(self, folder):
+        self.path = Path(folder) / KEYS_FILE
+        self.keys = {}
+        if self.path.exists():
+            size = self.path.stat().st_size
+            records = np.fromfile(self.path, dtype=KEY_DTYPE, count=size // KEY_DTYPE.itemsize)
+            keys = {int(record["frame"]): bytes(record["key"]).ljust(KEY_BYTES, b"\0") for record in records}
+            self.keys = {frame: key for frame, key in keys.items() if key != NO_KEY}
+            if size % KEY_DTYPE.itemsize:
+                logger.warning("Dropping a partial key record of %s", self.path)
+                with open(self.path, 'ab') as file:
+                    file.truncate(size - size % KEY_DTYPE.itemsize)
+
+    def get(self, frame):
+        return self.keys.get(frame)
+
+    def record(self, frame, key):
+        """Records the key of a written frame; a None `key` forgets the frame's key."""
+        if self.keys.get(frame) == key:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'ab') as file:
+            file.write(np.array([(frame, NO_KEY if key is None else key)], dtype=KEY_DTYPE).tobytes())
+        if key is None:
+            del self.keys[frame]
+        else:
+            self.keys[frame] = key
+
+
+class FrameCache:
+    """Frame keys of every sensor folder of the run.
+
+    While disabled every lookup misses and callers compute no keys, so all frames are
+    recomputed and forget their keys. `record` runs on the background writer after the frame's
+    own write, under the same folder key, so it follows the data to disk.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.folders = {}
+
+    def keys(self, folder):
+        folder = str(folder)
+        with self.lock:
+            if folder not in self.folders:
+                self.folders[folder] = FrameKeys(folder)
+            return self.folders[folder]
+
+    def hit(self, folder, frame, key):
+        """True if `folder` holds `frame` computed from the same inputs."""
+        return self.enabled and key is not None and self.keys(folder).get(frame) == key
+
+    def record(self, folder, frame, key):
+        self.keys(folder).record(frame, key)
+
+    def clear(self):
+        """Forgets the loaded keys, a new run reads them from the folders again."""
+        with self.lock:
+            self.folders.clear()
+
+
+# frame cache of the running simulation
+frame_cache = FrameCache()
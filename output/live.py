@@ -0,0 +1,299 @@
+"""Live output: every sensor publishes its frames into a shared memory ring buffer that other
+processes on the machine read as they are produced, without serialization or files.
+
+    python -m output.live <sensor> [<sensor> ...]      stand-in consumer printing every frame
+
+A ring is the shared memory block `otia-<sensor>`:
+
+    RING_DTYPE header      magic, version, slot count and size, frames published, closed flag
+    dtype                  JSON `descr` of the records, DTYPE_BYTES long
+    slots                  SLOT_DTYPE header plus up to `slot_bytes` of raw records each
+
+Frame n goes to slot n % slots. The single writer marks the slot with the odd sequence 2n + 1
+while copying the records and with 2n + 2 once it is complete, then counts it as published.
+Readers never block the writer: a frame is intact as long as its slot still holds 2n + 2, and
+readers falling more than `slots` frames behind skip to the oldest frame left.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import re
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RING_PREFIX = "otia-"
+RING_MAGIC = b"OTIA"
+RING_VERSION = 1
+SLOTS = 4
+DTYPE_BYTES = 4096
+# slot payloads start at multiples of this
+ALIGNMENT = 64
+POLL_INTERVAL = 0.001
+
+RING_DTYPE = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u4"),
+    ("slots", "<u4"),
+    ("dtype_bytes", "<u4"),
+    ("slot_bytes", "<u8"),
+    ("published", "<u8"),
+    ("closed", "<u8"),
+])
+SLOT_DTYPE = np.dtype({
+    "names": ["sequence", "frame", "time", "count", "nbytes"],
+    "formats": ["<u8", "<i8", "<f8", "<u8", "<u8"],
+    "offsets": [0, 8, 16, 24, 32],
+    "itemsize": ALIGNMENT,
+})
+
+# a complete frame of a ring; `records` is a view into the shared memory
+LiveFrame = collections.namedtuple("LiveFrame", ["sequence", "frame", "time", "records"])
+
+
+def _aligned(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def ring_name(sensor):
+    return RING_PREFIX + re.sub(r"[^A-Za-z0-9_.-]", "_", str(sensor))
+
+
+class _Ring:
+    """Views of the header, the slot headers and the payloads of a ring in `buffer`."""
+
+    def __init__(self, buffer):
+        self.header = np.ndarray((), dtype=RING_DTYPE, buffer=buffer)
+        slots, slot_bytes = int(self.header["slots"]), int(self.header["slot_bytes"])
+        stride = SLOT_DTYPE.itemsize + slot_bytes
+        start = _aligned(RING_DTYPE.itemsize) + DTYPE_BYTES
+        self.slots = [np.ndarray((), dtype=SLOT_DTYPE, buffer=buffer, offset=start + slot * stride)
+                      for slot in range(slots)]
+        self.payloads = [np.ndarray(slot_bytes, dtype=np.uint8, buffer=buffer,
+                                    offset=start + slot * stride + SLOT_DTYPE.itemsize)
+                         for slot in range(slots)]
+
+
+def ring_bytes(slot_bytes, slots):
+    return _aligned(RING_DTYPE.itemsize) + DTYPE_BYTES + slots * (SLOT_DTYPE.itemsize + _aligned(slot_bytes))
+
+
+class LivePublisher:
+    """Writer of a sensor's ring, created for records of `dtype` up to `slot_bytes` per frame.
+    A ring left behind by a crashed run of the same sensor is replaced."""
+
+    def __init__(self, sensor, dtype, slot_bytes, slots=SLOTS):
+        self.sensor = sensor
+        self.dtype = np.dtype(dtype)
+        slot_bytes = _aligned(max(int(slot_bytes), self.dtype.itemsize))
+        descr = json.dumps(self.dtype.descr).encode()
+        if len(descr) > DTYPE_BYTES:
+            raise ValueError(f"The record dtype of {sensor} does not fit into the ring header")
+
+        name = ring_name(sensor)
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=ring_bytes(slot_bytes, slots))
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.memory = shared_memory.SharedMemory(name, create=True, size=ring_bytes(slot_bytes, slots))
+
+        header = np.ndarray((), dtype=RING_DTYPE, buffer=self.memory.buf)
+        header[()] = (RING_MAGIC, RING_VERSION, slots, len(descr), slot_bytes, 0, 0)
+        start = _aligned(RING_DTYPE.itemsize)
+        self.memory.buf[start:start + len(descr)] = descr
+        self.ring = _Ring(self.memory.buf)
+
+    @property
+    def slot_bytes(self):
+        return int(self.ring.header["slot_bytes"])
+
+    def publish(self, frame, time, records):
+        """Copies the records of a frame into the next slot; the only copy a reader needs."""
+        records = np.ascontiguousarray(records, dtype=self.dtype)
+        if records.nbytes > self.slot_bytes:
+            raise ValueError(f"{records.nbytes} bytes of {self.sensor} exceed its {self.slot_bytes} byte slots")
+        sequence = int(self.ring.header["published"])
+        slot = self.ring.slots[sequence % len(self.ring.slots)]
+        slot["sequence"] = 2 * sequence + 1
+        self.ring.payloads[sequence % len(self.ring.slots)][:records.nbytes] = records.view(np.uint8).reshape(-1)
+        slot["frame"] = frame
+        slot["time"] = time
+        slot["count"] = len(records)
+        slot["nbytes"] = records.nbytes
+        slot["sequence"] = 2 * sequence + 2
+        self.ring.header["published"] = sequence + 1
+
+    def close(self):
+        """Tells the readers no more frames follow and removes the ring; attached readers keep
+        their mapping until they close it."""
+        self.ring.header["closed"] = 1
+        self.ring = None
+        self.memory.close()
+        self.memory.unlink()
+
+
+class LiveReader:
+    """Reads the frames of a sensor's ring in order, from another process than the writer.
+
+    `next` returns the frame after the last one read as a zero copy LiveFrame. Its records stay
+    valid until the writer reuses the slot, `slots` frames later; `intact` tells whether that
+    happened, `copy` the records to keep them. Frames the reader was too slow for are counted
+    in `dropped`.
+    """
+
+    def __init__(self, sensor):
+        self.sensor = sensor
+        # the writer owns the ring, the reader's resource tracker must not remove it
+        try:
+            self.memory = shared_memory.SharedMemory(ring_name(sensor), track=False)
+        except TypeError:
+            # before Python 3.13 attaching always registers the block
+            self.memory = shared_memory.SharedMemory(ring_name(sensor))
+            if os.name == "posix":
+                resource_tracker.unregister(self.memory._name, "shared_memory")
+        header = np.ndarray((), dtype=RING_DTYPE, buffer=self.memory.buf)
+        if bytes(header["magic"]) != RING_MAGIC or int(header["version"]) != RING_VERSION:
+            raise ValueError(f"{ring_name(sensor)} is not a version {RING_VERSION} otia ring")
+        start = _aligned(RING_DTYPE.itemsize)
+        descr = json.loads(bytes(self.memory.buf[start:start + int(header["dtype_bytes"])]))
+        self.dtype = np.dtype([tuple(field) for field in descr])
+        self.ring = _Ring(self.memory.buf)
+        self.sequence = 0
+        self.dropped = 0
+
+    @property
+    def closed(self):
+        return bool(self.ring.header["closed"])
+
+    def intact(self, frame):
+        slot = self.ring.slots[frame.sequence % len(self.ring.slots)]
+        return int(slot["sequence"]) == 2 * frame.sequence + 2
+
+    def _read(self, sequence):
+        slot = self.ring.slots[sequence % len(self.ring.slots)]
+        if int(slot["sequence"]) != 2 * sequence + 2:
+            return None
+        records = self.ring.payloads[sequence % len(self.ring.slots)][:int(slot["nbytes"])].view(self.dtype)
+        frame = LiveFrame(sequence, int(slot["frame"]), float(slot["time"]), records)
+        # the slot may have been rewritten while its header was read
+        return frame if int(slot["sequence"]) == 2 * sequence + 2 else None
+
+    def latest(self):
+        """The newest complete frame, None before the first one."""
+        published = int(self.ring.header["published"])
+        return self._read(published - 1) if published else None
+
+    def next(self, timeout=None):
+        """The next frame in order, waiting up to `timeout` seconds (forever if None) for it.
+        Returns None on timeout or once the writer closed the ring and every frame was read."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            published = int(self.ring.header["published"])
+            oldest = max(0, published - len(self.ring.slots))
+            if self.sequence < oldest:
+                self.dropped += oldest - self.sequence
+                self.sequence = oldest
+            if self.sequence < published:
+                frame = self._read(self.sequence)
+                if frame is None:
+                    # overwritten while we looked, the oldest frame moved on
+                    continue
+                self.sequence += 1
+                return frame
+            if self.closed or (deadline is not None and time.monotonic() >= deadline):
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def __iter__(self):
+        while True:
+            frame = self.next()
+            if frame is None:
+                return
+            yield frame
+
+    def close(self):
+        self.ring = None
+        self.memory.close()
+
+
+class LiveOutput:
+    """Live publishing of the running simulation, one ring per sensor.
+
+    While disabled `publish` returns at once, so the sensors can call it unconditionally.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.publishers = {}
+
+    def publish(self, sensor, frame, time, records, capacity=None):
+        """Publishes a frame of `sensor`. Its ring is created on the first frame with slots for
+        `capacity` records (the frame's own size by default); larger frames are dropped."""
+        if not self.enabled:
+            return
+        publisher = self.publishers.get(sensor)
+        if publisher is None:
+            slot_bytes = max(capacity or 0, len(records)) * records.dtype.itemsize
+            publisher = self.publishers[sensor] = LivePublisher(sensor, records.dtype, slot_bytes)
+        try:
+            publisher.publish(frame, time, records)
+        except ValueError as e:
+            logger.warning("Frame %d of %s not published live: %s", frame, sensor, e)
+
+    def close(self):
+        """Closes every ring, their readers see the end of the streams."""
+        for publisher in self.publishers.values():
+            publisher.close()
+        self.publishers.clear()
+
+
+# live output of the running simulation
+live_output = LiveOutput()
+
+
+def consume(sensors, timeout=None):
+    """Stand-in consumer: prints every frame of the `sensors` until their rings close."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    readers, finished = {}, set()
+    while len(finished) < len(sensors):
+        for sensor in sensors:
+            if sensor in readers or sensor in finished:
+                continue
+            try:
+                readers[sensor] = LiveReader(sensor)
+            except FileNotFoundError:
+                pass
+        for sensor, reader in list(readers.items()):
+            frame = reader.next(timeout=0)
+            while frame is not None:
+                print(f"{sensor:<24} frame {frame.frame:>8} time {frame.time:10.4f} s "
+                      f"{len(frame.records):>8} records  dropped {reader.dropped}", flush=True)
+                frame = reader.next(timeout=0)
+            if reader.closed:
+                reader.close()
+                del readers[sensor]
+                finished.add(sensor)
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        time.sleep(POLL_INTERVAL)
+    for reader in readers.values():
+        reader.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m output.live", description=__doc__.splitlines()[0])
+    parser.add_argument("sensors", nargs="+", help="names of the sensors to follow")
+    parser.add_argument("--timeout", type=float, help="stop after this many seconds")
+    args = parser.parse_args(argv)
+    consume(args.sensors, args.timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import collections
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# seconds between two hot loop log lines with the same key
+LOG_INTERVAL = 5.0
+
+StageEvent = collections.namedtuple("StageEvent", ["sensor", "stage", "frame", "start", "duration", "thread", "counters"])
+
+
+class Profiler:
+    """Timers and counters of the simulation hot path, per sensor, frame and stage.
+
+    `stage` times a block and records the counters (rays, hits, bytes, ...) the block adds to
+    the dict it yields. While disabled it only yields a throwaway dict, so the instrumentation
+    can stay in the hot loop. Events are exported as a Chrome trace (chrome://tracing, Perfetto)
+    and summarized per sensor and stage.
+
+    `log` is the rate limited logging of the hot loop: one line per key and `log_interval`
+    seconds, none at all when `log_interval` is None.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.log_interval = LOG_INTERVAL
+        self._logged = {}
+        self.clear()
+
+    def clear(self):
+        self.events = []
+        self.origin = time.perf_counter_ns()
+
+    @contextlib.contextmanager
+    def stage(self, sensor, stage, frame=None):
+        counters = {}
+        if not self.enabled:
+            yield counters
+            return
+        started = time.perf_counter_ns()
+        try:
+            yield counters
+        finally:
+            # list appends are atomic, the writer threads record their stages as well
+            self.events.append(StageEvent(sensor, stage, frame, started, time.perf_counter_ns() - started,
+                                          threading.current_thread().name, counters))
+
+    def log(self, log, key, message, *args, level=logging.INFO):
+        if self.log_interval is None:
+            return
+        now = time.monotonic()
+        if now - self._logged.get(key, -self.log_interval) < self.log_interval:
+            return
+        self._logged[key] = now
+        log.log(level, message, *args)
+
+    def summary(self):
+        """{(sensor, stage): {"calls", "seconds", counters...}} over all recorded events."""
+        totals = {}
+        for event in list(self.events):
+            total = totals.setdefault((event.sensor, event.stage), {"calls": 0, "seconds": 0.0})
+            total["calls"] += 1
+            total["seconds"] += event.duration / 1e9
+            for name, value in event.counters.items():
+                total[name] = total.get(name, 0) + value
+        return totals
+
+    def summary_table(self):
+        totals = self.summary()
+        counter_names = sorted({name for total in totals.values() for name in total} - {"calls", "seconds"})
+        header = ["sensor", "stage", "calls", "seconds", "ms/call"] + counter_names
+        rows = [header]
+        for (sensor, stage), total in sorted(totals.items(), key=lambda item: -item[1]["seconds"]):
+            rows.append([str(sensor), stage, str(total["calls"]), f"{total['seconds']:.3f}",
+                         f"{1000 * total['seconds'] / total['calls']:.2f}"]
+                        + [str(total.get(name, "")) for name in counter_names])
+        widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+        return "\n".join("  ".join(cell.ljust(width) if column < 2 else cell.rjust(width)
+                                   for column, (cell, width) in enumerate(zip(row, widths)))
+                         for row in rows)
+
+    def export_trace(self, path):
+        """Writes the events as Chrome trace event JSON, one track per thread."""
+        pid = os.getpid()
+        threads = {}
+        trace = []
+        for event in list(self.events):
+            tid = threads.setdefault(event.thread, len(threads))
+            args = dict(event.counters)
+            if event.frame is not None:
+                args["frame"] = event.frame
+            trace.append({"name": event.stage, "cat": str(event.sensor), "ph": "X", "pid": pid, "tid": tid,
+                          "ts": (event.start - self.origin) / 1000, "dur": event.duration / 1000,
+                          "args": args})
+        trace += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for name, tid in threads.items()]
+        with open(path, 'w') as file:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, file)
+
+
+# profiler of the running simulation
+profiler = Profiler()
@@ -0,0 +1,80 @@
+import numpy as np
+
+# always present in a lidar point record
+LIDAR_POINT_FIELDS = [("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("intensity", "<f4")]
+
+# optional per point fields, in record order
+LIDAR_OPTIONAL_FIELDS = {
+    "ring": ("ring", "<u2"),
+    "azimuth": ("azimuth", "<f4"),
+    "time": ("time", "<f4"),
+}
+
+
+def lidar_point_dtype(*optional):
+    """Structured float32 lidar point dtype: x, y, z, intensity plus the requested optional fields.
+
+    `ring` is the channel index, `azimuth` is in radians and `time` is the firing time offset
+    in seconds relative to the frame timestamp.
+    """
+    unknown = set(optional) - set(LIDAR_OPTIONAL_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown lidar point fields: {sorted(unknown)}")
+    fields = LIDAR_POINT_FIELDS + [field for name, field in LIDAR_OPTIONAL_FIELDS.items() if name in optional]
+    return np.dtype(fields)
+
+
+def lidar_points(locations, intensity, dtype=None, **fields):
+    """Packs (N,3) scanner space locations, intensities and optional per point fields into records."""
+    dtype = dtype if dtype is not None else lidar_point_dtype(*fields)
+    records = np.zeros(len(locations), dtype=dtype)
+    records["x"] = locations[:, 0]
+    records["y"] = locations[:, 1]
+    records["z"] = locations[:, 2]
+    records["intensity"] = intensity
+    for name, values in fields.items():
+        records[name] = values
+    return records
+
+
+def point_locations(records):
+    """(N,3) float32 locations of lidar point records."""
+    return np.column_stack((records["x"], records["y"], records["z"]))
+
+
+# store of the organized range images, next to the point store in a scanner folder
+RANGE_IMAGE_STORE = "range"
+
+# one pixel of an organized range image; pixels without a return have valid 0 and range 0
+RANGE_IMAGE_DTYPE = np.dtype([("range", "<f4"), ("intensity", "<f4"), ("valid", "u1")])
+
+
+def range_image(pixel_count, pixels, ranges, intensity):
+    """Flat RANGE_IMAGE_DTYPE records of `pixel_count` pixels with the returns of `pixels` set."""
+    image = np.zeros(pixel_count, dtype=RANGE_IMAGE_DTYPE)
+    image["range"][pixels] = ranges
+    image["intensity"][pixels] = intensity
+    image["valid"][pixels] = 1
+    return image
+
+
+# IMU readings of an IMU folder as a flat array that readers memory-map
+IMU_READINGS_FILE = "readings.npy"
+
+# one IMU reading, `orientation` as (w, x, y, z)
+IMU_RECORD_DTYPE = np.dtype([
+    ("time", "<f8"),
+    ("orientation", "<f8", (4,)),
+    ("angular_velocity", "<f8", (3,)),
+    ("acceleration", "<f8", (3,)),
+])
+
+
+def imu_records(imu_data):
+    """IMU_RECORD_DTYPE records of the readings of a simulated range."""
+    records = np.zeros(len(imu_data["timestamps"]), dtype=IMU_RECORD_DTYPE)
+    records["time"] = imu_data["timestamps"]
+    records["orientation"] = imu_data["orientations"]
+    records["angular_velocity"] = imu_data["angular_velocities"]
+    records["acceleration"] = imu_data["accelerations"]
+    return records
@@ -0,0 +1,458 @@
+"""Writes the sensor streams of a simulation into a rosbag2 (sqlite3) bag, without ROS.
+
+    otia_batch.py ... --bag <bag folder>                                    while simulating
+    python -m output.rosbag <output folder> <bag folder> [--milliseconds-per-frame 10]
+
+Every sensor folder with a ros.json becomes one topic named after its publisher, stamped with
+the simulation time:
+
+    lidar/<scanner>/   points or range image store   sensor_msgs/msg/PointCloud2
+    <imu>/IMU/         readings.npy (memory-mapped)  sensor_msgs/msg/Imu
+    cam/<camera>/      <frame>.png renders           sensor_msgs/msg/CompressedImage on <publisher>/compressed
+                       <pass>/<frame>.npy masks      sensor_msgs/msg/Image on <publisher>/<pass>
+
+While simulating, `bag_output` takes every scan, render, index mask and IMU range as its
+sensor produces it; the background writer serializes the messages and inserts them in batched
+transactions. Only the samples the simulating process does not produce itself, frames taken
+from the frame cache and the outputs of LiDAR shards and render workers, are read from the
+output folder when the bag is closed. `export_bag` writes a bag of a finished output folder,
+for example with other stamps, reading the sensors lazily and merging them by time. The
+timestamp index is built once at the end, so bags of millions of messages stream through a
+constant amount of memory.
+"""
+import argparse
+import collections
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from output import cdr
+from output.chunked_store import ChunkedReader
+from output.records import IMU_READINGS_FILE, RANGE_IMAGE_STORE, imu_records
+from output.writer import flush_outputs, output_writer
+
+logger = logging.getLogger(__name__)
+
+# messages per transaction
+BATCH_SIZE = 5000
+MILLISECONDS_PER_FRAME = 10
+# IMU readings serialized at once
+IMU_BLOCK = 10000
+CAMERA_PASSES = ("object_index", "material_index")
+# output writer key of the streamed bag, so one worker inserts all of its messages
+BAG_KEY = "rosbag"
+CLOUD_DTYPE = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("intensity", "<f4")])
+
+SCHEMA = """
+CREATE TABLE topics(id INTEGER PRIMARY KEY, name TEXT NOT NULL, type TEXT NOT NULL,
+                    serialization_format TEXT NOT NULL, offered_qos_profiles TEXT NOT NULL);
+CREATE TABLE messages(id INTEGER PRIMARY KEY, topic_id INTEGER NOT NULL, timestamp INTEGER NOT NULL,
+                      data BLOB NOT NULL);
+"""
+
+
+class BagWriter:
+    """Writes a rosbag2 folder: `<name>_0.db3` plus the metadata.yaml `ros2 bag` reads.
+
+    `write` buffers messages and inserts them `batch_size` at a time, each batch in one
+    transaction; `close` adds the timestamp index and the metadata.
+    """
+
+    def __init__(self, folder, batch_size=BATCH_SIZE):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.database_name = f"{self.folder.name}_0.db3"
+        database_path = self.folder / self.database_name
+        if database_path.exists():
+            raise FileExistsError(f"{database_path} already exists")
+        # a streamed bag is written on the background writer, one thread at a time
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        # the bag is rewritten from scratch if the export fails, it needs no journal
+        self.connection.execute("PRAGMA journal_mode=OFF")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.executescript(SCHEMA)
+        self.batch_size = batch_size
+        self.pending = []
+        # topic name -> [id, type, message count]
+        self.topics = {}
+        self.start = None
+        self.end = None
+
+    def add_topic(self, name, message_type):
+        if name in self.topics:
+            if self.topics[name][1] != message_type:
+                raise ValueError(f"Topic {name} carries {self.topics[name][1]}, not {message_type}")
+            return
+        topic_id = len(self.topics) + 1
+        self.connection.execute("INSERT INTO topics VALUES (?, ?, ?, 'cdr', '')", (topic_id, name, message_type))
+        self.topics[name] = [topic_id, message_type, 0]
+
+    def write(self, topic, timestamp, data):
+        """Queues a serialized message of `topic` received at `timestamp` nanoseconds."""
+        entry = self.topics[topic]
+        entry[2] += 1
+        self.pending.append((entry[0], timestamp, data))
+        self.start = timestamp if self.start is None else min(self.start, timestamp)
+        self.end = timestamp if self.end is None else max(self.end, timestamp)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with self.connection:
+            self.connection.executemany("INSERT INTO messages (topic_id, timestamp, data) VALUES (?, ?, ?)",
+                                        self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.connection.execute("CREATE INDEX timestamp_idx ON messages (timestamp ASC)")
+        self.connection.close()
+        with open(self.folder / "metadata.yaml", 'w') as file:
+            file.write(self.metadata())
+
+    def metadata(self):
+        start = self.start or 0
+        duration = (self.end or 0) - start
+        count = sum(entry[2] for entry in self.topics.values())
+        topics = "".join(
+            f"    - topic_metadata:\n"
+            f"        name: {name}\n"
+            f"        type: {message_type}\n"
+            f"        serialization_format: cdr\n"
+            f"        offered_qos_profiles: \"\"\n"
+            f"      message_count: {messages}\n"
+            for name, (_, message_type, messages) in self.topics.items())
+        return (
+            "rosbag2_bagfile_information:\n"
+            "  version: 5\n"
+            "  storage_identifier: sqlite3\n"
+            f"  duration:\n    nanoseconds: {duration}\n"
+            f"  starting_time:\n    nanoseconds_since_epoch: {start}\n"
+            f"  message_count: {count}\n"
+            "  topics_with_message_count:\n"
+            f"{topics if topics else '    []' + chr(10)}"
+            "  compression_format: \"\"\n"
+            "  compression_mode: \"\"\n"
+            f"  relative_file_paths:\n    - {self.database_name}\n"
+            "  files:\n"
+            f"    - path: {self.database_name}\n"
+            f"      starting_time:\n        nanoseconds_since_epoch: {start}\n"
+            f"      duration:\n        nanoseconds: {duration}\n"
+            f"      message_count: {count}\n"
+        )
+
+
+def topic_name(publisher):
+    return "/" + publisher.strip("/")
+
+
+def read_ros_info(folder):
+    with open(Path(folder) / "ros.json", 'r') as file:
+        return json.load(file)
+
+
+def frame_stamp(frame, milliseconds_per_frame, start_ns):
+    return start_ns + int(frame) * int(milliseconds_per_frame) * 1_000_000
+
+
+@lru_cache(maxsize=None)
+def _pixel_directions(model):
+    from sensor.models.lidar.beams import beam_pattern
+    pattern = beam_pattern(model)
+    rows, columns = pattern.layout.shape
+    directions = np.zeros((rows * columns, 3), dtype=np.float32)
+    directions[pattern.layout.pixel] = pattern.directions
+    return directions, rows
+
+
+def scan_message(stamp, frame_id, points=None, model=None, image=None):
+    """PointCloud2 of a scan's point records, or of the range `image` of a beam table `model` as
+    an organized cloud with NaN for the rays without a return."""
+    if image is None:
+        return cdr.point_cloud2(stamp, frame_id, points)
+    directions, rows = _pixel_directions(model)
+    ranges = np.where(image["valid"].astype(bool), image["range"], np.nan).astype(np.float32)
+    cloud = np.empty(len(image), dtype=CLOUD_DTYPE)
+    for axis, name in enumerate("xyz"):
+        cloud[name] = directions[:, axis] * ranges
+    cloud["intensity"] = image["intensity"]
+    return cdr.point_cloud2(stamp, frame_id, cloud, height=rows)
+
+
+def lidar_messages(folder, info, start_ns, keep=None):
+    """(stamp, topic, data) of every scan of a scanner folder, or of the frames `keep` is true for."""
+    topic = topic_name(info["publisher"])
+    organized = not (Path(folder) / "points.json").exists()
+    reader = ChunkedReader(folder, RANGE_IMAGE_STORE if organized else "points")
+    for frame in reader.frames.tolist():
+        if keep is not None and not keep(frame):
+            continue
+        stamp = frame_stamp(frame, info["milliseconds_per_frame"], start_ns)
+        if organized:
+            yield stamp, topic, scan_message(stamp, info["frame_id"], model=reader.metadata["model"],
+                                             image=reader.frame(frame))
+        else:
+            yield stamp, topic, scan_message(stamp, info["frame_id"], reader.frame(frame))
+
+
+def imu_readings(folder):
+    """IMU_RECORD_DTYPE readings of an IMU folder, memory-mapped; outputs written before the
+    readings file existed are converted from their pickled IMU data, which is read whole."""
+    readings_path = Path(folder) / "IMU" / IMU_READINGS_FILE
+    if readings_path.exists():
+        return np.load(readings_path, mmap_mode='r')
+    data_path = next(path for path in sorted((Path(folder) / "IMU").glob("*.npy")))
+    return imu_records(np.load(data_path, allow_pickle=True).item())
+
+
+def imu_messages(folder, info, start_ns, block=IMU_BLOCK):
+    """(stamp, topic, data) of every reading of an IMU folder, read and serialized `block`
+    readings at a time."""
+    return reading_messages(imu_readings(folder), info, start_ns, block)
+
+
+def reading_messages(readings, info, start_ns, block=IMU_BLOCK):
+    """(stamp, topic, data) of IMU_RECORD_DTYPE `readings`, serialized `block` at a time."""
+    topic = topic_name(info["publisher"])
+    for first in range(0, len(readings), block):
+        part = readings[first:first + block]
+        stamps = start_ns + np.rint(part["time"] * 1e9).astype(np.int64)
+        messages = cdr.imu_block(stamps, info["frame_id"], part["orientation"], part["angular_velocity"],
+                                 part["acceleration"])
+        for stamp, message in zip(stamps.tolist(), messages):
+            yield stamp, topic, message.tobytes()
+
+
+def camera_messages(folder, info, start_ns, keep=None):
+    folder = Path(folder)
+    topic = topic_name(info["publisher"])
+    frames = sorted(int(path.stem) for path in folder.glob("*.png") if path.stem.isdigit())
+    for frame in frames:
+        if keep is not None and not keep(frame):
+            continue
+        stamp = frame_stamp(frame, info["milliseconds_per_frame"], start_ns)
+        yield stamp, f"{topic}/compressed", cdr.compressed_image(stamp, info["frame_id"],
+                                                                 (folder / f"{frame}.png").read_bytes())
+        for name in CAMERA_PASSES:
+            mask_path = folder / name / f"{frame}.npy"
+            if mask_path.exists():
+                yield stamp, f"{topic}/{name}", cdr.image(stamp, info["frame_id"], np.load(mask_path))
+
+
+def sensor_streams(output_folder, milliseconds_per_frame=MILLISECONDS_PER_FRAME, start_ns=0, frames=None,
+                   streamed=None):
+    """{topic: message type} and the message generators of every sensor of an output folder, of
+    the `frames` range if given. `streamed` maps sensor folders to the frames already in the
+    bag, which are left out, and IMU folders to None, which leaves them out entirely."""
+    output_folder = Path(output_folder)
+    streamed = streamed or {}
+    topics, streams = {}, []
+
+    def keep(folder):
+        done = streamed.get(sensor_key(folder)) or ()
+        if frames is None and not done:
+            return None
+        return lambda frame: (frames is None or frame in frames) and frame not in done
+
+    def ros_info(folder):
+        info = read_ros_info(folder)
+        info.setdefault("milliseconds_per_frame", milliseconds_per_frame)
+        return info
+
+    def described(folder):
+        if (folder / "ros.json").exists():
+            return True
+        logger.warning("%s holds sensor data but no ros.json, it is left out of the bag", folder)
+        return False
+
+    for folder in sorted((output_folder / "lidar").glob("*/")):
+        if any((folder / f"{name}.json").exists() for name in ("points", RANGE_IMAGE_STORE)) and described(folder):
+            info = ros_info(folder)
+            topics[topic_name(info["publisher"])] = "sensor_msgs/msg/PointCloud2"
+            streams.append(lidar_messages(folder, info, start_ns, keep(folder)))
+
+    for folder in sorted((output_folder / "cam").glob("*/")):
+        if any(path.stem.isdigit() for path in folder.glob("*.png")) and described(folder):
+            info = ros_info(folder)
+            topic = topic_name(info["publisher"])
+            topics[f"{topic}/compressed"] = "sensor_msgs/msg/CompressedImage"
+            for name in CAMERA_PASSES:
+                if (folder / name).is_dir():
+                    topics[f"{topic}/{name}"] = "sensor_msgs/msg/Image"
+            streams.append(camera_messages(folder, info, start_ns, keep(folder)))
+
+    for folder in sorted({path.parent.parent for path in output_folder.glob("*/IMU/*.npy")}):
+        if described(folder) and sensor_key(folder) not in streamed:
+            info = ros_info(folder)
+            topics[topic_name(info["publisher"])] = "sensor_msgs/msg/Imu"
+            streams.append(imu_messages(folder, info, start_ns))
+    return topics, streams
+
+
+def export_bag(output_folder, bag_folder, milliseconds_per_frame=MILLISECONDS_PER_FRAME, start_ns=0,
+               batch_size=BATCH_SIZE):
+    """Writes every sensor of `output_folder` into a new rosbag2 in `bag_folder`, ordered by time.
+    `milliseconds_per_frame` stamps the frames of sensors whose ros.json lacks it.
+    Returns the number of messages per topic."""
+    topics, streams = sensor_streams(output_folder, milliseconds_per_frame, start_ns)
+    bag = BagWriter(bag_folder, batch_size)
+    try:
+        for name, message_type in topics.items():
+            bag.add_topic(name, message_type)
+        for stamp, topic, data in heapq.merge(*streams, key=lambda message: message[0]):
+            bag.write(topic, stamp, data)
+    finally:
+        bag.close()
+    counts = {name: entry[2] for name, entry in bag.topics.items()}
+    logger.info("Wrote %d messages on %d topics to %s", sum(counts.values()), len(counts), bag_folder)
+    return counts
+
+
+def sensor_key(folder):
+    return os.path.realpath(folder)
+
+
+class BagOutput:
+    """The bag of the running simulation, written while the sensors produce their samples.
+
+    Closed it ignores every sample. While open, `scan`, `render`, `index_pass` and `imu` queue
+    a sample's messages on the background writer, which serializes and inserts them in
+    submission order. `close` adds the samples of the output folder that were not streamed,
+    then finishes the bag and returns the number of messages per topic.
+    """
+
+    def __init__(self):
+        self.bag = None
+
+    @property
+    def enabled(self):
+        return self.bag is not None
+
+    def open(self, output_folder, bag_folder, frames, milliseconds_per_frame=MILLISECONDS_PER_FRAME, start_ns=0,
+             batch_size=BATCH_SIZE):
+        """Starts the bag of a simulation of the `frames` range into `output_folder`."""
+        self.bag = BagWriter(bag_folder, batch_size)
+        self.bag_folder = bag_folder
+        self.output_folder = output_folder
+        self.frames = frames
+        self.milliseconds_per_frame = milliseconds_per_frame
+        self.start_ns = start_ns
+        self.infos = {}
+        # sensor folder -> frames in the bag, None for an IMU folder
+        self.streamed = collections.defaultdict(set)
+
+    def _info(self, folder):
+        key = sensor_key(folder)
+        if key not in self.infos:
+            info = read_ros_info(folder)
+            info.setdefault("milliseconds_per_frame", self.milliseconds_per_frame)
+            self.infos[key] = info
+        return self.infos[key]
+
+    def _stamp(self, info, frame):
+        return frame_stamp(frame, info["milliseconds_per_frame"], self.start_ns)
+
+    def _write(self, topic, message_type, stamp, data):
+        self.bag.add_topic(topic, message_type)
+        self.bag.write(topic, stamp, data)
+
+    def scan(self, folder, model, frame, scan):
+        """A scan of the scanner writing `folder`: its range image if it has one, else its points."""
+        if self.bag is None:
+            return
+        info = self._info(folder)
+        self.streamed[sensor_key(folder)].add(frame)
+        output_writer().submit(BAG_KEY, self._write_scan, info, self._stamp(info, frame), model, scan)
+
+    def _write_scan(self, info, stamp, model, scan):
+        data = scan_message(stamp, info["frame_id"], scan.points, model, scan.range_image)
+        self._write(topic_name(info["publisher"]), "sensor_msgs/msg/PointCloud2", stamp, data)
+
+    def render(self, camera_folder, frame, path):
+        """The PNG file a camera rendered for `frame`."""
+        if self.bag is None:
+            return
+        info = self._info(camera_folder)
+        self.streamed[sensor_key(camera_folder)].add(frame)
+        output_writer().submit(BAG_KEY, self._write_render, info, self._stamp(info, frame), path)
+
+    def _write_render(self, info, stamp, path):
+        data = cdr.compressed_image(stamp, info["frame_id"], Path(path).read_bytes())
+        self._write(f"{topic_name(info['publisher'])}/compressed", "sensor_msgs/msg/CompressedImage", stamp, data)
+
+    def index_pass(self, camera_folder, frame, name, ids):
+        """The `name` index mask of a camera render."""
+        if self.bag is None:
+            return
+        info = self._info(camera_folder)
+        output_writer().submit(BAG_KEY, self._write_index_pass, info, self._stamp(info, frame), name, ids)
+
+    def _write_index_pass(self, info, stamp, name, ids):
+        data = cdr.image(stamp, info["frame_id"], ids)
+        self._write(f"{topic_name(info['publisher'])}/{name}", "sensor_msgs/msg/Image", stamp, data)
+
+    def imu(self, folder, imu_data):
+        """Every reading of an IMU's simulated range."""
+        if self.bag is None:
+            return
+        info = self._info(folder)
+        self.streamed[sensor_key(folder)] = None
+        output_writer().submit(BAG_KEY, self._write_imu, info, imu_data)
+
+    def _write_imu(self, info, imu_data):
+        self.bag.add_topic(topic_name(info["publisher"]), "sensor_msgs/msg/Imu")
+        for stamp, topic, data in reading_messages(imu_records(imu_data), info, self.start_ns):
+            self.bag.write(topic, stamp, data)
+
+    def close(self):
+        if self.bag is None:
+            return {}
+        try:
+            # the streamed messages are in the bag once the writer is done with them
+            flush_outputs()
+            bag = self.bag
+            topics, streams = sensor_streams(self.output_folder, self.milliseconds_per_frame, self.start_ns,
+                                             self.frames, self.streamed)
+            for name, message_type in topics.items():
+                bag.add_topic(name, message_type)
+            # rosbag2 readers order the messages by their timestamp index
+            for stamp, topic, data in itertools.chain(*streams):
+                bag.write(topic, stamp, data)
+        finally:
+            bag, self.bag = self.bag, None
+            bag.close()
+        counts = {name: entry[2] for name, entry in bag.topics.items()}
+        logger.info("Wrote %d messages on %d topics to %s", sum(counts.values()), len(counts), self.bag_folder)
+        return counts
+
+
+# bag of the running simulation
+bag_output = BagOutput()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m output.rosbag", description=__doc__.splitlines()[0])
+    parser.add_argument("output", help="simulation output folder")
+    parser.add_argument("bag", help="rosbag2 folder to create")
+    parser.add_argument("--milliseconds-per-frame", type=int, default=MILLISECONDS_PER_FRAME,
+                        help="frame duration of outputs whose ros.json does not record it")
+    parser.add_argument("--start-time", type=float, default=0.0,
+                        help="seconds since the epoch added to the simulation time")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="messages per transaction")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    counts = export_bag(args.output, args.bag, args.milliseconds_per_frame, int(args.start_time * 1e9),
+                        args.batch_size)
+    for name, count in counts.items():
+        print(f"{name:<40}{count:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import zlib
+
+from output.profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 2
+# jobs each worker may have queued before producers block
+MAX_PENDING = 32
+
+_STOP = object()
+
+
+class OutputWriterError(RuntimeError):
+    """A background write failed; the original exception is chained as the cause."""
+
+
+class OutputWriter:
+    """Persists finished sensor buffers on worker threads instead of Blender's main thread.
+
+    Jobs are routed by key, so all writes of one sensor run in submission order on the same
+    worker. `submit` blocks only while that worker's queue is full. The first failure is
+    re-raised in the producer by the next `submit`, `flush` or `close`.
+    Submitted buffers must not be modified afterwards.
+    """
+
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING):
+        self.queues = [queue.Queue(maxsize=max_pending) for _ in range(workers)]
+        self.error = None
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, args=(jobs,), name=f"otia-writer-{i}", daemon=True)
+                        for i, jobs in enumerate(self.queues)]
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self, jobs):
+        while True:
+            job = jobs.get()
+            try:
+                if job is _STOP:
+                    return
+                function, args, kwargs = job
+                function(*args, **kwargs)
+            except Exception as e:
+                logger.error("Background write failed: %s", e)
+                with self.lock:
+                    if self.error is None:
+                        self.error = e
+            finally:
+                jobs.task_done()
+
+    def _raise_error(self):
+        with self.lock:
+            error, self.error = self.error, None
+        if error is not None:
+            raise OutputWriterError(f"Writing sensor output failed: {error}") from error
+
+    def submit(self, key, function, *args, **kwargs):
+        self._raise_error()
+        if not self.threads:
+            raise OutputWriterError("The output writer is closed")
+        # time spent here is time the simulation waits for the disk
+        with profiler.stage(os.path.basename(str(key)), "queue"):
+            self.queues[zlib.crc32(str(key).encode()) % len(self.queues)].put((function, args, kwargs))
+
+    def flush(self):
+        """Waits until every submitted job has been written."""
+        for jobs in self.queues:
+            jobs.join()
+        self._raise_error()
+
+    def close(self):
+        if not self.threads:
+            return
+        for jobs in self.queues:
+            jobs.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self._raise_error()
+
+
+_writer = None
+
+
+def output_writer():
+    """Process wide writer, started on first use."""
+    global _writer
+    if _writer is None:
+        _writer = OutputWriter()
+    return _writer
+
+
+def flush_outputs():
+    if _writer is not None:
+        _writer.flush()
+
+
+@atexit.register
+def close_outputs():
+    global _writer
+    if _writer is not None:
+        writer, _writer = _writer, None
+        writer.close()
@@ -2,17 +2,9 @@ import bpy
 import logging
 from bpy.props import FloatProperty, FloatVectorProperty, EnumProperty, StringProperty, PointerProperty
 import os
-import json
-from pathlib import Path
-import sys
-
-#begin preprocessing
-project_root = "/home/jan/Workspace/lidar_scanner2/otia"
-#end preprocessing 
-sys.path.append(project_root)
 
 from sensor.models.cam.ros_info import save_cam_ros_info
-logging.basicConfig(level=logging.DEBUG)
+
 logger = logging.getLogger(__name__)
 
 
@@ -0,0 +1,195 @@
+"""Content keys of camera renders for the frame cache (output.frame_cache)."""
+import logging
+import os
+from pathlib import Path
+
+import bpy
+import numpy as np
+
+from output.frame_cache import content_key
+from sensor.models.cam.segmentation import (COMPOSITE_NODE, INDEX_OUTPUT_NODE, INDEX_PASSES, RENDER_LAYERS_NODE,
+                                            RENDERABLE_TYPES, renderable_objects)
+from sensor.models.lidar.scene_geometry import GEOMETRY_TYPES, geometry_cache, register_geometry_cache
+
+logger = logging.getLogger(__name__)
+
+# set per camera by render_frame or machine specific, neither changes the image
+RENDER_EXCLUDED = ("filepath", "threads", "threads_mode", "use_lock_interface")
+# compositor nodes of a segmentation run, whose output path changes per camera
+RUN_NODES = {RENDER_LAYERS_NODE, INDEX_OUTPUT_NODE, COMPOSITE_NODE}
+# object settings that only renders see, the viewport geometry revision does not
+OBJECT_RENDER_SETTINGS = ("hide_render", "pass_index", "is_holdout", "is_shadow_catcher", "visible_camera",
+                          "visible_diffuse", "visible_glossy", "visible_transmission", "visible_volume_scatter",
+                          "visible_shadow")
+IMAGE_SETTINGS = ("source", "filepath", "alpha_mode", "generated_type", "generated_width", "generated_height",
+                  "generated_color", "use_generated_float")
+# image sources read from a single file or generated; sequences and tiles span many files
+KEYED_IMAGE_SOURCES = {'FILE', 'MOVIE', 'GENERATED'}
+# images Blender writes itself
+RESULT_IMAGE_SOURCES = {'VIEWER'}
+
+
+def _plain(value):
+    if isinstance(value, set):
+        return sorted(value)
+    if hasattr(value, "__len__") and not isinstance(value, str):
+        return np.array(value).tolist()
+    return value
+
+
+def _settings(datablock, names):
+    return {name: _plain(getattr(datablock, name, None)) for name in names}
+
+
+def _rna_values(struct, base=None, exclude=()):
+    """Values of the plain properties of a Blender struct, without those its `base` type defines.
+    Datablock pointers are given by name, other pointers and collections are left out."""
+    if struct is None:
+        return None
+    skipped = {"rna_type", *exclude}
+    if base is not None:
+        skipped.update(prop.identifier for prop in base.bl_rna.properties)
+    values = {}
+    for prop in struct.bl_rna.properties:
+        if prop.identifier in skipped or prop.type == 'COLLECTION':
+            continue
+        value = getattr(struct, prop.identifier, None)
+        if prop.type == 'POINTER':
+            if not isinstance(value, bpy.types.ID):
+                continue
+            value = value.name_full
+        values[prop.identifier] = _plain(value)
+    return values
+
+
+def _curve_values(mapping):
+    return None if mapping is None else [[tuple(point.location) for point in curve.points] for curve in mapping.curves]
+
+
+def _socket_value(socket):
+    value = getattr(socket, "default_value", None)
+    if hasattr(value, "__len__") and not isinstance(value, str):
+        return list(value)
+    # object, image or other datablock sockets
+    return getattr(value, "name_full", value)
+
+
+def _node_values(node):
+    ramp = getattr(node, "color_ramp", None)
+    return (node.name, node.bl_idname, node.mute, _rna_values(node, bpy.types.Node),
+            [_socket_value(socket) for socket in node.inputs],
+            None if ramp is None else (ramp.interpolation, [(element.position, tuple(element.color))
+                                                            for element in ramp.elements]),
+            _curve_values(getattr(node, "mapping", None)),
+            node_tree_values(getattr(node, "node_tree", None)))
+
+
+def node_tree_values(tree, skipped=()):
+    """Nodes with their settings and input values, links and the groups used of a node tree,
+    without the `skipped` node names."""
+    if tree is None:
+        return None
+    nodes = [_node_values(node) for node in tree.nodes if node.name not in skipped]
+    links = [(link.from_node.name, link.from_socket.identifier, link.to_node.name, link.to_socket.identifier)
+             for link in tree.links if link.from_node.name not in skipped and link.to_node.name not in skipped]
+    return sorted(nodes, key=repr), sorted(links)
+
+
+def _images():
+    return sorted((image for image in bpy.data.images if image.source not in RESULT_IMAGE_SOURCES),
+                  key=lambda image: image.name_full)
+
+
+def unkeyed_reason(scene):
+    """Why renders of the scene depend on inputs a key cannot cover, None if they do not."""
+    view_layer = scene.view_layers[0]
+    for obj in view_layer.objects:
+        if obj.type in RENDERABLE_TYPES and not obj.hide_render and not obj.visible_get(view_layer=view_layer):
+            return f"{obj.name} renders but is hidden in the viewport"
+    for obj in renderable_objects(scene):
+        if obj.type not in GEOMETRY_TYPES and not obj.hide_render:
+            return f"{obj.name} has geometry the scene revision does not hash"
+    for image in _images():
+        if image.is_dirty:
+            return f"image {image.name} has unsaved changes"
+        if image.source not in KEYED_IMAGE_SOURCES:
+            return f"image {image.name} is read from several files"
+    return None
+
+
+def _image_values(image):
+    # the size and modification time of the file stand in for its contents
+    stat = None
+    if image.packed_file is not None:
+        stat = image.packed_file.size
+    elif image.source != 'GENERATED':
+        path = bpy.path.abspath(image.filepath, library=image.library)
+        if os.path.exists(path):
+            stat = (os.stat(path).st_size, os.stat(path).st_mtime_ns)
+    return image.name_full, _settings(image, IMAGE_SETTINGS), image.colorspace_settings.name, stat
+
+
+def _object_values(obj):
+    # render visibility, modifiers with their render levels and particle settings
+    return (obj.name_full, _settings(obj, OBJECT_RENDER_SETTINGS),
+            [(modifier.bl_idname, _rna_values(modifier)) for modifier in obj.modifiers],
+            [(system.seed, _rna_values(system.settings, bpy.types.ID)) for system in obj.particle_systems])
+
+
+def render_inputs(scene, depsgraph, segmentation):
+    """What every render of the current frame sees besides the camera: the geometry revision
+    of the scene geometry cache, the render, view layer and color management settings, the
+    compositor, the render settings of the objects, the materials, images, lights and world,
+    and whether index masks are written. Evaluated once per frame for all cameras.
+
+    None if the render cannot be fully keyed, for example when an object renders that the
+    viewport hides or an image has unsaved changes.
+    """
+    reason = unkeyed_reason(scene)
+    if reason is not None:
+        logger.debug("Renders are not cached: %s", reason)
+        return None
+
+    register_geometry_cache()
+    objects = renderable_objects(scene)
+    lights = sorted((obj for obj in scene.objects if obj.type == 'LIGHT'), key=lambda obj: obj.name_full)
+    materials = sorted({slot.material for obj in objects for slot in obj.material_slots if slot.material},
+                       key=lambda material: material.name_full)
+    world = scene.world
+    view_settings = scene.view_settings
+    return [
+        geometry_cache.scene_revision(depsgraph),
+        _rna_values(scene.render, exclude=RENDER_EXCLUDED),
+        _rna_values(scene.render.image_settings),
+        _rna_values(getattr(scene, "cycles", None)),
+        _rna_values(getattr(scene, "eevee", None)),
+        [_rna_values(layer) for layer in scene.view_layers],
+        (_rna_values(view_settings), _curve_values(view_settings.curve_mapping) if view_settings.use_curve_mapping
+         else None, scene.display_settings.display_device, scene.sequencer_colorspace_settings.name),
+        (scene.use_nodes, node_tree_values(scene.node_tree, RUN_NODES) if scene.use_nodes else None),
+        [_object_values(obj) for obj in objects],
+        [(material.name_full, _rna_values(material, bpy.types.ID),
+          node_tree_values(material.node_tree) if material.use_nodes else None) for material in materials],
+        [_image_values(image) for image in _images()],
+        [(texture.name_full, _rna_values(texture, bpy.types.ID)) for texture in bpy.data.textures],
+        [(light.name_full, np.array(light.matrix_world), _object_values(light), _rna_values(light.data, bpy.types.ID),
+          node_tree_values(light.data.node_tree) if light.data.use_nodes else None) for light in lights],
+        None if world is None else (_rna_values(world, bpy.types.ID),
+                                    node_tree_values(world.node_tree) if world.use_nodes else None),
+        # the mask ids follow the object names
+        [obj.name for obj in objects] if segmentation else None,
+    ]
+
+
+def camera_key(camera, frame, inputs):
+    """Content key of the render of `camera` at `frame` with the frame's `render_inputs`."""
+    return content_key("camera", frame, np.array(camera.matrix_world), _rna_values(camera.data, bpy.types.ID),
+                       _rna_values(camera.data.dof), inputs)
+
+
+def render_files(camera_folder, frame, segmentation):
+    """Files a render of the frame writes into the camera folder."""
+    paths = [Path(camera_folder) / f"{frame}.png"]
+    if segmentation:
+        paths.extend(Path(camera_folder) / slot / f"{frame}.npy" for slot in INDEX_PASSES)
+    return paths
@@ -1,20 +1,8 @@
-
 import bpy
-import os
 import json
-import bmesh
 import logging
-import numpy as np
-from mathutils import Vector
 from pathlib import Path
-import sys
-
-#begin preprocessing
-project_root = "/home/jan/Workspace/lidar_scanner2/otia"
-#end preprocessing 
-sys.path.append(project_root)
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 def save_cam_ros_info(path):
@@ -23,7 +11,8 @@ def save_cam_ros_info(path):
     info = {
         "publisher": bpy.context.scene.cam_publisher,
         "frame_id": bpy.context.scene.cam_frame_id,
-        "hz": bpy.context.scene.cam_hz
+        "hz": bpy.context.scene.cam_hz,
+        "milliseconds_per_frame": bpy.context.scene.milliseconds_per_frame,
     }
 
     try:
@@ -0,0 +1,189 @@
+import contextlib
+import functools
+import json
+import logging
+import os
+from pathlib import Path
+
+import bpy
+import numpy as np
+
+from output.rosbag import bag_output
+from output.writer import output_writer
+
+logger = logging.getLogger(__name__)
+
+# compositor nodes added for the index passes of a run and removed again afterwards
+RENDER_LAYERS_NODE = "otia_render_layers"
+INDEX_OUTPUT_NODE = "otia_index_output"
+COMPOSITE_NODE = "otia_composite"
+# object types with geometry that shows in a render
+RENDERABLE_TYPES = {'MESH', 'CURVE', 'SURFACE', 'META', 'FONT', 'CURVES', 'POINTCLOUD', 'VOLUME'}
+# file output slot -> render layer output of the pass
+INDEX_PASSES = {"object_index": "IndexOB", "material_index": "IndexMA"}
+LABELS_FILE = "segmentation.json"
+
+
+def renderable_objects(scene):
+    """Every object of the scene with renderable geometry, including the objects of instanced
+    collections, in name order."""
+    objects, collections = set(), set()
+
+    def visit(candidates):
+        for obj in candidates:
+            if obj.type in RENDERABLE_TYPES:
+                objects.add(obj)
+            collection = obj.instance_collection if obj.instance_type == 'COLLECTION' else None
+            if collection is not None and collection not in collections:
+                collections.add(collection)
+                visit(collection.all_objects)
+
+    visit(scene.objects)
+    return sorted(objects, key=lambda obj: obj.name_full)
+
+
+def assign_pass_indices(objects):
+    """Gives the `objects` and their materials a unique pass index, 1.. in name order so that
+    every process numbers them alike, 0 is the background.
+    Returns the id-to-name tables."""
+    materials = sorted({slot.material for obj in objects for slot in obj.material_slots if slot.material},
+                       key=lambda material: material.name_full)
+
+    for index, obj in enumerate(objects, start=1):
+        obj.pass_index = index
+    for index, material in enumerate(materials, start=1):
+        material.pass_index = index
+    return {
+        "objects": {index: obj.name for index, obj in enumerate(objects, start=1)},
+        "materials": {index: material.name for index, material in enumerate(materials, start=1)},
+    }
+
+
+def index_output_node(scene):
+    """Enables the object and material index passes and routes them through the compositor
+    into a 32 bit single channel EXR file output node, keeping the composite image as it is."""
+    scene.view_layers[0].use_pass_object_index = True
+    scene.view_layers[0].use_pass_material_index = True
+    scene.use_nodes = True
+    scene.render.use_compositing = True
+    tree = scene.node_tree
+
+    render_layers = tree.nodes.new("CompositorNodeRLayers")
+    render_layers.name = RENDER_LAYERS_NODE
+    render_layers.layer = scene.view_layers[0].name
+
+    # without a composite node enabling the compositor would leave the color image empty
+    if not any(node.type == 'COMPOSITE' for node in tree.nodes):
+        composite = tree.nodes.new("CompositorNodeComposite")
+        composite.name = COMPOSITE_NODE
+        tree.links.new(render_layers.outputs["Image"], composite.inputs["Image"])
+
+    output = tree.nodes.new("CompositorNodeOutputFile")
+    output.name = INDEX_OUTPUT_NODE
+    output.format.file_format = 'OPEN_EXR'
+    output.format.color_depth = '32'
+    output.format.color_mode = 'BW'
+    output.format.exr_codec = 'ZIP'
+    output.file_slots.clear()
+    for slot in INDEX_PASSES:
+        output.file_slots.new(slot)
+    for slot, render_output in INDEX_PASSES.items():
+        tree.links.new(render_layers.outputs[render_output], output.inputs[slot])
+    return output
+
+
+def remove_index_nodes(scene):
+    """Removes the compositor nodes added for the index passes, also those of older runs."""
+    if scene.node_tree is None:
+        return
+    for name in (INDEX_OUTPUT_NODE, RENDER_LAYERS_NODE, COMPOSITE_NODE):
+        node = scene.node_tree.nodes.get(name)
+        if node is not None:
+            scene.node_tree.nodes.remove(node)
+
+
+@functools.lru_cache(maxsize=None)
+def _warn_engine(engine):
+    logger.warning("Segmentation masks need Cycles, %s renders only the color images", engine)
+
+
+def write_labels(labels, output_folder):
+    """Writes the id-to-name table to `<output_folder>/segmentation.json`."""
+    # written through a temporary file, parallel render workers write the same table
+    labels_path = Path(output_folder) / LABELS_FILE
+    labels_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = labels_path.with_name(f"{LABELS_FILE}.{os.getpid()}")
+    with open(temporary_path, 'w') as file:
+        json.dump(labels, file, indent=4)
+    os.replace(temporary_path, labels_path)
+
+
+@contextlib.contextmanager
+def segmentation_run(scene, output_folder):
+    """Sets up the index passes once for all renders of a run if the scene asks for
+    segmentation: assigns the pass indices, adds the compositor nodes and writes the label
+    table. Yields the file output node, None without segmentation or if the render engine has
+    no index passes. Afterwards the user's pass indices and compositor settings are restored."""
+    remove_index_nodes(scene)
+    if not scene.cam_segmentation:
+        yield None
+        return
+    if scene.render.engine != 'CYCLES':
+        _warn_engine(scene.render.engine)
+        yield None
+        return
+
+    objects = renderable_objects(scene)
+    materials = {slot.material for obj in objects for slot in obj.material_slots if slot.material}
+    pass_indices = [(datablock, datablock.pass_index) for datablock in [*objects, *materials]]
+    view_layer = scene.view_layers[0]
+    settings = (scene.use_nodes, scene.render.use_compositing,
+                view_layer.use_pass_object_index, view_layer.use_pass_material_index)
+    try:
+        write_labels(assign_pass_indices(objects), output_folder)
+        yield index_output_node(scene)
+    finally:
+        remove_index_nodes(scene)
+        (scene.use_nodes, scene.render.use_compositing,
+         view_layer.use_pass_object_index, view_layer.use_pass_material_index) = settings
+        for datablock, pass_index in pass_indices:
+            datablock.pass_index = pass_index
+
+
+def read_index_pass(path):
+    """uint16 (H, W) ids of an index pass EXR, with the first row at the top of the image."""
+    image = bpy.data.images.load(str(path))
+    try:
+        width, height = image.size
+        pixels = np.empty(width * height * image.channels, dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+    finally:
+        bpy.data.images.remove(image)
+    ids = np.rint(pixels.reshape(height, width, -1)[::-1, :, 0])
+    return ids.astype(np.uint16)
+
+
+def save_index_pass(ids, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.save(path, ids)
+
+
+def index_folder(camera_folder):
+    """Where the file output node writes the EXR files of a camera before they are converted."""
+    return os.path.join(camera_folder, "index_exr")
+
+
+def collect_index_passes(camera_folder, frame_number):
+    """Converts the EXR files the file output node wrote for the last render into
+    `<pass>/<frame>.npy` arrays of the camera and removes them."""
+    for slot in INDEX_PASSES:
+        # the file output node appends the zero padded frame number to the slot name
+        exr_file = Path(index_folder(camera_folder)) / f"{slot}{frame_number:04d}.exr"
+        if not exr_file.is_file():
+            logger.error("No %s pass was written to %s", slot, exr_file)
+            continue
+        ids = read_index_pass(exr_file)
+        exr_file.unlink()
+        npy_path = Path(camera_folder) / slot / f"{frame_number}.npy"
+        output_writer().submit(str(npy_path.parent), save_index_pass, ids, npy_path)
+        bag_output.index_pass(camera_folder, frame_number, slot, ids)
@@ -1,40 +1,23 @@
 import bpy
 import os
-import json
 import logging
-import numpy as np
-from pathlib import Path
-import sys
-
-
-#begin preprocessing
-project_root = "/home/jan/Workspace/lidar_scanner2/otia"
-#end preprocessing 
-sys.path.append(project_root)
 
 from sensor.models.imu.ros_info import save_imu_ros_info
+from sensor.registry import NOISE_PARAMETERS
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-def save_imu_data(imu_data, folder_path, file_name="imu.npy"):
-    """Saves the IMU data as a NumPy file."""
-    try:
-        Path(folder_path).mkdir(parents=True, exist_ok=True)
-        imu_array = np.array(imu_data)
-        file_path = os.path.join(folder_path, "IMU", file_name)
-        np.save(file_path, imu_array)
-        logger.info(f"IMU data saved to {file_path}")
-    except Exception as e:
-        logger.error(f"Failed to save IMU data: {e}")
+# custom property keeping an IMU's noise parameters in the .blend
+IMU_NOISE = "otia_noise"
+
 
 def create_imu_operator(imu_name):
     """Creates a custom IMU operator for the given IMU name."""
 
     outpath = bpy.context.scene.folder_path
     logger.info("outpath %s", outpath)
-    scanner_folder = os.path.join(outpath, "lidar", imu_name)
-    save_imu_ros_info(scanner_folder)
+    # next to the IMU's readings, where the bag exporter finds it
+    save_imu_ros_info(os.path.join(outpath, imu_name))
 
     class ImuOperator(bpy.types.Operator):
         bl_idname = f"object.imu_{imu_name}"
@@ -46,6 +29,9 @@ def create_imu_operator(imu_name):
 
         def get_imu(self, context):
             """Extracts IMU data and position for the given object."""
+            from output.writer import output_writer
+            from sensor.models.imu.simulation import publish_imu, save_imu_data, simulate_imu
+
             scene = context.scene
             outpath = scene.folder_path
             imu_object = bpy.data.objects.get(imu_name)
@@ -54,58 +40,12 @@ def create_imu_operator(imu_name):
                 self.report({'ERROR'}, f"IMU object {imu_name} not found")
                 return {'CANCELLED'}
 
-            frame_start = scene.frame_start
-            frame_end = scene.frame_end
-            frame_rate = scene.render.fps
-
-            positions = []
-            rotations = []
-            accelerations = []
-            angular_velocities = []
-
-            previous_position = None
-            previous_rotation = None
-
-            for frame in range(frame_start, frame_end + 1):
-                scene.frame_set(frame)
-                matrix_world = imu_object.matrix_world
-                current_position = np.array(matrix_world.translation)
-                current_rotation = np.array(matrix_world.to_euler())
-
-                positions.append(current_position)
-                rotations.append(current_rotation)
-
-                if previous_position is not None:
-                    velocity = (current_position - previous_position) * frame_rate
-                    previous_velocity = (previous_position - np.array(positions[-2])) * frame_rate if len(positions) > 1 else velocity
-                    acceleration = (velocity - previous_velocity) * frame_rate
-                    accelerations.append(acceleration)
-                else:
-                    accelerations.append(np.array([0, 0, 0]))
-
-                if previous_rotation is not None:
-                    # Calculate the difference in rotation between frames
-                    delta_rotation = current_rotation - previous_rotation
-                    angular_velocity = delta_rotation * frame_rate
-                    angular_velocities.append(angular_velocity)
-                else:
-                    angular_velocities.append(np.array([0, 0, 0]))
-
-                previous_position = current_position
-                previous_rotation = current_rotation
-
-            # Convert lists to arrays for saving
-            imu_data = {
-                "positions": np.array(positions),
-                "rotations": np.array(rotations),
-                "accelerations": np.array(accelerations),
-                "angular_velocities": np.array(angular_velocities),
-                "frame_rate": frame_rate
-            }
+            imu_data = simulate_imu(scene, imu_object, scene.frame_start, scene.frame_end)
 
             # Create a folder for the IMU if it doesn't exist
             imu_folder = os.path.join(outpath, imu_name)
-            save_imu_data(imu_data, imu_folder, f"{imu_name}_imu_data.npy")
+            output_writer().submit(imu_folder, save_imu_data, imu_data, imu_folder, f"{imu_name}_imu_data.npy")
+            publish_imu(imu_name, scene.frame_end, imu_data)
 
             return {'FINISHED'}
 
@@ -128,6 +68,7 @@ class CreateImuOperator(bpy.types.Operator):
         bpy.ops.object.empty_add(type='ARROWS', location=(0, 0, 0))
         imu_base = context.active_object
         imu_base.name = sensor_name if sensor_name else "New IMU"
+        imu_base[IMU_NOISE] = {param_name: getattr(context.scene, f"imu_{param_name}") for param_name in NOISE_PARAMETERS}
 
         # Create a custom collection if it doesn't exist
         if "IMU" not in bpy.data.collections:
@@ -0,0 +1,120 @@
+import numpy as np
+
+from sensor.pose import continuous_quaternions, quaternion_conjugate, quaternion_multiply, quaternion_matrices
+
+# world gravity in m/s², Blender's Z axis points up
+GRAVITY = (0.0, 0.0, -9.81)
+
+
+class CubicSpline:
+    """Natural cubic spline through (times, values) with values (N,) or (N,D).
+
+    Calling it returns the value or its first or second derivative at arbitrary times.
+    With fewer than three knots it degrades to linear interpolation, it needs at least two.
+    """
+
+    def __init__(self, times, values):
+        self.times = np.asarray(times, dtype=np.float64)
+        if len(self.times) < 2:
+            raise ValueError(f"A spline needs at least two knots, not {len(self.times)}")
+        self.values = np.asarray(values, dtype=np.float64).reshape(len(self.times), -1)
+        self.scalar = np.ndim(values) == 1
+        self.moments = self._moments(self.times, self.values)
+
+    @staticmethod
+    def _moments(x, y):
+        # second derivatives at the knots, zero at both ends
+        n = len(x)
+        moments = np.zeros_like(y)
+        if n < 3:
+            return moments
+        h = np.diff(x)
+        slopes = np.diff(y, axis=0) / h[:, None]
+        rhs = 6 * np.diff(slopes, axis=0)
+        lower = h[:-1].copy()
+        diagonal = 2 * (h[:-1] + h[1:])
+        upper = h[1:].copy()
+
+        # Thomas algorithm over the n - 2 interior knots, all dimensions at once
+        for i in range(1, n - 2):
+            factor = lower[i] / diagonal[i - 1]
+            diagonal[i] -= factor * upper[i - 1]
+            rhs[i] -= factor * rhs[i - 1]
+        interior = np.empty_like(rhs)
+        interior[-1] = rhs[-1] / diagonal[-1]
+        for i in range(n - 4, -1, -1):
+            interior[i] = (rhs[i] - upper[i] * interior[i + 1]) / diagonal[i]
+        moments[1:-1] = interior
+        return moments
+
+    def __call__(self, t, derivative=0):
+        t = np.asarray(t, dtype=np.float64)
+        x, y, m = self.times, self.values, self.moments
+        i = np.clip(np.searchsorted(x, t, side='right') - 1, 0, len(x) - 2)
+        h = (x[i + 1] - x[i])[:, None]
+        a = (x[i + 1] - t)[:, None]
+        b = (t - x[i])[:, None]
+        left = y[i] / h - m[i] * h / 6
+        right = y[i + 1] / h - m[i + 1] * h / 6
+
+        if derivative == 0:
+            result = (m[i] * a ** 3 + m[i + 1] * b ** 3) / (6 * h) + left * a + right * b
+        elif derivative == 1:
+            result = (m[i + 1] * b ** 2 - m[i] * a ** 2) / (2 * h) - left + right
+        elif derivative == 2:
+            result = (m[i] * a + m[i + 1] * b) / h
+        else:
+            raise ValueError(f"Unsupported derivative {derivative}")
+        return result[:, 0] if self.scalar else result
+
+
+class PoseSpline:
+    """Smooth trajectory through sampled poses: positions and quaternion components are
+    interpolated with cubic splines, quaternions are renormalized when evaluated."""
+
+    def __init__(self, times, positions, quaternions):
+        self.positions = CubicSpline(times, positions)
+        self.quaternions = CubicSpline(times, continuous_quaternions(quaternions))
+
+    def orientation(self, t):
+        """Unit quaternions at `t` and their time derivatives."""
+        q = self.quaternions(t)
+        dq = self.quaternions(t, 1)
+        norm = np.linalg.norm(q, axis=1, keepdims=True)
+        q = q / norm
+        dq = (dq - q * np.sum(q * dq, axis=1, keepdims=True)) / norm
+        return q, dq
+
+
+def imu_measurements(times, positions, quaternions, sample_times, gravity=GRAVITY):
+    """Ideal accelerometer and gyroscope readings of a body moving through sampled poses.
+
+    `times` (N,), `positions` (N,3) and world-from-body `quaternions` (N,4) describe the
+    trajectory, readings are taken at `sample_times`. The accelerometer measures the specific
+    force (acceleration minus gravity) and the gyroscope the angular velocity, both in the
+    body frame. Fewer than two poses describe no motion and give no readings.
+    """
+    if len(times) < 2:
+        return {
+            "timestamps": np.zeros(0),
+            "positions": np.zeros((0, 3)),
+            "orientations": np.zeros((0, 4)),
+            "accelerations": np.zeros((0, 3)),
+            "angular_velocities": np.zeros((0, 3)),
+        }
+    spline = PoseSpline(times, positions, quaternions)
+    q, dq = spline.orientation(sample_times)
+
+    # body angular rate from q' = 1/2 q ⊗ (0, ω)
+    angular_velocities = 2 * quaternion_multiply(quaternion_conjugate(q), dq)[:, 1:]
+
+    world_force = spline.positions(sample_times, 2) - np.asarray(gravity)
+    accelerations = np.einsum("nji,nj->ni", quaternion_matrices(q), world_force)
+
+    return {
+        "timestamps": np.asarray(sample_times, dtype=np.float64),
+        "positions": spline.positions(sample_times),
+        "orientations": q,
+        "accelerations": accelerations,
+        "angular_velocities": angular_velocities,
+    }
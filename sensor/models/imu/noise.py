@@ -0,0 +1,34 @@
+import zlib
+
+import numpy as np
+
+
+def sensor_rng(seed, sensor_name):
+    """Generator of one sensor; the same seed and name give the same stream in every process."""
+    return np.random.default_rng([seed, zlib.crc32(sensor_name.encode())])
+
+
+def _noise(rng, shape, noise_density, random_walk, dt):
+    # white noise of the discrete samples and a bias that integrates white noise
+    white = rng.standard_normal(shape) * (noise_density / np.sqrt(dt))
+    bias = np.cumsum(rng.standard_normal(shape) * (random_walk * np.sqrt(dt)), axis=0)
+    return white + bias, bias
+
+
+def add_imu_noise(imu_data, noise, rng):
+    """Returns a copy of `imu_data` with white noise and bias random walk on the accelerometer
+    and gyroscope readings, plus the biases as `accelerometer_bias` and `gyroscope_bias`.
+
+    `noise` maps the NOISE_PARAMETERS names to their values, the samples are 1 / frame_rate apart.
+    """
+    dt = 1.0 / imu_data["frame_rate"]
+    noisy = dict(imu_data)
+    shape = np.shape(imu_data["accelerations"])
+
+    accelerometer, noisy["accelerometer_bias"] = _noise(rng, shape, noise["accelerometer_noise_density"],
+                                                        noise["accelerometer_random_walk"], dt)
+    gyroscope, noisy["gyroscope_bias"] = _noise(rng, shape, noise["gyroscope_noise_density"],
+                                                noise["gyroscope_random_walk"], dt)
+    noisy["accelerations"] = imu_data["accelerations"] + accelerometer
+    noisy["angular_velocities"] = imu_data["angular_velocities"] + gyroscope
+    return noisy
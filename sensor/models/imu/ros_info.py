@@ -1,25 +1,8 @@
-
 import bpy
-import os
 import json
-import bmesh
 import logging
-import numpy as np
-from mathutils import Vector
 from pathlib import Path
-import sys
-
-#begin preprocessing
-project_root = "/home/jan/Workspace/lidar_scanner2/otia"
-#end preprocessing 
-sys.path.append(project_root)
-
-
-
-print("sys.path after:", sys.path)
-
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 def save_imu_ros_info(path):
@@ -28,7 +11,8 @@ def save_imu_ros_info(path):
     info = {
         "publisher": bpy.context.scene.imu_publisher,
         "frame_id": bpy.context.scene.imu_frame_id,
-        "hz": bpy.context.scene.imu_hz
+        "hz": bpy.context.scene.imu_hz,
+        "milliseconds_per_frame": bpy.context.scene.milliseconds_per_frame,
     }
 
     try:
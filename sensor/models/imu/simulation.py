@@ -0,0 +1,152 @@
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+from mathutils import Euler, Quaternion
+
+from output.live import live_output
+from output.profiling import profiler
+from output.records import IMU_READINGS_FILE, imu_records
+from sensor.models.imu.imu_creator import IMU_NOISE
+from sensor.models.imu.kinematics import imu_measurements
+from sensor.models.imu.noise import add_imu_noise, sensor_rng
+from sensor.pose import matrix_quaternions
+from sensor.registry import NOISE_PARAMETERS
+from sensor.schedule import SensorScheduler
+from sensor.trajectory import sensor_poses
+
+logger = logging.getLogger(__name__)
+
+
+def save_imu_data(imu_data, folder_path, file_name="imu.npy"):
+    """Saves the IMU data as a NumPy file, and the readings as IMU_RECORD_DTYPE records to
+    IMU_READINGS_FILE, which exporters memory-map. Runs on the background writer, which
+    re-raises a failed write in the simulation."""
+    Path(folder_path, "IMU").mkdir(parents=True, exist_ok=True)
+    imu_array = np.array(imu_data)
+    file_path = os.path.join(folder_path, "IMU", file_name)
+    readings_path = os.path.join(folder_path, "IMU", IMU_READINGS_FILE)
+    with profiler.stage(Path(folder_path).name, "write") as counters:
+        np.save(file_path, imu_array)
+        np.save(readings_path, imu_records(imu_data))
+        counters["bytes"] = os.path.getsize(file_path) + os.path.getsize(readings_path)
+    logger.info(f"IMU data saved to {file_path}")
+
+
+def publish_imu(imu_name, frame, imu_data):
+    """Publishes the readings of a simulated range live as one batch of IMU_RECORD_DTYPE records."""
+    if not live_output.enabled:
+        return
+    records = imu_records(imu_data)
+    live_output.publish(imu_name, frame, float(records["time"][-1]) if len(records) else 0.0, records)
+
+
+def check_imu_rate(scene):
+    """Raises ValueError unless the scene's IMU rate can be sampled, before any frame is simulated."""
+    if scene.imu_hz <= 0:
+        raise ValueError(f"The IMU frequency must be positive, not {scene.imu_hz} Hz")
+
+
+def imu_schedule(scene, frame_start, frame_end):
+    """Timestamps in seconds of every IMU sample of the frame range at the scene's IMU rate."""
+    check_imu_rate(scene)
+    scheduler = SensorScheduler(scene.milliseconds_per_frame, frame_start, frame_end)
+    scheduler.add("imu", scene.imu_hz, subframes=True)
+    return scheduler.times("imu")
+
+
+# transform channels the F-Curve fast path understands
+TRANSFORM_PATHS = ("location", "rotation_euler", "rotation_quaternion", "rotation_axis_angle")
+DELTA_PATHS = ("delta_location", "delta_rotation_euler", "delta_rotation_quaternion", "delta_scale")
+
+
+def animation_trajectory(obj, frames):
+    """Positions (N,3) and quaternions (N,4) of `obj` at `frames` read from its own F-Curves
+    without evaluating the scene. None if parents, constraints, drivers, NLA strips or delta
+    transforms move it too."""
+    animation_data = obj.animation_data
+    if obj.parent is not None or len(obj.constraints):
+        return None
+    if animation_data is not None and (len(animation_data.drivers) or len(animation_data.nla_tracks)):
+        return None
+    if (obj.delta_location.length or obj.delta_rotation_quaternion != Quaternion()
+            or obj.delta_rotation_euler != Euler()):
+        return None
+
+    values = {path: np.tile(np.array(getattr(obj, path), dtype=np.float64), (len(frames), 1)) for path in TRANSFORM_PATHS}
+    action = animation_data.action if animation_data is not None else None
+    for fcurve in (action.fcurves if action is not None else []):
+        if fcurve.data_path in DELTA_PATHS:
+            return None
+        if fcurve.data_path in values:
+            values[fcurve.data_path][:, fcurve.array_index] = [fcurve.evaluate(frame) for frame in frames]
+
+    mode = obj.rotation_mode
+    if mode == 'QUATERNION':
+        quaternions = values["rotation_quaternion"]
+    elif mode == 'AXIS_ANGLE':
+        angle, axis = values["rotation_axis_angle"][:, :1], values["rotation_axis_angle"][:, 1:]
+        axis = axis / np.maximum(np.linalg.norm(axis, axis=1, keepdims=True), 1e-12)
+        quaternions = np.hstack((np.cos(angle / 2), axis * np.sin(angle / 2)))
+    else:
+        quaternions = np.array([Euler(euler, mode).to_quaternion() for euler in values["rotation_euler"]])
+    quaternions = quaternions / np.linalg.norm(quaternions, axis=1, keepdims=True)
+    return values["location"], quaternions
+
+
+def evaluated_trajectory(scene, obj, frames):
+    """Positions and quaternions of `obj` at `frames`, evaluating the scene once per frame.
+    The poses are recorded in the shared pose table as well."""
+    current_frame = scene.frame_current
+    matrices = []
+    for frame in frames:
+        scene.frame_set(int(frame))
+        matrices.append(np.array(obj.matrix_world))
+        sensor_poses.record(obj.name, frame * scene.milliseconds_per_frame / 1000.0, matrices[-1])
+    scene.frame_set(current_frame)
+    matrices = np.array(matrices)
+    return matrices[:, :3, 3], matrix_quaternions(matrices[:, :3, :3])
+
+
+def imu_samples(scene, imu_object, frame_start, frame_end):
+    """Accelerometer and gyroscope readings of `imu_object` at the scene's IMU rate.
+
+    The pose comes from the F-Curves when only its own animation moves the IMU, otherwise
+    from the poses the simulation already recorded, and only if those do not cover the range
+    the scene is evaluated once per frame. Readings come from a spline through these poses at
+    any rate.
+    """
+    frames = np.arange(frame_start, frame_end + 1)
+    times = frames * scene.milliseconds_per_frame / 1000.0
+    sample_times = imu_schedule(scene, frame_start, frame_end)
+    trajectory = animation_trajectory(imu_object, frames)
+    if trajectory is not None:
+        positions, quaternions = trajectory
+    elif len(sample_times) and sensor_poses.covers(imu_object.name, sample_times[0], sample_times[-1]):
+        times, positions, quaternions = sensor_poses.trajectory(imu_object.name)
+    else:
+        positions, quaternions = evaluated_trajectory(scene, imu_object, frames)
+
+    if len(times) < 2:
+        logger.warning("%s: frames %d-%d hold fewer than two poses, the IMU has no readings",
+                       imu_object.name, frame_start, frame_end)
+    imu_data = imu_measurements(times, positions, quaternions, sample_times)
+    imu_data["frame_rate"] = scene.imu_hz
+    return imu_data
+
+
+def imu_noise(scene, imu_object):
+    """Noise parameters stored on the IMU, the scene's current ones for older IMUs."""
+    if IMU_NOISE in imu_object:
+        return imu_object[IMU_NOISE].to_dict()
+    return {param_name: getattr(scene, f"imu_{param_name}") for param_name in NOISE_PARAMETERS}
+
+
+def simulate_imu(scene, imu_object, frame_start, frame_end):
+    """Noisy IMU readings of the frame range; the noise is seeded per IMU, so runs repeat exactly."""
+    with profiler.stage(imu_object.name, "imu") as counters:
+        imu_data = imu_samples(scene, imu_object, frame_start, frame_end)
+        counters["samples"] = len(imu_data["timestamps"])
+    with profiler.stage(imu_object.name, "noise"):
+        return add_imu_noise(imu_data, imu_noise(scene, imu_object), sensor_rng(scene.imu_noise_seed, imu_object.name))
@@ -0,0 +1,155 @@
+"""LiDAR models described by a beam table in models.json instead of code.
+
+A model with a "beams" entry is compiled once into frozen arrays of ray directions, firing
+times and per ray ring and azimuth; scanning a frame then only hands out these arrays.
+
+    "beams": {
+        "type": "spinning",                 # or "solid_state"
+        "elevations": [-15, 1, -13, ...],   # degrees per channel (ring), or
+                                            # {"start": 22.5, "stop": -22.5, "count": 128} ranges
+        "azimuth_offsets": [0.0, ...],      # degrees per channel, optional
+        "columns": 2048,                    # or "horizontal_resolution" in degrees
+        "clockwise": true,                  # spinning direction seen from above, optional
+        "firing_order": [0, 1, ...],        # order the channels of a column fire in, optional
+        "channel_spacing": 0.0416667        # column periods between two firings, optional
+    }
+
+Spinning models sweep 360 degrees per scan, column after column. Solid state models take
+"azimuths" like "elevations" and scan their grid column by column, or row by row with
+"scan_order": "rows".
+
+Every ray also has a pixel of the model's organized range image: one row per channel from the
+highest to the lowest beam and one column per column of the scan, in sweep order.
+"""
+import collections
+from functools import lru_cache
+
+import numpy as np
+
+from sensor.models.lidar.lidar_functionality import _frozen, normalize_directions
+from sensor.registry import ScanModel, lidar_models
+
+BeamPattern = collections.namedtuple("BeamPattern", ["directions", "firing", "ring", "azimuth", "layout"])
+
+# (rows, columns) of the range image, flat pixel index of every ray and the ring of every row
+RangeImageLayout = collections.namedtuple("RangeImageLayout", ["shape", "pixel", "rings"])
+
+
+def angle_table(spec):
+    """Degrees of a list of angles and {"start", "stop", "count"} ranges, concatenated."""
+    if isinstance(spec, dict):
+        spec = [spec]
+    angles = []
+    for entry in spec:
+        if isinstance(entry, dict):
+            angles.extend(np.linspace(entry["start"], entry["stop"], entry["count"]))
+        else:
+            angles.append(entry)
+    return np.asarray(angles, dtype=np.float64)
+
+
+def channel_times(beams, channels):
+    """Firing time of every channel within its column, in column periods."""
+    order = np.asarray(beams.get("firing_order", range(channels)))
+    if sorted(order.tolist()) != list(range(channels)):
+        raise ValueError(f"firing_order must list each of the {channels} channels once")
+    times = np.empty(channels)
+    times[order] = np.arange(channels) * beams.get("channel_spacing", 0.0)
+    return times
+
+
+def compile_spinning(beams):
+    elevations = angle_table(beams["elevations"])
+    channels = len(elevations)
+    offsets = angle_table(beams.get("azimuth_offsets", [0.0] * channels))
+    if len(offsets) != channels:
+        raise ValueError(f"{len(offsets)} azimuth offsets for {channels} channels")
+    columns = beams.get("columns") or int(round(360.0 / beams["horizontal_resolution"]))
+
+    sweep = np.arange(columns) * (360.0 / columns)
+    if beams.get("clockwise", False):
+        sweep = -sweep
+    # (columns, channels) grids, column-major like the sweep
+    azimuths = np.radians(sweep[:, None] + offsets[None, :])
+    firing = (np.arange(columns)[:, None] + channel_times(beams, channels)[None, :]) / columns
+    ring = np.broadcast_to(np.arange(channels), (columns, channels))
+    return elevations, azimuths, firing, ring
+
+
+def compile_solid_state(beams):
+    elevations = angle_table(beams["elevations"])
+    column_azimuths = angle_table(beams["azimuths"])
+    columns, channels = len(column_azimuths), len(elevations)
+    azimuths = np.radians(np.broadcast_to(column_azimuths[:, None], (columns, channels)))
+    ring = np.broadcast_to(np.arange(channels), (columns, channels))
+    if beams.get("scan_order", "columns") == "rows":
+        order = np.arange(columns * channels).reshape(channels, columns).T
+    else:
+        order = np.arange(columns * channels).reshape(columns, channels)
+    return elevations, azimuths, order / (columns * channels), ring
+
+
+BEAM_COMPILERS = {"spinning": compile_spinning, "solid_state": compile_solid_state}
+
+
+def compile_beams(beams):
+    """BeamPattern of a beam table: unit directions (N,3) float32, firing fractions of the sweep,
+    ring (channel index), azimuth in radians and range image pixel of every ray, ordered by
+    firing time."""
+    if beams["type"] not in BEAM_COMPILERS:
+        raise ValueError(f"Unknown beam table type {beams['type']}, expected one of {sorted(BEAM_COMPILERS)}")
+    elevations, azimuths, firing, ring = BEAM_COMPILERS[beams["type"]](beams)
+    columns, channels = firing.shape
+    # image rows from the highest to the lowest beam, ties in channel order
+    rings = np.argsort(-elevations, kind='stable')
+    rows = np.empty(channels, dtype=np.int64)
+    rows[rings] = np.arange(channels)
+    pixel = rows[ring] * columns + np.arange(columns)[:, None]
+
+    # azimuths in [-pi, pi), like atan2 of the ray
+    azimuths = (azimuths.ravel() + np.pi) % (2 * np.pi) - np.pi
+    elevations = np.radians(np.broadcast_to(elevations[None, :], firing.shape)).ravel()
+    directions = np.column_stack((np.cos(elevations) * np.cos(azimuths),
+                                  np.cos(elevations) * np.sin(azimuths),
+                                  np.sin(elevations)))
+
+    order = np.argsort(firing.ravel(), kind='stable')
+    return BeamPattern(
+        directions=_frozen(normalize_directions(directions[order])),
+        firing=_frozen(firing.ravel()[order]),
+        ring=_frozen(ring.ravel()[order].astype(np.uint16)),
+        azimuth=_frozen(azimuths[order].astype(np.float32)),
+        layout=RangeImageLayout(
+            shape=(channels, columns),
+            pixel=_frozen(pixel.ravel()[order].astype(np.uint32)),
+            rings=_frozen(rings.astype(np.uint16)),
+        ),
+    )
+
+
+@lru_cache(maxsize=None)
+def beam_pattern(model):
+    return compile_beams(lidar_models()[model]["beams"])
+
+
+@lru_cache(maxsize=None)
+def beam_functions(model):
+    """ScanModel of a beam table model; every frame shares the compiled arrays."""
+    pattern = beam_pattern(model)
+    return ScanModel(
+        pattern=lambda current_frame, params: pattern.directions,
+        firing=lambda current_frame, params, count: pattern.firing,
+        fields=lambda current_frame, params: {"ring": pattern.ring, "azimuth": pattern.azimuth},
+        layout=pattern.layout,
+    )
+
+
+def range_image_locations(model, image):
+    """(N,3) float32 scanner space locations of the valid pixels of a range image of `model`,
+    in row-major pixel order. Motion distortion is not undone, like in the point records."""
+    pattern = beam_pattern(model)
+    directions = np.zeros((image.size, 3), dtype=np.float32)
+    directions[pattern.layout.pixel] = pattern.directions
+    image = image.reshape(-1)
+    valid = image["valid"].astype(bool)
+    return directions[valid] * image["range"][valid, None]
@@ -0,0 +1,45 @@
+import numpy as np
+
+# intensity of objects and slots without a material
+DEFAULT_INTENSITY = 1.0
+
+
+def material_intensity(mat):
+    """Average base color of a material, DEFAULT_INTENSITY if there is none."""
+    intensity = DEFAULT_INTENSITY
+
+    if mat:
+        if mat.use_nodes:
+            # Look for the Principled BSDF node
+            principled_node = next((node for node in mat.node_tree.nodes if node.type == 'BSDF_PRINCIPLED'), None)
+            if principled_node:
+                # Get the base color from the Principled BSDF node's input
+                base_color_socket = principled_node.inputs.get('Base Color')
+                if base_color_socket:
+                    color = base_color_socket.default_value
+                    intensity = sum(color[:3]) / 3.0  # Average RGB value
+        else:
+            color = mat.diffuse_color
+            intensity = sum(color[:3]) / 3.0  # Average RGB value
+    return intensity
+
+
+class IntensityTable:
+    """Flat intensity lookup indexed by object id and material slot.
+
+    `slot_intensities` holds one sequence of slot intensities per object id. Objects without
+    slots get a single DEFAULT_INTENSITY entry, out of range slots clamp to the last slot,
+    as Blender does when it draws them.
+    """
+
+    def __init__(self, slot_intensities):
+        slot_intensities = [list(slots) or [DEFAULT_INTENSITY] for slots in slot_intensities]
+        self.counts = np.array([len(slots) for slots in slot_intensities], dtype=np.int64)
+        self.offsets = np.cumsum(self.counts) - self.counts
+        values = [value for slots in slot_intensities for value in slots]
+        self.values = np.array(values, dtype=np.float32)
+
+    def lookup(self, object_ids, material_indices):
+        object_ids = np.asarray(object_ids, dtype=np.int64)
+        slots = np.clip(material_indices, 0, self.counts[object_ids] - 1)
+        return self.values[self.offsets[object_ids] + slots]
@@ -1,61 +1,61 @@
 import bpy
 import os
-import json
-import bmesh
 import logging
-import numpy as np
-from mathutils import Vector
-from pathlib import Path
 import sys
 
+from output.profiling import profiler
+from sensor.models.lidar.ros_info import save_lidar_ros_info
+from sensor.registry import lidar_models, lidar_parameters
 
-#begin preprocessing
-project_root = "/home/jan/Workspace/lidar_scanner2/otia"
-#end preprocessing 
-sys.path.append(project_root)
+logger = logging.getLogger(__name__)
 
+# the scanning code and its NumPy patterns load when the first scan runs
+SCENE_GEOMETRY_MODULE = "sensor.models.lidar.scene_geometry"
+SCANNING_MODULE = "sensor.models.lidar.scanning"
 
-print("sys.path after:", sys.path)
 
-from sensor.models.lidar.lidar_functionality import *
-from sensor.models.lidar.ros_info import save_lidar_ros_info
+# custom properties that keep a scanner's configuration in the .blend, the generated
+# raycast operators themselves are not saved with the file
+SCANNER_MODEL = "otia_lidar"
+SCANNER_PARAMETERS = "otia_parameters"
+SCANNER_HZ = "otia_hz"
+# ROS topic and frame id of the scanner's messages
+SCANNER_PUBLISHER = "otia_publisher"
+SCANNER_FRAME_ID = "otia_frame_id"
+# True if the scanner writes organized range images instead of point lists
+SCANNER_ORGANIZED = "otia_organized"
 
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
 
-functions = {
-    "livox_mid40": livox_mid_40,
-    "demo": demo,
-    "velodyne_hdl64": velodyne_hdl64
-}
-
-def get_lidar_parameters():
-    filepath = os.path.join(project_root, "sensor", "models", "lidar", "models.json")
-    try:
-        with open(filepath, 'r') as file:
-            data = json.load(file)
-        return data
-    except Exception as e:
-        logger.info("%s", e)
-        print(f"An error occurred: {e}")
+def scanner_config(scanner_base):
+    """(model, parameters, hz) stored on a scanner by CreateScannerOperator, None for other objects."""
+    if SCANNER_MODEL not in scanner_base:
         return None
+    return (scanner_base[SCANNER_MODEL], scanner_base[SCANNER_PARAMETERS].to_dict(), scanner_base[SCANNER_HZ])
 
-lidar_data = get_lidar_parameters()
 
+def scanner_ros_config(scanner_base):
+    """(publisher, frame_id, hz) of a scanner's ROS messages as stored by CreateScannerOperator;
+    scanners created before the topic was stored fall back to the scene's settings."""
+    scene = bpy.context.scene
+    return (scanner_base.get(SCANNER_PUBLISHER, scene.lidar_publisher),
+            scanner_base.get(SCANNER_FRAME_ID, scene.lidar_frame_id),
+            scanner_base.get(SCANNER_HZ, scene.lidar_hz))
 
 
+def lidar_codec(scene):
+    """Codec of the LiDAR stores chosen in the scene, None writes raw records."""
+    if scene.lidar_compression == 'NONE':
+        return None
+    from output.codec import LidarCodec
+    quantization = scene.lidar_quantization if scene.lidar_compression == 'QUANTIZED' else None
+    return LidarCodec(scene.lidar_compressor, scene.lidar_compression_level, quantization)
 
-def save_hit_locations_as_numpy(hit_locations, folder_path, file_name="hit_locations.npy"):
-    try:
-        Path(folder_path).mkdir(parents=True, exist_ok=True)
-
-        hit_locations_array = np.array([loc.to_tuple() for loc in hit_locations])
-
-        file_path = os.path.join(folder_path, file_name)
 
-        np.save(file_path, hit_locations_array)
-    except Exception as e:
-        logger.error(f"Failed to save hit locations: {e}")
+def close_scanner_stores():
+    """Closes the stores of the scanners; they only exist once a scan ran in this session."""
+    scanning = sys.modules.get(SCANNING_MODULE)
+    if scanning is not None:
+        scanning.close_lidar_stores()
 
 
 def create_custom_raycast_operator(scanner_name, parameters, selected_lidar):
@@ -63,7 +63,8 @@ def create_custom_raycast_operator(scanner_name, parameters, selected_lidar):
     outpath = bpy.context.scene.folder_path
     logger.info("outpath %s", outpath)
     scanner_folder = os.path.join(outpath, "lidar", scanner_name)
-    save_lidar_ros_info(scanner_folder)
+    scene = bpy.context.scene
+    save_lidar_ros_info(scanner_folder, scene.lidar_publisher, scene.lidar_frame_id, scene.lidar_hz)
 
     class CustomRaycastOperator(bpy.types.Operator):
         bl_idname = f"object.custom_raycast_{scanner_name}"
@@ -76,12 +77,18 @@ def create_custom_raycast_operator(scanner_name, parameters, selected_lidar):
 
 
         def perform_scan(self, context):
+            from output.frame_cache import frame_cache
+            from output.records import point_locations
+            from sensor.models.lidar.scanning import (publish_scan, scan_due, scan_frame, scan_key, store_scan,
+                                                      sweep_start_pose)
+            from sensor.trajectory import scan_poses
+
             scene = context.scene
             outpath = None
             
             current_frame = bpy.context.scene.frame_current
             
-            if scene.simulation_running and scene.milliseconds_per_frame * current_frame % self.hz != 0:
+            if scene.simulation_running and not scan_due(scene, current_frame, self.hz):
                 return {"FINISHED"}
 
             try:
@@ -89,106 +96,76 @@ def create_custom_raycast_operator(scanner_name, parameters, selected_lidar):
             except Exception as e:
                 logger.info("%s", e)
 
-            depsgraph = bpy.context.evaluated_depsgraph_get()
-
             scanner_base = scene.objects.get(scanner_name)
-            world_matrix = scanner_base.matrix_world
-            position = world_matrix.translation
 
             if scanner_base is None or scanner_base.type != 'EMPTY':
                 self.report({'ERROR'}, "No active empty object as scanner base")
                 return {'CANCELLED'}
 
-            bpy.context.view_layer.update()
-
-            max_distance = parameters['max_distance']
-            res = functions[selected_lidar](current_frame, parameters)
-
-            rotation_matrix = world_matrix.to_3x3()
-            hit_data = []
-
-            for e in res:
-                direction_local = Vector(e).normalized()
-                direction_world = rotation_matrix @ direction_local
-
-                hit, loc, norm, idx, obj_hit, mw = scene.ray_cast(depsgraph, position, direction_world)
-
-                if hit and (loc - position).length <= max_distance:
-                    loc_relative = world_matrix.inverted() @ loc
-                    intensity = 1.0  # Default intensity value
-
-
-                    if obj_hit and obj_hit.active_material:
-                        mat = obj_hit.active_material
-                        if mat.use_nodes:
-                            # Look for the Principled BSDF node
-                            principled_node = next((node for node in mat.node_tree.nodes if node.type == 'BSDF_PRINCIPLED'), None)
-                            if principled_node:
-                                # Get the base color from the Principled BSDF node's input
-                                base_color_socket = principled_node.inputs.get('Base Color')
-                                if base_color_socket:
-                                    color = base_color_socket.default_value
-                                    intensity = sum(color[:3]) / 3.0  # Average RGB value
-                        else:
-                            color = mat.diffuse_color
-                            intensity = sum(color[:3]) / 3.0  # Average RGB value
-                    #logger.info("intensity %s", intensity)
-                    logger.info("obj name: %s",obj_hit.name)
-                    intensity *= 255
-                    hit_data.append((*loc_relative, intensity))
-
-            # Create a folder for the scanner if it doesn't exist
+            # the depsgraph is already evaluated for this frame; the geometry cache keeps
+            # every unchanged mesh tree from earlier frames
+            depsgraph = context.evaluated_depsgraph_get()
+
+            # the sweep of a scan covers the time since the previous one
+            sweep_duration = 1.0 / self.hz if self.hz else 0.0
+            frame_time = current_frame * scene.milliseconds_per_frame / 1000.0
+            scan_poses.record(scanner_name, frame_time, scanner_base.matrix_world)
+            sweep_start = sweep_start_pose(scanner_name, frame_time, sweep_duration)
+
+            organized = scanner_base.get(SCANNER_ORGANIZED, False)
+            codec = lidar_codec(scene)
             scanner_folder = os.path.join(outpath, "lidar", scanner_name)
-            Path(scanner_folder).mkdir(parents=True, exist_ok=True)
+            key = scan_key(depsgraph, scanner_base, selected_lidar, parameters, current_frame,
+                           sweep_duration, sweep_start, organized, codec) if frame_cache.enabled else None
+            if frame_cache.hit(scanner_folder, current_frame, key):
+                profiler.log(logger, scanner_name, "%s: frame %d is cached", scanner_name, current_frame)
+                return {'FINISHED'}
 
-            # Convert the list to a NumPy array
-            hit_data_array = np.array(hit_data)
+            scan = scan_frame(depsgraph, scanner_base, selected_lidar, parameters, current_frame,
+                              sweep_duration, sweep_start, organized=organized)
+            hit_records = scan.points
 
-            # Save the hit data array including intensities
-            file_path = os.path.join(scanner_folder, f"{current_frame}.npy")
-            np.save(file_path, hit_data_array)
+            # Append the frame to the scanner's chunked store on the background writer
+            store_scan(scanner_folder, selected_lidar, current_frame, scan, codec, key)
+            publish_scan(scanner_name, current_frame, frame_time, scan)
 
             # Update the points in the scene (optional visualization)
-            self.create_points(hit_data_array[:, :3], scanner_base)
+            preview_interval = scene.lidar_preview_interval
+            if preview_interval and current_frame % preview_interval == 0:
+                with profiler.stage(scanner_name, "preview", current_frame):
+                    self.create_points(point_locations(hit_records), scanner_base)
+            profiler.log(logger, scanner_name, "%s: %d points at frame %d", scanner_name, len(hit_records), current_frame)
 
             return {'FINISHED'}
  
 
         def create_points(self, locations, scanner_base):
+            import numpy as np
+
             # Ensure the "Scans" collection exists
             scans_collection = bpy.data.collections.get("Scans")
             if not scans_collection:
                 scans_collection = bpy.data.collections.new("Scans")
                 bpy.context.scene.collection.children.link(scans_collection)
 
-            # Delete old points with the same name
-            for obj in list(scans_collection.objects):
-                if obj.name.startswith(f"{scanner_name}"):
-                    bpy.data.objects.remove(obj, do_unlink=True)
+            # Reuse the scanner's point cloud object and mesh between frames
+            points_name = f"{scanner_name}_points"
+            obj = scans_collection.objects.get(points_name)
+            if obj is None:
+                mesh = bpy.data.meshes.get(points_name) or bpy.data.meshes.new(name=points_name)
+                obj = bpy.data.objects.new(points_name, mesh)
+                scans_collection.objects.link(obj)
+            mesh = obj.data
 
-            # Create a new mesh for the point cloud
-            mesh = bpy.data.meshes.new(name=f"{scanner_name}")
-            obj = bpy.data.objects.new(f"{scanner_name}", mesh)
-            scans_collection.objects.link(obj)
-
-            # Create the point cloud geometry using BMesh
-            bm = bmesh.new()
-            
-            # Convert numpy arrays to Blender Vectors for transformation
-            for loc in locations:
-                # Convert the numpy array to a Blender Vector
-                loc_vector = Vector(loc[:3])
-                # Apply the matrix transformation
-                loc_absolute = scanner_base.matrix_world @ loc_vector
-                # Add the transformed location as a vertex
-                bm.verts.new(loc_absolute)
-            
-            bm.to_mesh(mesh)
-            bm.free()
+            # Points stay in scanner space, the object follows the scanner instead
+            decimation = max(bpy.context.scene.lidar_preview_decimation, 1)
+            locations = np.ascontiguousarray(locations[::decimation], dtype=np.float32)
 
-            # Update the view layer to reflect changes
-            bpy.context.view_layer.objects.active = obj
-            obj.select_set(True)
+            mesh.clear_geometry()
+            mesh.vertices.add(len(locations))
+            mesh.vertices.foreach_set("co", locations.ravel())
+            mesh.update()
+            obj.matrix_world = scanner_base.matrix_world.copy()
 
 
 
@@ -206,7 +183,7 @@ class CreateScannerOperator(bpy.types.Operator):
 
         selected_lidar = scene.lidar_selection_dropdown
         if selected_lidar:
-            parameters = lidar_data[selected_lidar]["parameters"]
+            parameters = lidar_parameters(selected_lidar)
             params = {param_name: getattr(scene, f"lidar_{param_name}") for param_name in parameters.keys()}
             sensor_name = scene.lidar_name
 
@@ -215,6 +192,13 @@ class CreateScannerOperator(bpy.types.Operator):
             bpy.ops.object.empty_add(type='ARROWS', location=(0, 0, 0))
             scanner_base = context.active_object
             scanner_base.name = sensor_name if sensor_name else "New Scanner"
+            scanner_base[SCANNER_MODEL] = selected_lidar
+            scanner_base[SCANNER_PARAMETERS] = params
+            scanner_base[SCANNER_HZ] = scene.lidar_hz
+            scanner_base[SCANNER_PUBLISHER] = scene.lidar_publisher
+            scanner_base[SCANNER_FRAME_ID] = scene.lidar_frame_id
+            # only models with a beam table have a fixed ray grid to image
+            scanner_base[SCANNER_ORGANIZED] = scene.lidar_organized and "beams" in lidar_models()[selected_lidar]
 
             # Create a custom collection if it doesn't exist
             if "LiDAR" not in bpy.data.collections:
@@ -241,3 +225,7 @@ def register_create_scanner():
 
 def unregister_create_scanner():
     bpy.utils.unregister_class(CreateScannerOperator)
+    # the geometry cache only exists once a scanner ran
+    scene_geometry = sys.modules.get(SCENE_GEOMETRY_MODULE)
+    if scene_geometry is not None:
+        scene_geometry.unregister_geometry_cache()
@@ -1,59 +1,88 @@
+from functools import lru_cache
+
 import numpy as np
 
 def logit(x):
     return np.log(x / (1 - x))
 
 
-def rot_x(angle, vec):
-    angle = np.radians(angle)
-    M = np.array([[1,0,0], [0,np.cos(angle), -np.sin(angle)], [0,np.sin(angle),np.cos(angle)]])
-    return M @ vec
+def normalize_directions(vectors):
+    """Returns the rows of `vectors` as a contiguous float32 (N,3) array of unit vectors."""
+    vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 3)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(vectors / norms, dtype=np.float32)
 
-def rot_y(angle, vec):
-    angle = np.radians(angle)
-    M = np.array([[np.cos(angle),0,np.sin(angle)], [0,1,0], [-np.sin(angle),0,np.cos(angle)]])
-    return M @ vec
 
-def rot_z(angle, vec):
-    angle = np.radians(angle)
-    M = np.array([[np.cos(angle),-np.sin(angle),0], [np.sin(angle),np.cos(angle),0],[0,0,1]])
-    return M @ vec
+def scanner_rays(directions, world_matrix):
+    """Pattern `directions` (N,3) stretched by the axis scale of the scanner's 4x4 `world_matrix`,
+    the ray directions in its rotated but unscaled frame. A scaled scanner casts the same rays
+    as its matrix applied to the pattern."""
+    scale = np.linalg.norm(np.asarray(world_matrix, dtype=np.float64)[:3, :3], axis=0)
+    return normalize_directions(directions).astype(np.float64) * scale
 
 
+def scanner_points(directions, world_matrix, distances):
+    """Hits at world `distances` along the `scanner_rays` of `directions` in the scaled frame of
+    the scanner, where the inverse of its world matrix puts them."""
+    rays = scanner_rays(directions, world_matrix)
+    lengths = np.linalg.norm(rays, axis=1)
+    lengths[lengths == 0] = 1.0
+    return normalize_directions(directions) * (np.asarray(distances) / lengths)[:, None]
 
-def demo(current_frame, params):
 
-    results = []
-    results.append((1,1,1))
-    return results
+def spherical_directions(azimuths, elevations):
+    """Unit directions for every (azimuth, elevation) pair, azimuth-major. Angles in radians."""
+    azimuths = np.asarray(azimuths, dtype=np.float64)[:, None]
+    elevations = np.asarray(elevations, dtype=np.float64)[None, :]
+    cos_el = np.cos(elevations)
+    directions = np.empty((azimuths.shape[0], elevations.shape[1], 3), dtype=np.float32)
+    directions[..., 0] = cos_el * np.cos(azimuths)
+    directions[..., 1] = cos_el * np.sin(azimuths)
+    directions[..., 2] = np.sin(elevations)
+    return directions.reshape(-1, 3)
+
+
+def _frozen(array):
+    # cached patterns are shared between frames and scanners, so nobody may write into them
+    array.setflags(write=False)
+    return array
+
+
+@lru_cache(maxsize=None)
+def _demo_pattern():
+    return _frozen(normalize_directions([(1, 1, 1)]))
+
+
+def demo(current_frame, params):
+    return _demo_pattern()
 
 
+def sequential_firing(current_frame, params, count):
+    """Firing time of every ray as a fraction of the sweep, for patterns listed in firing order."""
+    return np.arange(count) / max(count, 1)
 
 
-def velodyne_hdl64(current_frame, params):
+def no_fields(current_frame, params):
+    """Per ray record fields of patterns without ring or azimuth metadata."""
+    return {}
 
-    results = []
 
-    v0 = np.array([1,0,0])
-    v1 = rot_y(-10, np.array([1,0,0]))
-    v2 = rot_y(-5, np.array([1,0,0]))
-    v3 = rot_y(5, np.array([1,0,0]))
-    v4 = rot_y(10, np.array([1,0,0]))
-    v5 = rot_y(-20, np.array([1,0,0]))
-    v6 = rot_y(20, np.array([1,0,0]))
+@lru_cache(maxsize=None)
+def _livox_logit_table(density):
+    vals = logit(np.linspace(0.01, 0.99, density))
+    vals -= np.min(vals)
+    vals /= np.max(vals)
+    return _frozen(vals)
 
-    for i in range(360):
-        results.append(rot_z(i, v0))
-        results.append(rot_z(i, v1))
-        results.append(rot_z(i, v2))
-        results.append(rot_z(i, v3))
-        results.append(rot_z(i, v4))
-        results.append(rot_z(i, v5))
-        results.append(rot_z(i, v6))
-    return results
 
+# seed sequences take non-negative entropy, negative frames and seeds wrap to 64 bit
+ENTROPY_MASK = 0xFFFFFFFFFFFFFFFF
 
 
+def frame_rng(current_frame, params):
+    """Generator of one frame of a random pattern, so any process scanning the frame draws the same rays."""
+    return np.random.default_rng([int(params.get("seed", 0)) & ENTROPY_MASK, int(current_frame) & ENTROPY_MASK])
 
 
 def livox_mid_40(current_frame, params):
@@ -65,23 +94,28 @@ def livox_mid_40(current_frame, params):
     angle = 38.4 / 2
     radius = np.tan(np.radians(angle))
     a = radius #/ 2
-    results = []
     start = current_frame * 2.0 * np.pi / k
 
-    for i in range(scans):
-        p = k + i + current_frame
-        vals = [logit(x) for x in np.linspace(0.01, 0.99, density)]
-        vals -= np.min(vals)
-        vals /= np.max(vals)
-
-        lily_half = (np.pi / k) * 0.5 + start * (2 * np.pi / k)
-        q = sorted([np.random.randint(0, 2 * k) * lily_half + lily_half * np.random.choice(vals, 1)[0] for _ in range(density)])
-        
-        
-        for e in q:
-            r = a * np.sin(start + p + e * k)
-            x = r * np.cos(e)
-            y = r * np.sin(e)
-
-            results.append((1,x,y))
-    return results
\ No newline at end of file
+    vals = _livox_logit_table(density)
+    lily_half = (np.pi / k) * 0.5 + start * (2 * np.pi / k)
+
+    rng = frame_rng(current_frame, params)
+    petals = rng.integers(0, 2 * k, size=(scans, density))
+    offsets = vals[rng.integers(0, density, size=(scans, density))]
+    q = np.sort(petals * lily_half + lily_half * offsets, axis=1)
+
+    p = (k + np.arange(scans) + current_frame)[:, None]
+    r = a * np.sin(start + p + q * k)
+
+    directions = np.empty((scans, density, 3), dtype=np.float64)
+    directions[..., 0] = 1.0
+    directions[..., 1] = r * np.cos(q)
+    directions[..., 2] = r * np.sin(q)
+    return normalize_directions(directions)
+
+
+# scan pattern of every models.json model without a beam table
+functions = {
+    "livox_mid40": livox_mid_40,
+    "demo": demo,
+}
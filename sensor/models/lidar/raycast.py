@@ -0,0 +1,515 @@
+import collections
+
+import numpy as np
+
+# maximum triangles per BVH leaf
+LEAF_SIZE = 8
+# centroid bins per axis evaluated by the SAH split search
+SAH_BINS = 16
+# rays traversed together; bounds the size of the per ray traversal stacks
+RAY_BATCH = 1 << 16
+# ignore hits closer than this to the ray origin
+T_MIN = 1e-6
+EPSILON = 1e-12
+
+RayHits = collections.namedtuple("RayHits", ["hit", "distance", "position", "normal", "object_id", "triangle"])
+
+
+def _segment_entries(starts, counts):
+    # positions covered by the ranges [start, start + count) and the range index of every position
+    offsets = np.cumsum(counts) - counts
+    segment = np.repeat(np.arange(len(counts)), counts)
+    return np.arange(counts.sum()) + (starts - offsets)[segment], segment, offsets
+
+
+def _surface_area(lo, hi):
+    extent = np.maximum(hi - lo, 0.0)
+    return extent[..., 0] * extent[..., 1] + extent[..., 1] * extent[..., 2] + extent[..., 2] * extent[..., 0]
+
+
+def _grouped_bounds(key, n_keys, lo, hi):
+    # per key bounds of the boxes (lo, hi); keys without entries stay empty (inf, -inf)
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    group_lo = np.full((n_keys, 3), np.inf)
+    group_hi = np.full((n_keys, 3), -np.inf)
+    group_lo[key[starts]] = np.minimum.reduceat(lo[order], starts, axis=0)
+    group_hi[key[starts]] = np.maximum.reduceat(hi[order], starts, axis=0)
+    return group_lo, group_hi
+
+
+def _sah_split(segment, centroids, tri_lo, tri_hi, n_segments):
+    """Chooses a binned SAH split for every segment; returns the side (0 left, 1 right) of every entry.
+
+    `segment` must be sorted and every segment must have at least one entry.
+    """
+    segment_counts = np.bincount(segment, minlength=n_segments)
+    offsets = np.cumsum(segment_counts) - segment_counts
+    c_lo = np.minimum.reduceat(centroids, offsets, axis=0)
+    c_hi = np.maximum.reduceat(centroids, offsets, axis=0)
+    extent = c_hi - c_lo
+    scale = np.divide(SAH_BINS, extent, out=np.zeros_like(extent), where=extent > 0)
+    bins = np.clip(((centroids - c_lo[segment]) * scale[segment]).astype(np.int64), 0, SAH_BINS - 1)
+
+    costs = np.full((n_segments, 3, SAH_BINS - 1), np.inf)
+    for axis in range(3):
+        key = segment * SAH_BINS + bins[:, axis]
+        counts = np.bincount(key, minlength=n_segments * SAH_BINS).reshape(n_segments, SAH_BINS)
+        bin_lo, bin_hi = _grouped_bounds(key, n_segments * SAH_BINS, tri_lo, tri_hi)
+        bin_lo = bin_lo.reshape(n_segments, SAH_BINS, 3)
+        bin_hi = bin_hi.reshape(n_segments, SAH_BINS, 3)
+
+        left_count = np.cumsum(counts, axis=1)[:, :-1]
+        right_count = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1][:, 1:]
+        left_area = _surface_area(np.minimum.accumulate(bin_lo, axis=1), np.maximum.accumulate(bin_hi, axis=1))[:, :-1]
+        right_area = _surface_area(np.minimum.accumulate(bin_lo[:, ::-1], axis=1),
+                                   np.maximum.accumulate(bin_hi[:, ::-1], axis=1))[:, ::-1][:, 1:]
+        cost = left_area * left_count + right_area * right_count
+        costs[:, axis] = np.where((left_count > 0) & (right_count > 0), cost, np.inf)
+
+    costs = costs.reshape(n_segments, -1)
+    best = costs.argmin(axis=1)
+    found = np.isfinite(costs[np.arange(n_segments), best])
+    split_axis, split_bin = np.divmod(best, SAH_BINS - 1)
+    side = (bins[np.arange(len(segment)), split_axis[segment]] > split_bin[segment]).astype(np.int64)
+
+    # all centroids of a segment in one bin: split it in the middle of its current order
+    if not found.all():
+        rank = np.arange(len(segment)) - offsets[segment]
+        fallback = ~found[segment]
+        side[fallback] = rank[fallback] >= segment_counts[segment[fallback]] // 2
+    return side
+
+
+def build_bvh(tri_lo, tri_hi, centroids, leaf_size=LEAF_SIZE):
+    """Binned SAH build that splits all nodes of one tree level per step.
+
+    Returns the primitive order, per node bounds, first child (-1 for leaves), the
+    [start, start + count) range of a leaf inside the primitive order and the tree depth.
+    Children are always stored next to each other, the root is node 0.
+    """
+    n = len(centroids)
+    order = np.arange(n)
+    levels = []
+    starts = np.zeros(1, dtype=np.int64)
+    counts = np.full(1, n, dtype=np.int64)
+    next_node = 1
+
+    while starts.size:
+        positions, segment, offsets = _segment_entries(starts, counts)
+        triangles = order[positions]
+        node_lo = np.minimum.reduceat(tri_lo[triangles], offsets, axis=0)
+        node_hi = np.maximum.reduceat(tri_hi[triangles], offsets, axis=0)
+
+        split = counts > leaf_size
+        child = np.full(len(starts), -1, dtype=np.int64)
+        child[split] = next_node + 2 * np.arange(split.sum())
+        levels.append((node_lo, node_hi, child, starts, counts))
+        if not split.any():
+            break
+
+        entries = split[segment]
+        remap = np.cumsum(split) - 1
+        split_segment = remap[segment[entries]]
+        split_triangles = triangles[entries]
+        n_split = int(split.sum())
+        side = _sah_split(split_segment, centroids[split_triangles], tri_lo[split_triangles],
+                          tri_hi[split_triangles], n_split)
+
+        # stable sort by (segment, side) keeps every segment in place and moves its left part first
+        regroup = np.argsort(split_segment * 2 + side, kind="stable")
+        order[positions[entries]] = split_triangles[regroup]
+
+        left = np.bincount(split_segment, weights=1 - side, minlength=n_split).astype(np.int64)
+        split_starts, split_counts = starts[split], counts[split]
+        starts = np.stack((split_starts, split_starts + left), axis=1).ravel()
+        counts = np.stack((left, split_counts - left), axis=1).ravel()
+        next_node += 2 * n_split
+
+    node_lo, node_hi, child, start, count = (np.concatenate(parts) for parts in zip(*levels))
+    return order, node_lo, node_hi, child, start, count, len(levels)
+
+
+def _prepare_rays(origins, directions, max_distance):
+    directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+    n = len(directions)
+    origins = np.broadcast_to(np.asarray(origins, dtype=np.float64).reshape(-1, 3), (n, 3))
+    limits = np.broadcast_to(np.asarray(max_distance, dtype=np.float64), (n,))
+    return origins, directions, limits
+
+
+def _slab(node_lo_axes, node_hi_axes, nodes, origins, inv_directions, limits):
+    # origins and inv_directions are (3, k); bounds are gathered per axis to keep the arrays flat
+    lo = node_lo_axes[:, nodes]
+    hi = node_hi_axes[:, nodes]
+    with np.errstate(invalid="ignore"):
+        lo -= origins
+        lo *= inv_directions
+        hi -= origins
+        hi *= inv_directions
+    # fmin/fmax skip the NaNs of rays lying exactly in a slab plane
+    near = np.fmin(lo, hi)
+    far = np.fmax(lo, hi)
+    t_near = np.fmax(np.fmax(near[0], near[1]), near[2])
+    t_far = np.fmin(np.fmin(far[0], far[1]), far[2])
+    hit = (t_far >= np.maximum(t_near, 0.0)) & (t_near <= limits)
+    return t_near, hit
+
+
+
+
+class TriangleBVH:
+    """Bounding volume hierarchy over the triangles of one mesh that answers whole ray batches at once.
+
+    The tree is built with a binned surface area heuristic, every tree level in one vectorized
+    step. Traversal advances all rays of a batch in lockstep, so the per ray cost is NumPy work only.
+    """
+
+    def __init__(self, vertices, triangles, triangle_objects=None, leaf_size=LEAF_SIZE):
+        vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+        self.leaf_size = leaf_size
+        self.n_triangles = len(triangles)
+        self.triangle_objects = None if triangle_objects is None else np.asarray(triangle_objects, dtype=np.int32)
+
+        corners = vertices[triangles]
+        if self.n_triangles:
+            (self.order, self.node_lo, self.node_hi, self.node_child,
+             self.node_start, self.node_count, self.depth) = build_bvh(
+                corners.min(axis=1), corners.max(axis=1), corners.mean(axis=1), leaf_size)
+        else:
+            self.order = np.zeros(0, dtype=np.int64)
+            self.node_lo = np.full((1, 3), np.inf)
+            self.node_hi = np.full((1, 3), -np.inf)
+            self.node_child = np.full(1, -1, dtype=np.int64)
+            self.node_start = np.zeros(1, dtype=np.int64)
+            self.node_count = np.zeros(1, dtype=np.int64)
+            self.depth = 1
+        self.node_lo_axes = np.ascontiguousarray(self.node_lo.T)
+        self.node_hi_axes = np.ascontiguousarray(self.node_hi.T)
+
+        corners = corners[self.order]
+        self.v0 = corners[:, 0]
+        self.e1 = corners[:, 1] - self.v0
+        self.e2 = corners[:, 2] - self.v0
+
+    @property
+    def bounds(self):
+        return self.node_lo[0], self.node_hi[0]
+
+    def cast(self, origins, directions, max_distance=np.inf):
+        """Casts every ray against the triangles and returns the closest hits as a RayHits of arrays.
+
+        `origins` and `directions` are (N,3) arrays, directions must be unit length so that
+        distances are metric. Misses have an infinite distance and an object id of -1.
+        """
+        origins, directions, limits = _prepare_rays(origins, directions, max_distance)
+        n = len(directions)
+
+        best_t = np.full(n, np.inf)
+        best_tri = np.full(n, -1, dtype=np.int64)
+        if self.n_triangles:
+            for start in range(0, n, RAY_BATCH):
+                batch = slice(start, start + RAY_BATCH)
+                roots = np.zeros(len(directions[batch]), dtype=np.int64)
+                best_t[batch], best_tri[batch] = self._closest(roots, origins[batch], directions[batch], limits[batch])
+
+        return self._hits(origins, directions, best_t, best_tri)
+
+    def _closest(self, roots, origins, directions, limits, item_rays=None, ray_best=None):
+        """Closest hit of every work item, each traversed from its own root node.
+
+        Items of the same ray (`item_rays`) share their entry in `ray_best`, so a hit found for one
+        item prunes the others. Returns the hit distance and sorted triangle index of every item.
+        """
+        n = len(roots)
+        if item_rays is None:
+            item_rays = np.arange(n)
+            ray_best = np.full(n, np.inf)
+        best_t = np.full(n, np.inf)
+        best_tri = np.full(n, -1, dtype=np.int64)
+
+        with np.errstate(divide="ignore"):
+            inv_directions = np.ascontiguousarray((1.0 / directions).T)
+        origins_axes = np.ascontiguousarray(origins.T)
+
+        # every item keeps its own stack of (node, entry distance); each round pops one node per item,
+        # tests leaves directly and pushes hit children far first, so nearer nodes are visited first
+        stack_nodes = np.zeros((n, self.depth + 1), dtype=np.int64)
+        stack_t = np.zeros((n, self.depth + 1))
+        stack_size = np.zeros(n, dtype=np.int64)
+
+        t_root, hit = _slab(self.node_lo_axes, self.node_hi_axes, roots, origins_axes, inv_directions, limits)
+        stack_nodes[hit, 0] = roots[hit]
+        stack_t[hit, 0] = t_root[hit]
+        stack_size[hit] = 1
+
+        while True:
+            items = np.flatnonzero(stack_size)
+            if items.size == 0:
+                break
+            stack_size[items] -= 1
+            top = stack_size[items]
+            nodes = stack_nodes[items, top]
+            closer = stack_t[items, top] < ray_best[item_rays[items]]
+            items, nodes = items[closer], nodes[closer]
+
+            leaf = self.node_child[nodes] < 0
+            if leaf.any():
+                leaf_items = items[leaf]
+                self._intersect_leaves(leaf_items, nodes[leaf], origins, directions, limits, best_t, best_tri)
+                np.minimum.at(ray_best, item_rays[leaf_items], best_t[leaf_items])
+                items, nodes = items[~leaf], nodes[~leaf]
+
+            # both children of every popped node in one slab test: first children, then second children
+            k = items.size
+            first_child = self.node_child[nodes]
+            pair_items = np.concatenate((items, items))
+            children = np.concatenate((first_child, first_child + 1))
+            t_child, hit_child = _slab(self.node_lo_axes, self.node_hi_axes, children,
+                                       origins_axes[:, pair_items], inv_directions[:, pair_items], limits[pair_items])
+            first_near = t_child[:k] <= t_child[k:]
+            near = np.where(first_near, np.arange(k), np.arange(k, 2 * k))
+            far = np.where(first_near, np.arange(k, 2 * k), np.arange(k))
+            for pick in (far, near):
+                pick = pick[hit_child[pick]]
+                self._push(stack_nodes, stack_t, stack_size, pair_items[pick], children[pick], t_child[pick])
+
+        return best_t, best_tri
+
+    @staticmethod
+    def _push(stack_nodes, stack_t, stack_size, items, nodes, t):
+        stack_nodes[items, stack_size[items]] = nodes
+        stack_t[items, stack_size[items]] = t
+        stack_size[items] += 1
+
+    def _intersect_leaves(self, items, leaves, origins, directions, limits, best_t, best_tri):
+        slots = np.arange(self.leaf_size)
+        valid = (slots < self.node_count[leaves][:, None]).ravel()
+        triangles = (self.node_start[leaves][:, None] + slots).ravel()[valid]
+        items = np.repeat(items, self.leaf_size)[valid]
+
+        t = self._intersect(origins[items], directions[items], triangles)
+        closer = (t < best_t[items]) & (t <= limits[items])
+        items, triangles, t = items[closer], triangles[closer], t[closer]
+        if items.size == 0:
+            return
+
+        order = np.lexsort((t, items))
+        items, triangles, t = items[order], triangles[order], t[order]
+        first = np.r_[True, items[1:] != items[:-1]]
+        best_t[items[first]] = t[first]
+        best_tri[items[first]] = triangles[first]
+
+    def _intersect(self, origins, directions, triangles):
+        # Moeller-Trumbore for every (ray, triangle) pair
+        v0, e1, e2 = self.v0[triangles], self.e1[triangles], self.e2[triangles]
+        p = np.cross(directions, e2)
+        det = np.einsum("ij,ij->i", e1, p)
+        valid = np.abs(det) > EPSILON
+        inv_det = np.divide(1.0, det, out=np.zeros_like(det), where=valid)
+
+        s = origins - v0
+        u = np.einsum("ij,ij->i", s, p) * inv_det
+        q = np.cross(s, e1)
+        v = np.einsum("ij,ij->i", directions, q) * inv_det
+        t = np.einsum("ij,ij->i", e2, q) * inv_det
+
+        valid &= (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0) & (t > T_MIN)
+        return np.where(valid, t, np.inf)
+
+    def _hits(self, origins, directions, best_t, best_tri):
+        hit = best_tri >= 0
+        sorted_tri = best_tri[hit]
+        position = np.full((len(best_t), 3), np.nan)
+        position[hit] = origins[hit] + directions[hit] * best_t[hit][:, None]
+
+        normal = np.full((len(best_t), 3), np.nan)
+        face = np.cross(self.e1[sorted_tri], self.e2[sorted_tri])
+        normal[hit] = face / np.maximum(np.linalg.norm(face, axis=1, keepdims=True), EPSILON)
+
+        triangle = np.full(len(best_t), -1, dtype=np.int64)
+        triangle[hit] = self.order[sorted_tri]
+
+        object_id = np.full(len(best_t), -1, dtype=np.int32)
+        if self.triangle_objects is not None:
+            object_id[hit] = self.triangle_objects[triangle[hit]]
+
+        return RayHits(hit, best_t, position, normal, object_id, triangle)
+
+
+def _joined(arrays, empty):
+    return np.concatenate(arrays) if arrays else empty
+
+
+class MeshPool(TriangleBVH):
+    """Several TriangleBVHs concatenated into one set of arrays.
+
+    Rays into different meshes then share a single lockstep traversal. `roots` holds the root
+    node of every mesh, `order` maps pool triangles back to the triangle index inside their mesh.
+    """
+
+    def __init__(self, meshes):
+        self.meshes = list(meshes)
+        self.leaf_size = max((mesh.leaf_size for mesh in self.meshes), default=LEAF_SIZE)
+        self.depth = max((mesh.depth for mesh in self.meshes), default=1)
+        self.triangle_objects = None
+
+        node_sizes = np.array([len(mesh.node_child) for mesh in self.meshes], dtype=np.int64)
+        triangle_sizes = np.array([mesh.n_triangles for mesh in self.meshes], dtype=np.int64)
+        self.roots = np.cumsum(node_sizes) - node_sizes
+        self.triangle_offsets = np.cumsum(triangle_sizes) - triangle_sizes
+        self.n_triangles = int(triangle_sizes.sum())
+
+        empty_vectors = np.zeros((0, 3))
+        empty_indices = np.zeros(0, dtype=np.int64)
+        self.node_lo = _joined([mesh.node_lo for mesh in self.meshes], empty_vectors)
+        self.node_hi = _joined([mesh.node_hi for mesh in self.meshes], empty_vectors)
+        self.node_child = _joined([np.where(mesh.node_child >= 0, mesh.node_child + root, -1)
+                                   for mesh, root in zip(self.meshes, self.roots)], empty_indices)
+        self.node_start = _joined([mesh.node_start + offset
+                                   for mesh, offset in zip(self.meshes, self.triangle_offsets)], empty_indices)
+        self.node_count = _joined([mesh.node_count for mesh in self.meshes], empty_indices)
+        self.node_lo_axes = np.ascontiguousarray(self.node_lo.T)
+        self.node_hi_axes = np.ascontiguousarray(self.node_hi.T)
+
+        self.order = _joined([mesh.order for mesh in self.meshes], empty_indices)
+        self.v0 = _joined([mesh.v0 for mesh in self.meshes], empty_vectors)
+        self.e1 = _joined([mesh.e1 for mesh in self.meshes], empty_vectors)
+        self.e2 = _joined([mesh.e2 for mesh in self.meshes], empty_vectors)
+
+
+# the eight corners of a box as (lo, hi) selectors per axis
+BOX_CORNERS = np.array([(x, y, z) for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=bool)
+
+
+class SceneBVH:
+    """Two level hierarchy: the meshes of a MeshPool placed in the world by instance transforms.
+
+    Only the small top level tree over instance bounds depends on the transforms, the meshes keep
+    their local space trees. Object ids reported by `cast` are instance indices and triangle
+    indices refer to the mesh of that instance.
+    """
+
+    def __init__(self, pool, instance_mesh, matrices):
+        self.pool = pool
+        self.instance_mesh = np.asarray(instance_mesh, dtype=np.int64)
+        self.matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+        self.inverse = np.linalg.inv(self.matrices) if len(self.matrices) else self.matrices.copy()
+
+        if len(self.instance_mesh):
+            mesh_lo = np.array([mesh.bounds[0] for mesh in pool.meshes])[self.instance_mesh]
+            mesh_hi = np.array([mesh.bounds[1] for mesh in pool.meshes])[self.instance_mesh]
+            corners = np.where(BOX_CORNERS[None], mesh_hi[:, None], mesh_lo[:, None])
+            world = np.einsum("nij,nkj->nki", self.matrices[:, :3, :3], corners) + self.matrices[:, None, :3, 3]
+            lo, hi = world.min(axis=1), world.max(axis=1)
+            self.top_order, lo, hi, self.top_child, self.top_start, _, _ = build_bvh(lo, hi, (lo + hi) / 2, leaf_size=1)
+            self.top_lo_axes = np.ascontiguousarray(lo.T)
+            self.top_hi_axes = np.ascontiguousarray(hi.T)
+
+    def cast(self, origins, directions, max_distance=np.inf):
+        """Same contract as TriangleBVH.cast, for every instance of the scene at once."""
+        origins, directions, limits = _prepare_rays(origins, directions, max_distance)
+        n = len(directions)
+
+        best_t = np.full(n, np.inf)
+        best_tri = np.full(n, -1, dtype=np.int64)
+        best_instance = np.full(n, -1, dtype=np.int64)
+        if len(self.instance_mesh) == 0:
+            return self._hits(origins, directions, best_t, best_tri, best_instance)
+
+        # instances are entered front to back in waves of doubling width, so instances behind a
+        # hit found in an earlier wave are never traversed
+        rays, instances, t_enter, rank = self._candidates(origins, directions, limits)
+        ray_best = limits.copy()
+        last_rank = rank.max() if rank.size else -1
+        first_rank, width = 0, 1
+        while first_rank <= last_rank:
+            wave = (rank >= first_rank) & (rank < first_rank + width)
+            wave[wave] = t_enter[wave] < ray_best[rays[wave]]
+            self._cast_wave(rays[wave], instances[wave], origins, directions, limits,
+                            ray_best, best_t, best_tri, best_instance)
+            first_rank += width
+            width *= 2
+
+        return self._hits(origins, directions, best_t, best_tri, best_instance)
+
+    def _cast_wave(self, rays, instances, origins, directions, limits, ray_best, best_t, best_tri, best_instance):
+        for start in range(0, len(rays), RAY_BATCH):
+            batch_rays = rays[start:start + RAY_BATCH]
+            batch_instances = instances[start:start + RAY_BATCH]
+            inverse = self.inverse[batch_instances]
+            local_origins = np.einsum("kij,kj->ki", inverse[:, :3, :3], origins[batch_rays]) + inverse[:, :3, 3]
+            local_directions = np.einsum("kij,kj->ki", inverse[:, :3, :3], directions[batch_rays])
+            roots = self.pool.roots[self.instance_mesh[batch_instances]]
+
+            # directions are transformed but not renormalized, so local distances stay world distances
+            t, tri = self.pool._closest(roots, local_origins, local_directions, limits[batch_rays], batch_rays, ray_best)
+
+            closer = t < best_t[batch_rays]
+            batch_rays, batch_instances, t, tri = batch_rays[closer], batch_instances[closer], t[closer], tri[closer]
+            if batch_rays.size == 0:
+                continue
+            order = np.lexsort((t, batch_rays))
+            batch_rays, batch_instances, t, tri = batch_rays[order], batch_instances[order], t[order], tri[order]
+            first = np.r_[True, batch_rays[1:] != batch_rays[:-1]]
+            best_t[batch_rays[first]] = t[first]
+            best_tri[batch_rays[first]] = tri[first]
+            best_instance[batch_rays[first]] = batch_instances[first]
+
+    def _candidates(self, origins, directions, limits):
+        # all (ray, instance) pairs whose instance bounds the ray enters within its limit, with the
+        # entry distance and the rank of the pair among the pairs of its ray, sorted by ray and rank
+        with np.errstate(divide="ignore"):
+            inv_directions = np.ascontiguousarray((1.0 / directions).T)
+        origins_axes = np.ascontiguousarray(origins.T)
+
+        rays = np.arange(len(directions))
+        nodes = np.zeros(len(directions), dtype=np.int64)
+        found_rays = []
+        found_instances = []
+        found_t = []
+        while rays.size:
+            t_near, hit = _slab(self.top_lo_axes, self.top_hi_axes, nodes,
+                                origins_axes[:, rays], inv_directions[:, rays], limits[rays])
+            rays, nodes, t_near = rays[hit], nodes[hit], t_near[hit]
+            leaf = self.top_child[nodes] < 0
+            found_rays.append(rays[leaf])
+            found_instances.append(self.top_order[self.top_start[nodes[leaf]]])
+            found_t.append(t_near[leaf])
+            rays, nodes = rays[~leaf], self.top_child[nodes[~leaf]]
+            rays = np.concatenate((rays, rays))
+            nodes = np.concatenate((nodes, nodes + 1))
+
+        rays = np.concatenate(found_rays)
+        instances = np.concatenate(found_instances)
+        t_enter = np.maximum(np.concatenate(found_t), 0.0)
+        order = np.lexsort((t_enter, rays))
+        rays, instances, t_enter = rays[order], instances[order], t_enter[order]
+
+        rank = np.zeros(len(rays), dtype=np.int64)
+        if rays.size:
+            starts = np.flatnonzero(np.r_[True, rays[1:] != rays[:-1]])
+            rank = np.arange(len(rays)) - np.repeat(starts, np.diff(np.r_[starts, len(rays)]))
+        return rays, instances, t_enter, rank
+
+    def _hits(self, origins, directions, best_t, best_tri, best_instance):
+        hit = best_instance >= 0
+        pool_tri = best_tri[hit]
+        position = np.full((len(best_t), 3), np.nan)
+        position[hit] = origins[hit] + directions[hit] * best_t[hit][:, None]
+
+        # local face normals go to world space with the inverse transpose of the instance transform
+        normal = np.full((len(best_t), 3), np.nan)
+        face = np.cross(self.pool.e1[pool_tri], self.pool.e2[pool_tri])
+        face = np.einsum("kji,kj->ki", self.inverse[best_instance[hit], :3, :3], face)
+        normal[hit] = face / np.maximum(np.linalg.norm(face, axis=1, keepdims=True), EPSILON)
+
+        triangle = np.full(len(best_t), -1, dtype=np.int64)
+        triangle[hit] = self.pool.order[pool_tri]
+
+        object_id = np.full(len(best_t), -1, dtype=np.int32)
+        object_id[hit] = best_instance[hit]
+
+        return RayHits(hit, best_t, position, normal, object_id, triangle)
@@ -1,34 +1,18 @@
-
 import bpy
-import os
 import json
-import bmesh
 import logging
-import numpy as np
-from mathutils import Vector
 from pathlib import Path
-import sys
-
-
-#begin preprocessing
-project_root = "/home/jan/Workspace/lidar_scanner2/otia"
-#end preprocessing 
-sys.path.append(project_root)
-
-
-print("sys.path after:", sys.path)
-
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-def save_lidar_ros_info(path):
+def save_lidar_ros_info(path, publisher, frame_id, hz):
     logger.info("PATH: %s", path)
 
     info = {
-        "publisher": bpy.context.scene.lidar_publisher,
-        "frame_id": bpy.context.scene.lidar_frame_id,
-        "hz": bpy.context.scene.lidar_hz
+        "publisher": publisher,
+        "frame_id": frame_id,
+        "hz": hz,
+        "milliseconds_per_frame": bpy.context.scene.milliseconds_per_frame,
     }
 
     try:
@@ -0,0 +1,159 @@
+import collections
+import logging
+
+import numpy as np
+
+from output.chunked_store import ChunkedWriter
+from output.frame_cache import content_key, frame_cache
+from output.live import live_output
+from output.profiling import profiler
+from output.writer import flush_outputs, output_writer
+from output.records import RANGE_IMAGE_DTYPE, RANGE_IMAGE_STORE, lidar_point_dtype, lidar_points, range_image
+from sensor.models.lidar.lidar_functionality import normalize_directions, scanner_points, scanner_rays
+from sensor.models.lidar.scene_geometry import geometry_cache, register_geometry_cache
+from sensor.pose import interpolate_poses
+from sensor.registry import lidar_models, scan_functions
+from sensor.schedule import sample_due
+from sensor.trajectory import scan_poses
+
+logger = logging.getLogger(__name__)
+
+# hits of a scan as point records, for organized output the flat range image, and the number
+# of rays cast, which bounds the points of every scan of the pattern
+Scan = collections.namedtuple("Scan", ["points", "range_image", "rays"])
+
+
+def scan_frame(depsgraph, scanner_base, selected_lidar, parameters, current_frame, sweep_duration=0.0, sweep_start=None,
+               organized=False):
+    """Casts the whole pattern of `selected_lidar` from `scanner_base` in one batch.
+
+    Every ray fires at its own time of the sweep that ends at the current pose and lasts
+    `sweep_duration` seconds. With the 4x4 world matrix `sweep_start` of the scanner when the
+    sweep began, each ray is cast from the pose interpolated at its firing time, otherwise all
+    rays leave from the current pose.
+    Returns a Scan of the hits as lidar point records in scanner space at their firing pose,
+    which is scaled like the scanner's world matrix, `time` is the firing time relative to the frame, in [-sweep_duration, 0]. Beam table models
+    add the ring and azimuth of every point, and with `organized` the range image of all rays.
+    """
+    # the cache follows depsgraph updates from the first scan of the session on
+    register_geometry_cache()
+    world_matrix = np.array(scanner_base.matrix_world)
+    sensor = scanner_base.name
+
+    with profiler.stage(sensor, "pattern", current_frame) as counters:
+        model = scan_functions(selected_lidar)
+        directions_local = model.pattern(current_frame, parameters)
+        firing = model.firing(current_frame, parameters, len(directions_local))
+        fields = model.fields(current_frame, parameters)
+        counters["rays"] = len(directions_local)
+
+    with profiler.stage(sensor, "transform", current_frame):
+        if sweep_start is None:
+            sweep_start, weights = world_matrix, np.ones(len(directions_local))
+        else:
+            weights = firing
+        rotations, origins = interpolate_poses(sweep_start, world_matrix, weights)
+        # the interpolated rotations carry no scale, a scaled scanner stretches its pattern first
+        rays = scanner_rays(directions_local, world_matrix)
+        directions = normalize_directions(np.einsum("nij,nj->ni", rotations, rays))
+
+    scene_bvh = geometry_cache.scene_bvh(depsgraph)
+    with profiler.stage(sensor, "cast", current_frame) as counters:
+        hits = scene_bvh.cast(origins, directions, parameters['max_distance'])
+        counters["rays"] = len(directions)
+        counters["hits"] = int(np.count_nonzero(hits.hit))
+
+    with profiler.stage(sensor, "intensity", current_frame):
+        intensity = geometry_cache.hit_intensity(hits) * 255
+
+    with profiler.stage(sensor, "records", current_frame):
+        locations = scanner_points(directions_local[hits.hit], world_matrix, hits.distance[hits.hit])
+        times = (firing[hits.hit] - 1.0) * sweep_duration
+        fields = {name: values[hits.hit] for name, values in fields.items()}
+        points = lidar_points(locations, intensity, time=times, **fields)
+
+    image = None
+    if organized and model.layout is not None:
+        with profiler.stage(sensor, "range_image", current_frame):
+            rows, columns = model.layout.shape
+            image = range_image(rows * columns, model.layout.pixel[hits.hit], hits.distance[hits.hit], intensity)
+    return Scan(points, image, len(directions_local))
+
+
+def scan_key(depsgraph, scanner_base, selected_lidar, parameters, current_frame, sweep_duration=0.0, sweep_start=None,
+             organized=False, codec=None):
+    """Content key of the scan `scan_frame` returns for the same arguments, stored as `codec`.
+    Covers the model's models.json entry, the parameters with their seed, the sweep's poses and
+    the revision of the scene geometry."""
+    register_geometry_cache()
+    return content_key(
+        "lidar", selected_lidar, lidar_models()[selected_lidar], parameters, current_frame, sweep_duration,
+        np.array(scanner_base.matrix_world), None if sweep_start is None else np.asarray(sweep_start, dtype=np.float64),
+        bool(organized), codec.spec if codec is not None else None, geometry_cache.scene_revision(depsgraph))
+
+
+def sweep_start_pose(scanner_name, time, sweep_duration):
+    """World matrix of the scanner when the sweep ending at `time` began, interpolated from the
+    poses of its scans; None if no scan is close enough before it."""
+    return scan_poses.matrix_at(scanner_name, time - sweep_duration, max_gap=2 * sweep_duration)
+
+
+def scan_due(scene, current_frame, hz):
+    """True if a scan of a `hz` scanner falls into `current_frame`."""
+    return sample_due(hz, scene.milliseconds_per_frame, current_frame)
+
+
+# one open store per scanner folder, kept for one simulation
+lidar_stores = {}
+
+
+def lidar_store(folder, dtype=None, name="points", metadata=None, codec=None):
+    """Store of a scanner folder, created for records of `dtype` (x, y, z, intensity, time by default)
+    encoded with `codec`."""
+    if (folder, name) not in lidar_stores:
+        dtype = dtype if dtype is not None else lidar_point_dtype("time")
+        lidar_stores[folder, name] = ChunkedWriter(folder, dtype, name, metadata=metadata, codec=codec)
+    return lidar_stores[folder, name]
+
+
+def close_lidar_stores():
+    """Waits for the pending scans and closes every store, so the next simulation opens them
+    again with its own output folder and codec."""
+    flush_outputs()
+    for store in lidar_stores.values():
+        store.close()
+    lidar_stores.clear()
+
+
+def range_image_metadata(selected_lidar):
+    """Header of a range image store: the image shape, the ring of every row and the beam table
+    the pixels' directions are compiled from (sensor.models.lidar.beams.range_image_locations)."""
+    layout = scan_functions(selected_lidar).layout
+    return {
+        "model": selected_lidar,
+        "shape": list(layout.shape),
+        "rings": layout.rings.tolist(),
+        "beams": lidar_models()[selected_lidar]["beams"],
+    }
+
+
+def store_scan(folder, selected_lidar, frame, scan, codec=None, key=None):
+    """Appends a scan on the background writer, which also encodes it: the range image if it
+    has one, else the points. The scan's `key` is recorded in the frame cache once it is written,
+    without a key the frame's cached key is forgotten."""
+    if scan.range_image is None:
+        store = lidar_store(folder, scan.points.dtype, codec=codec)
+        records = scan.points
+    else:
+        store = lidar_store(folder, RANGE_IMAGE_DTYPE, RANGE_IMAGE_STORE, range_image_metadata(selected_lidar), codec)
+        records = scan.range_image
+    output_writer().submit(folder, store.append, frame, records)
+    output_writer().submit(folder, frame_cache.record, folder, frame, key)
+
+
+def publish_scan(sensor, frame, time, scan):
+    """Publishes a scan live if that is on, in the records its store gets."""
+    if scan.range_image is None:
+        live_output.publish(sensor, frame, time, scan.points, capacity=scan.rays)
+    else:
+        live_output.publish(sensor, frame, time, scan.range_image)
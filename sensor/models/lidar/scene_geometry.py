@@ -0,0 +1,221 @@
+import logging
+
+import bpy
+import numpy as np
+from bpy.app.handlers import persistent
+
+from output.frame_cache import content_key
+from output.profiling import profiler
+from sensor.models.lidar.intensity import IntensityTable, material_intensity
+from sensor.models.lidar.raycast import MeshPool, SceneBVH, TriangleBVH
+
+logger = logging.getLogger(__name__)
+
+# object types that can be converted to a triangle mesh and therefore block rays
+GEOMETRY_TYPES = {'MESH', 'CURVE', 'SURFACE', 'META', 'FONT'}
+
+
+def mesh_arrays(obj):
+    """Local vertex positions (V,3), triangle vertex indices (T,3) and triangle material slots (T,) of an evaluated object."""
+    mesh = obj.to_mesh()
+    try:
+        mesh.calc_loop_triangles()
+        vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", vertices)
+        triangles = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get("vertices", triangles)
+        materials = np.empty(len(mesh.loop_triangles), dtype=np.int32)
+        mesh.loop_triangles.foreach_get("material_index", materials)
+    finally:
+        obj.to_mesh_clear()
+    return vertices.reshape(-1, 3), triangles.reshape(-1, 3), materials
+
+
+def mesh_key(obj):
+    """Cache key of the evaluated geometry of `obj`.
+
+    Undeformed mesh objects share the tree of their mesh datablock, everything else
+    (modifiers, shape keys, curves, text) gets a tree per object.
+    """
+    original = obj.original
+    if original.type == 'MESH' and not original.modifiers and original.data.shape_keys is None:
+        return ('MESH', original.data.name_full)
+    return ('OBJECT', original.name_full)
+
+
+class SceneGeometryCache:
+    """Two level acceleration structure of the evaluated scene that persists between frames.
+
+    Bottom level trees are kept per mesh in local space and rebuilt only when the depsgraph
+    reports a geometry update for them. The top level over object transforms is cheap and is
+    rebuilt once after every depsgraph update, then shared by all scanners of that frame.
+    `objects` holds the original object of every object id reported by the scene's `cast`.
+
+    Material intensities are cached per material until the depsgraph reports an edit and are
+    laid out per frame in an IntensityTable, so the intensity of a whole scan is one gather.
+
+    `revision` is a content hash of what the scanners see: the geometry of every mesh, the
+    instance transforms and the intensities. It is equal between sessions for equal scenes.
+    It is hashed from per-mesh digests taken when a mesh is extracted, without building any
+    tree, so a frame whose sensors are all cached never pays for one. Meshes extracted for the
+    revision keep their arrays until the trees are built from them.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.meshes = {}
+        self.mesh_materials = {}
+        self.mesh_digests = {}
+        self.mesh_triangles = {}
+        self.extracted = {}
+        self.dirty = set()
+        self.pool = None
+        self.pool_keys = []
+        self.pool_materials = np.zeros(0, dtype=np.int32)
+        self.instances = None
+        self.scene = None
+        self.objects = []
+        self.material_intensities = {}
+        self.intensity = IntensityTable([])
+        self.revision = None
+
+    def tag_updates(self, depsgraph):
+        self.instances = None
+        self.scene = None
+        for update in depsgraph.updates:
+            datablock = update.id.original
+            if datablock.id_type == 'OBJECT' and update.is_updated_geometry:
+                self.dirty.add(mesh_key(datablock))
+            elif datablock.id_type == 'MESH' and update.is_updated_geometry:
+                self.dirty.add(('MESH', datablock.name_full))
+            elif datablock.id_type == 'MATERIAL':
+                self.material_intensities.pop(datablock.name_full, None)
+            elif datablock.id_type == 'NODETREE':
+                # node groups can feed any material
+                self.material_intensities.clear()
+
+    def scene_bvh(self, depsgraph):
+        if self.scene is None:
+            self._collect_instances(depsgraph)
+            with profiler.stage("scene", "bvh") as counters:
+                self._build_scene(counters)
+        return self.scene
+
+    def scene_revision(self, depsgraph):
+        self._collect_instances(depsgraph)
+        return self.revision
+
+    def _collect_instances(self, depsgraph):
+        """Instances, intensities and revision of the evaluated scene; extracts and hashes the
+        new and changed meshes."""
+        if self.instances is not None:
+            return
+        with profiler.stage("scene", "revision") as counters:
+            extracted = 0
+            seen = set()
+            instance_keys = []
+            matrices = []
+            objects = []
+            for instance in depsgraph.object_instances:
+                obj = instance.object
+                if obj.type not in GEOMETRY_TYPES:
+                    continue
+                # vertex only meshes such as the scan previews never block rays
+                if obj.type == 'MESH' and not obj.data.polygons:
+                    continue
+                key = mesh_key(obj)
+                if key not in seen:
+                    seen.add(key)
+                    if key in self.dirty or key not in self.mesh_digests:
+                        vertices, triangles, materials = mesh_arrays(obj)
+                        self.extracted[key] = (vertices, triangles, materials)
+                        self.mesh_digests[key] = content_key(vertices, triangles, materials)
+                        self.mesh_triangles[key] = len(triangles)
+                        extracted += 1
+                if self.mesh_triangles[key] == 0:
+                    continue
+                instance_keys.append(key)
+                matrices.append(np.array(instance.matrix_world))
+                objects.append(obj.original)
+
+            for key in set(self.mesh_digests) - seen:
+                del self.mesh_digests[key]
+                del self.mesh_triangles[key]
+                self.meshes.pop(key, None)
+                self.mesh_materials.pop(key, None)
+                self.extracted.pop(key, None)
+            self.dirty.clear()
+
+            intensities = [[self.slot_intensity(slot.material) for slot in obj.material_slots] for obj in objects]
+            self.instances = (instance_keys, np.array(matrices))
+            self.objects = objects
+            self.intensity = IntensityTable(intensities)
+            self.revision = content_key([self.mesh_digests[key] for key in instance_keys],
+                                        np.array(matrices, dtype=np.float64), intensities).hex()
+            counters.update(instances=len(objects), extracted=extracted)
+
+    def _build_scene(self, counters):
+        instance_keys, matrices = self.instances
+        rebuilt = 0
+        for key, (vertices, triangles, materials) in self.extracted.items():
+            self.meshes[key] = TriangleBVH(vertices, triangles)
+            self.mesh_materials[key] = materials
+            rebuilt += 1
+        self.extracted.clear()
+
+        pool_keys = list(dict.fromkeys(instance_keys))
+        if rebuilt or pool_keys != self.pool_keys:
+            self.pool = MeshPool([self.meshes[key] for key in pool_keys])
+            self.pool_keys = pool_keys
+            self.pool_materials = np.concatenate([self.mesh_materials[key] for key in pool_keys] or
+                                                 [np.zeros(0, dtype=np.int32)])
+        mesh_index = {key: i for i, key in enumerate(pool_keys)}
+
+        self.scene = SceneBVH(self.pool, [mesh_index[key] for key in instance_keys], matrices)
+        counters.update(instances=len(instance_keys), meshes=len(pool_keys), rebuilt=rebuilt)
+
+    def slot_intensity(self, mat):
+        if mat is None:
+            return material_intensity(None)
+        if mat.name_full not in self.material_intensities:
+            self.material_intensities[mat.name_full] = material_intensity(mat)
+        return self.material_intensities[mat.name_full]
+
+    def hit_intensity(self, hits):
+        """Intensity of every hit of a scene `cast`, looked up by object and triangle material slot."""
+        object_ids = hits.object_id[hits.hit]
+        first_triangle = self.pool.triangle_offsets[self.scene.instance_mesh[object_ids]]
+        materials = self.pool_materials[first_triangle + hits.triangle[hits.hit]]
+        return self.intensity.lookup(object_ids, materials)
+
+
+geometry_cache = SceneGeometryCache()
+
+
+@persistent
+def tag_geometry_updates(scene, depsgraph):
+    geometry_cache.tag_updates(depsgraph)
+
+
+@persistent
+def clear_geometry_cache(*args):
+    geometry_cache.clear()
+
+
+def register_geometry_cache():
+    for handlers, handler in ((bpy.app.handlers.depsgraph_update_post, tag_geometry_updates),
+                              (bpy.app.handlers.frame_change_post, tag_geometry_updates),
+                              (bpy.app.handlers.load_post, clear_geometry_cache)):
+        if handler not in handlers:
+            handlers.append(handler)
+
+
+def unregister_geometry_cache():
+    for handlers, handler in ((bpy.app.handlers.depsgraph_update_post, tag_geometry_updates),
+                              (bpy.app.handlers.frame_change_post, tag_geometry_updates),
+                              (bpy.app.handlers.load_post, clear_geometry_cache)):
+        if handler in handlers:
+            handlers.remove(handler)
+    geometry_cache.clear()
@@ -0,0 +1,90 @@
+import numpy as np
+
+
+def matrix_quaternions(rotations):
+    """Unit quaternions (N,4) as w, x, y, z of rotation matrices (N,3,3); column scale is ignored."""
+    rotations = np.asarray(rotations, dtype=np.float64).reshape(-1, 3, 3)
+    rotations = rotations / np.linalg.norm(rotations, axis=1, keepdims=True)
+    m = rotations
+    trace = m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2]
+
+    # each row uses the largest of the four candidate components to stay well conditioned
+    candidates = np.stack([trace, m[:, 0, 0], m[:, 1, 1], m[:, 2, 2]], axis=1)
+    case = np.argmax(candidates, axis=1)
+    q = np.empty((len(m), 4))
+
+    rows = case == 0
+    s = np.sqrt(1.0 + trace[rows]) * 2
+    q[rows] = np.stack([0.25 * s,
+                        (m[rows, 2, 1] - m[rows, 1, 2]) / s,
+                        (m[rows, 0, 2] - m[rows, 2, 0]) / s,
+                        (m[rows, 1, 0] - m[rows, 0, 1]) / s], axis=1)
+    for axis in range(3):
+        rows = case == axis + 1
+        i, j, k = axis, (axis + 1) % 3, (axis + 2) % 3
+        s = np.sqrt(1.0 + m[rows, i, i] - m[rows, j, j] - m[rows, k, k]) * 2
+        q[rows, 0] = (m[rows, k, j] - m[rows, j, k]) / s
+        q[rows, 1 + i] = 0.25 * s
+        q[rows, 1 + j] = (m[rows, j, i] + m[rows, i, j]) / s
+        q[rows, 1 + k] = (m[rows, k, i] + m[rows, i, k]) / s
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def quaternion_matrices(q):
+    """Rotation matrices (N,3,3) of quaternions (N,4) as w, x, y, z."""
+    q = np.asarray(q, dtype=np.float64).reshape(-1, 4)
+    w, x, y, z = (q / np.linalg.norm(q, axis=1, keepdims=True)).T
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)], axis=1),
+        np.stack([2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)], axis=1),
+        np.stack([2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)], axis=1),
+    ], axis=1)
+
+
+def slerp(q0, q1, weights):
+    """Spherical interpolation from q0 to q1 (4,) at every weight of `weights` (N,)."""
+    q0 = np.asarray(q0, dtype=np.float64)
+    q1 = np.asarray(q1, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)[:, None]
+    dot = np.dot(q0, q1)
+    if dot < 0:
+        # take the short way around
+        q1, dot = -q1, -dot
+    if dot > 0.9995:
+        q = q0 + weights * (q1 - q0)
+        return q / np.linalg.norm(q, axis=1, keepdims=True)
+    theta = np.arccos(dot)
+    return (np.sin((1 - weights) * theta) * q0 + np.sin(weights * theta) * q1) / np.sin(theta)
+
+
+def interpolate_poses(start, end, weights):
+    """Rotations (N,3,3) and translations (N,3) between two 4x4 world matrices at `weights` in [0, 1]."""
+    start = np.asarray(start, dtype=np.float64)
+    end = np.asarray(end, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    q0, q1 = matrix_quaternions(np.stack([start[:3, :3], end[:3, :3]]))
+    rotations = quaternion_matrices(slerp(q0, q1, weights))
+    translations = start[:3, 3] + weights[:, None] * (end[:3, 3] - start[:3, 3])
+    return rotations, translations
+
+
+def quaternion_multiply(a, b):
+    """Hamilton products of quaternions (N,4) as w, x, y, z."""
+    aw, ax, ay, az = np.moveaxis(np.asarray(a, dtype=np.float64), -1, 0)
+    bw, bx, by, bz = np.moveaxis(np.asarray(b, dtype=np.float64), -1, 0)
+    return np.stack([aw * bw - ax * bx - ay * by - az * bz,
+                     aw * bx + ax * bw + ay * bz - az * by,
+                     aw * by - ax * bz + ay * bw + az * bx,
+                     aw * bz + ax * by - ay * bx + az * bw], axis=-1)
+
+
+def quaternion_conjugate(q):
+    return np.asarray(q, dtype=np.float64) * np.array([1.0, -1.0, -1.0, -1.0])
+
+
+def continuous_quaternions(q):
+    """Flips signs so that consecutive quaternions (N,4) lie in the same hemisphere."""
+    q = np.array(q, dtype=np.float64)
+    flips = np.sum(q[1:] * q[:-1], axis=1) < 0
+    q[1:][np.cumsum(flips) % 2 == 1] *= -1
+    return q
@@ -0,0 +1,49 @@
+"""Declarative sensor configuration, cheap enough to import when the add-on loads.
+
+Only the standard library is used here; the NumPy scan patterns and beam tables are imported
+the first time a scanner actually runs.
+"""
+import collections
+import json
+from functools import lru_cache
+from pathlib import Path
+
+LIDAR_MODELS_FILE = Path(__file__).parent / "models" / "lidar" / "models.json"
+
+# per frame functions of a LiDAR model: ray directions, their firing times as fractions of the
+# sweep and extra per ray record fields such as ring and azimuth, plus the range image layout of
+# models with a fixed ray grid (None for the others)
+ScanModel = collections.namedtuple("ScanModel", ["pattern", "firing", "fields", "layout"])
+
+# continuous time noise parameters as in Kalibr's IMU noise model, name -> (label, unit, default)
+# https://github.com/ethz-asl/kalibr/wiki/IMU-Noise-Model
+NOISE_PARAMETERS = {
+    "accelerometer_noise_density": ("Accelerometer Noise Density", "m/s²/√Hz", 2.0e-3),
+    "accelerometer_random_walk": ("Accelerometer Random Walk", "m/s³/√Hz", 3.0e-3),
+    "gyroscope_noise_density": ("Gyroscope Noise Density", "rad/s/√Hz", 1.6968e-4),
+    "gyroscope_random_walk": ("Gyroscope Random Walk", "rad/s²/√Hz", 1.9393e-5),
+}
+
+
+@lru_cache(maxsize=None)
+def lidar_models():
+    """Contents of models.json: name, description and parameters of every LiDAR model,
+    parsed once per session."""
+    with open(LIDAR_MODELS_FILE, 'r') as file:
+        return json.load(file)
+
+
+def lidar_parameters(model):
+    """Parameter descriptions of one LiDAR model: type, description, default and min."""
+    return lidar_models()[model]["parameters"]
+
+
+def scan_functions(model):
+    """ScanModel of a LiDAR model, importing the patterns on first use. Models with a "beams"
+    table are compiled from it, the others are functions in lidar_functionality."""
+    if "beams" in lidar_models()[model]:
+        from sensor.models.lidar.beams import beam_functions
+        return beam_functions(model)
+    from sensor.models.lidar.lidar_functionality import functions, no_fields, sequential_firing
+    # the patterns of these models are listed in firing order
+    return ScanModel(functions[model], sequential_firing, no_fields, None)
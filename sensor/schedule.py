@@ -0,0 +1,85 @@
+from collections import namedtuple
+
+import numpy as np
+
+# one evaluation of the scene; `sensors` lists every sensor that samples at this time
+Step = namedtuple("Step", ["frame", "subframe", "time", "sensors"])
+
+
+def _sample_range(hz, milliseconds_per_frame, frame_start, frame_end):
+    """Indices k of the samples k / hz seconds that lie within the frame range, and the
+    denominator of their frame positions k * 1000 / (hz * milliseconds_per_frame)."""
+    denominator = hz * milliseconds_per_frame
+    first = -((-frame_start * denominator) // 1000)
+    last = (frame_end * denominator) // 1000
+    return np.arange(first, last + 1, dtype=np.int64), denominator
+
+
+def sample_due(hz, milliseconds_per_frame, frame):
+    """True if a sensor of `hz` has a sample within [frame, frame + 1)."""
+    if hz <= 0:
+        return False
+    samples, denominator = _sample_range(hz, milliseconds_per_frame, frame, frame + 1)
+    return bool(len(samples)) and samples[0] * 1000 < (frame + 1) * denominator
+
+
+class SensorScheduler:
+    """Exact sample schedule of sensors running at different rates.
+
+    Frame f is the time f * milliseconds_per_frame ms, a sensor of `hz` samples at every
+    multiple of 1 / hz seconds within [frame_start, frame_end]. Positions are kept as exact
+    fractions, so rates never drift and sensors that sample at the same time share a step.
+    Sensors added with `subframes=False` are snapped to the frame their sample falls in and
+    sample at most once per frame; the others are evaluated at the sub-frame time.
+    """
+
+    def __init__(self, milliseconds_per_frame, frame_start, frame_end):
+        self.milliseconds_per_frame = milliseconds_per_frame
+        self.frame_start = frame_start
+        self.frame_end = frame_end
+        self.sensors = {}
+
+    def add(self, sensor, hz, subframes=False):
+        if hz <= 0:
+            self.sensors[sensor] = (np.zeros(0, dtype=np.int64),) * 3
+            return
+        samples, denominator = _sample_range(hz, self.milliseconds_per_frame, self.frame_start, self.frame_end)
+        frames, remainders = np.divmod(samples * 1000, denominator)
+        if subframes:
+            divisors = np.gcd(remainders, denominator)
+            numerators, denominators = remainders // divisors, denominator // divisors
+        else:
+            frames = np.unique(frames)
+            numerators, denominators = np.zeros(len(frames), dtype=np.int64), np.ones(len(frames), dtype=np.int64)
+        self.sensors[sensor] = (frames, numerators, denominators)
+
+    def add_frames(self, sensor):
+        """Samples `sensor` at the start of every frame of the range."""
+        frames = np.arange(self.frame_start, self.frame_end + 1, dtype=np.int64)
+        self.sensors[sensor] = (frames, np.zeros(len(frames), dtype=np.int64), np.ones(len(frames), dtype=np.int64))
+
+    def frames(self, sensor):
+        """Frames in which `sensor` samples."""
+        return np.unique(self.sensors[sensor][0])
+
+    def samples(self, sensor):
+        """(frame, subframe) of every sample of `sensor`, in time order."""
+        frames, numerators, denominators = self.sensors[sensor]
+        return [(int(frame), numerator / denominator)
+                for frame, numerator, denominator in zip(frames.tolist(), numerators.tolist(), denominators.tolist())]
+
+    def times(self, sensor):
+        """Timestamps of the samples of `sensor` in seconds."""
+        frames, numerators, denominators = self.sensors[sensor]
+        return (frames + numerators / denominators) * self.milliseconds_per_frame / 1000.0
+
+    def steps(self):
+        """Every time some sensor needs the scene, in order; all other frames are skipped."""
+        steps = {}
+        for sensor, (frames, numerators, denominators) in self.sensors.items():
+            for key in zip(frames.tolist(), numerators.tolist(), denominators.tolist()):
+                steps.setdefault(key, []).append(sensor)
+        for (frame, numerator, denominator), sensors in sorted(steps.items(),
+                                                               key=lambda item: (item[0][0], item[0][1] / item[0][2])):
+            subframe = numerator / denominator
+            yield Step(frame, subframe, (frame + subframe) * self.milliseconds_per_frame / 1000.0, sensors)
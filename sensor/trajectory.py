@@ -0,0 +1,102 @@
+from pathlib import Path
+
+import numpy as np
+
+from sensor.pose import interpolate_poses, matrix_quaternions
+
+
+class PoseTable:
+    """Timestamped world poses of the sensor objects of one simulation.
+
+    The scene is evaluated once per needed time and every sensor object's `matrix_world` is
+    recorded; IMUs, sweep interpolation and the ground truth export read from here instead of
+    evaluating the scene again. A later record for the same object and time replaces the
+    earlier one.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.samples = {}
+        self._arrays = {}
+
+    def record(self, name, time, matrix):
+        self.samples.setdefault(name, {})[float(time)] = np.array(matrix, dtype=np.float64)
+        self._arrays.pop(name, None)
+
+    @property
+    def names(self):
+        return list(self.samples)
+
+    def __contains__(self, name):
+        return name in self.samples
+
+    def trajectory(self, name):
+        """Times (T,), positions (T,3) and quaternions (T,4) as w, x, y, z of `name`, in time order."""
+        if name not in self._arrays:
+            samples = self.samples[name]
+            times = np.array(sorted(samples))
+            matrices = np.array([samples[time] for time in times.tolist()])
+            self._arrays[name] = (times, matrices[:, :3, 3], matrix_quaternions(matrices[:, :3, :3]))
+        return self._arrays[name]
+
+    def covers(self, name, start, end):
+        if name not in self.samples:
+            return False
+        times = self.trajectory(name)[0]
+        return times[0] <= start and times[-1] >= end
+
+    def matrix_at(self, name, time, max_gap=np.inf):
+        """4x4 world matrix of `name` at `time`, interpolated between the recorded poses around
+        it; None outside the recorded range or when they are more than `max_gap` apart."""
+        if name not in self.samples:
+            return None
+        samples = self.samples[name]
+        times = self.trajectory(name)[0]
+        after = np.searchsorted(times, time, side='left')
+        if after == len(times):
+            return None
+        if times[after] == time:
+            return samples[times[after]].copy()
+        if after == 0 or times[after] - times[after - 1] > max_gap:
+            return None
+
+        before_time, after_time = times[after - 1], times[after]
+        weight = (time - before_time) / (after_time - before_time)
+        rotations, translations = interpolate_poses(samples[before_time], samples[after_time], [weight])
+        matrix = np.eye(4)
+        matrix[:3, :3] = rotations[0]
+        matrix[:3, 3] = translations[0]
+        return matrix
+
+    def export(self, folder):
+        """Writes one `<name>.txt` per object in TUM format: time x y z qx qy qz qw."""
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        for name in self.samples:
+            times, positions, quaternions = self.trajectory(name)
+            rows = np.column_stack((times, positions, quaternions[:, 1:], quaternions[:, :1]))
+            np.savetxt(folder / f"{name}.txt", rows, fmt="%.9f", header="time x y z qx qy qz qw")
+
+
+# poses of the running simulation, shared by all sensors
+sensor_poses = PoseTable()
+# poses of every scanner at its own scans only, where its next sweep starts; they do not
+# depend on the other sensors, so any frame range of a simulation reproduces them
+scan_poses = PoseTable()
+
+
+def merge_pose_files(sources, target):
+    """Joins the `<name>.txt` pose files of the `sources` folders into `target`, keeping the
+    first row of every time."""
+    rows = {}
+    for source in sources:
+        for path in sorted(Path(source).glob("*.txt")):
+            rows.setdefault(path.stem, []).append(np.loadtxt(path, ndmin=2))
+    target = Path(target)
+    target.mkdir(parents=True, exist_ok=True)
+    for name, tables in rows.items():
+        table = np.concatenate(tables)
+        _, first = np.unique(table[:, 0], return_index=True)
+        np.savetxt(target / f"{name}.txt", table[first], fmt="%.9f", header="time x y z qx qy qz qw")
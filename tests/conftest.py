@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the tests import the addon's modules the way benchmarks/bench.py does, without Blender
+sys.path.append(str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,60 @@
+import numpy as np
+
+from sensor.models.lidar.lidar_functionality import (frame_rng, livox_mid_40, normalize_directions, scanner_points,
+                                                     scanner_rays)
+from sensor.registry import lidar_models
+
+
+def scaled_scanner():
+    angle = np.radians(30)
+    rotation = np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation @ np.diag([2.0, 0.5, 3.0])
+    matrix[:3, 3] = [1.0, -2.0, 0.5]
+    return matrix
+
+
+def test_scaled_scanner_casts_its_matrix_applied_to_the_pattern():
+    matrix = scaled_scanner()
+    directions = normalize_directions(np.random.default_rng(0).normal(size=(50, 3)))
+    rotation = matrix[:3, :3] / np.linalg.norm(matrix[:3, :3], axis=0)
+
+    expected = normalize_directions(directions @ matrix[:3, :3].T)
+    assert np.allclose(normalize_directions(scanner_rays(directions, matrix) @ rotation.T), expected, atol=1e-6)
+
+
+def test_scaled_scanner_points_are_the_inverse_world_matrix_of_the_hits():
+    matrix = scaled_scanner()
+    rng = np.random.default_rng(1)
+    directions = normalize_directions(rng.normal(size=(50, 3)))
+    distances = rng.uniform(1.0, 100.0, size=50)
+
+    world_directions = normalize_directions(directions @ matrix[:3, :3].T)
+    hits = matrix[:3, 3] + world_directions * distances[:, None]
+    expected = (np.linalg.inv(matrix) @ np.column_stack([hits, np.ones(50)]).T).T[:, :3]
+    assert np.allclose(scanner_points(directions, matrix, distances), expected, rtol=1e-4, atol=1e-4)
+
+
+def test_unit_scale_scanner_points_lie_at_the_hit_distance():
+    directions = normalize_directions(np.random.default_rng(2).normal(size=(20, 3)))
+    points = scanner_points(directions, np.eye(4), np.full(20, 7.0))
+    assert np.allclose(np.linalg.norm(points, axis=1), 7.0, atol=1e-5)
+
+
+def livox_parameters(**overrides):
+    parameters = lidar_models()["livox_mid40"]["parameters"]
+    return {**{name: info["default"] for name, info in parameters.items()}, **overrides}
+
+
+def test_livox_pattern_at_negative_frames_is_seeded_per_frame():
+    parameters = livox_parameters()
+    pattern = livox_mid_40(-3, parameters)
+    assert pattern.shape[1] == 3 and np.isfinite(pattern).all()
+    assert np.array_equal(pattern, livox_mid_40(-3, parameters))
+    assert not np.array_equal(pattern, livox_mid_40(-4, parameters))
+
+
+def test_frame_rng_keeps_the_streams_of_non_negative_frames():
+    expected = np.random.default_rng([7, 12]).random(4)
+    assert np.array_equal(frame_rng(12, {"seed": 7}).random(4), expected)
+    frame_rng(-1, {"seed": -7}).random(4)
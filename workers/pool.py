@@ -0,0 +1,65 @@
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def frame_range(text):
+    """Parses "first-last" or a single frame into an inclusive range."""
+    start, _, end = text.partition("-")
+    return range(int(start), int(end or start) + 1)
+
+
+def split(items, shards):
+    """Splits `items` into at most `shards` contiguous, non-empty, nearly equal parts."""
+    items = list(items)
+    shards = max(1, min(shards, len(items)))
+    size, extra = divmod(len(items), shards)
+    parts = []
+    start = 0
+    for shard in range(shards):
+        end = start + size + (shard < extra)
+        parts.append(items[start:end])
+        start = end
+    return [part for part in parts if part]
+
+
+def blender_command(blender, blend_file, script, arguments, threads=0):
+    """Command line of a background Blender running `script` on `blend_file`.
+
+    `threads` limits the render and simulation threads of the worker, 0 uses all cores.
+    """
+    command = [str(blender), "--background", str(blend_file)]
+    if threads:
+        command += ["--threads", str(threads)]
+    return command + ["--python", str(script), "--"] + [str(argument) for argument in arguments]
+
+
+def run_commands(commands, workers, log_folder):
+    """Runs the commands on a pool of `workers` processes, each writing `<log_folder>/worker-NNNN.log`.
+
+    Queued commands start as soon as a worker is free. Raises RuntimeError listing the
+    failed commands' logs once all of them have finished.
+    """
+    log_folder = Path(log_folder)
+    log_folder.mkdir(parents=True, exist_ok=True)
+
+    def run(indexed):
+        index, command = indexed
+        log_path = log_folder / f"worker-{index:04d}.log"
+        logger.info("Starting worker %d: %s", index, " ".join(command))
+        with open(log_path, 'w') as log:
+            # Blender exits with 0 on script errors unless told otherwise
+            returncode = subprocess.call(command[:1] + ["--python-exit-code", "1"] + command[1:],
+                                         stdout=log, stderr=subprocess.STDOUT)
+        logger.info("Worker %d finished with %d", index, returncode)
+        return log_path, returncode
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(run, enumerate(commands)))
+
+    failed = [str(log_path) for log_path, returncode in results if returncode != 0]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(commands)} workers failed, see {', '.join(failed)}")